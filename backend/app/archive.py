@@ -0,0 +1,298 @@
+"""Compressed columnar archive for cold location history.
+
+Closed vehicle-days are copied out of `locations` into one file each,
+ARCHIVE_DIR/<vehicle_id>/<year>/<YYYY-MM-DD>.gpsa. Time (microseconds),
+latitude/longitude (1e-7 degrees), speed (0.01 km/h) and the dwell span and
+sample count of compacted rows are stored as fixed-point integers, delta-encoded in the narrowest integer type that
+fits, and zlib-compressed when that is smaller. A moving vehicle costs a
+few bytes per point and a parked one almost nothing.
+
+File layout, with every block aligned to 8 bytes so raw columns can be
+read straight from a memory map:
+
+    b'GPSA' | uint32 header length | JSON header | column blocks
+
+Reads are transparent: the part of a window older than the vehicle's
+oldest row still in `locations` is served from the archive. Retention can
+then drop hot partitions without losing history.
+"""
+from datetime import datetime, timedelta
+import json
+import mmap
+import os
+import shutil
+import struct
+import zlib
+
+import numpy as np
+from flask import current_app
+
+from app.models import db, Location, LocationArchiveDay
+
+MAGIC = b'GPSA'
+FORMAT_VERSION = 2
+COLUMNS = (
+    ('time', 1),           # microseconds since the epoch
+    ('latitude', 1e7),
+    ('longitude', 1e7),
+    ('speed', 100),
+    ('dwell', 1),          # microseconds from time to dwell_until, 0 for plain rows
+    ('samples', 1),
+)
+# Columns added after version 1 and their value in older files
+COLUMN_DEFAULTS = {'dwell': 0, 'samples': 1}
+INT_TYPES = ('<i1', '<i2', '<i4', '<i8')
+EPOCH = np.datetime64(0, 'us')
+
+def archive_path(vehicle_id, day):
+    return os.path.join(current_app.config['ARCHIVE_DIR'], str(vehicle_id), f'{day:%Y}', f'{day:%Y-%m-%d}.gpsa')
+
+def encode_day(columns):
+    """Encode a dict of equal-length int64 arrays into archive file bytes."""
+    count = len(columns['time'])
+    specs = []
+    blocks = []
+    offset = 0
+    for name, scale in COLUMNS:
+        values = columns[name]
+        deltas = np.diff(values)
+        dtype = _narrowest(deltas)
+        raw = deltas.astype(dtype).tobytes()
+        packed = zlib.compress(raw, 6)
+        codec = 'zlib' if len(packed) < len(raw) else 'raw'
+        block = packed if codec == 'zlib' else raw
+        specs.append({
+            'name': name, 'scale': scale, 'first': int(values[0]) if count else 0,
+            'dtype': dtype, 'codec': codec, 'offset': offset, 'length': len(block)
+        })
+        blocks.append(block + b'\0' * (-len(block) % 8))
+        offset += len(blocks[-1])
+
+    header = json.dumps({'version': FORMAT_VERSION, 'count': count, 'columns': specs}).encode()
+    header += b' ' * (-(len(header) + 8) % 8)
+    return MAGIC + struct.pack('<I', len(header)) + header + b''.join(blocks)
+
+def decode_day(buffer):
+    """Decode archive bytes (or a memory map) into a dict of int64 arrays."""
+    if bytes(buffer[:4]) != MAGIC:
+        raise ValueError('Not a location archive file')
+    header_length, = struct.unpack('<I', bytes(buffer[4:8]))
+    header = json.loads(bytes(buffer[8:8 + header_length]))
+    if header['version'] > FORMAT_VERSION:
+        raise ValueError(f"Unsupported archive version {header['version']}")
+
+    base = 8 + header_length
+    count = header['count']
+    columns = {}
+    for spec in header['columns']:
+        start = base + spec['offset']
+        if spec['codec'] == 'zlib':
+            deltas = np.frombuffer(zlib.decompress(memoryview(buffer)[start:start + spec['length']]), dtype=spec['dtype'])
+        else:
+            deltas = np.frombuffer(buffer, dtype=spec['dtype'], count=max(count - 1, 0), offset=start)
+        values = np.empty(count, dtype=np.int64)
+        if count:
+            values[0] = spec['first']
+            np.cumsum(deltas, dtype=np.int64, out=values[1:])
+            values[1:] += spec['first']
+        columns[spec['name']] = values
+    for name, default in COLUMN_DEFAULTS.items():
+        if name not in columns:
+            columns[name] = np.full(count, default, dtype=np.int64)
+    return columns
+
+def read_day_file(path):
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        return decode_day(mapped)
+
+def to_fixed(timestamps, latitudes, longitudes, speeds, dwell_until, sample_counts):
+    times = np.asarray(timestamps, dtype='datetime64[us]')
+    dwell = (np.asarray(dwell_until, dtype='datetime64[us]') - times).astype('timedelta64[us]').astype(np.int64)
+    dwell[np.isnat(np.asarray(dwell_until, dtype='datetime64[us]'))] = 0
+    return {
+        'time': (times - EPOCH).astype(np.int64),
+        'latitude': np.round(np.asarray(latitudes, dtype=np.float64) * 1e7).astype(np.int64),
+        'longitude': np.round(np.asarray(longitudes, dtype=np.float64) * 1e7).astype(np.int64),
+        'speed': np.round(np.asarray(speeds, dtype=np.float64) * 100).astype(np.int64),
+        'dwell': dwell,
+        'samples': np.asarray(sample_counts, dtype=np.int64),
+    }
+
+def from_fixed(columns):
+    """Return (timestamps, latitudes, longitudes, speeds, dwell_until, sample_counts) arrays.
+
+    dwell_until is NaT for rows that are not compacted.
+    """
+    timestamps = EPOCH + columns['time'].astype('timedelta64[us]')
+    dwell_until = timestamps + columns['dwell'].astype('timedelta64[us]')
+    dwell_until[columns['dwell'] == 0] = np.datetime64('NaT')
+    return (
+        timestamps,
+        columns['latitude'] / 1e7,
+        columns['longitude'] / 1e7,
+        columns['speed'] / 100,
+        dwell_until,
+        columns['samples']
+    )
+
+def read_archive(vehicle_id, start, end=None):
+    """Archived points in [start, end) older than the vehicle's oldest hot row.
+
+    Returns one from_fixed() tuple of arrays per archived day, oldest first;
+    empty when nothing in the window is archived.
+    """
+    query = db.select(LocationArchiveDay.day).where(
+        LocationArchiveDay.vehicle_id == vehicle_id,
+        LocationArchiveDay.day > start - timedelta(days=1)
+    )
+    if end is not None:
+        query = query.where(LocationArchiveDay.day < end)
+    days = db.session.execute(query.order_by(LocationArchiveDay.day.asc())).scalars().all()
+    if not days:
+        return []
+
+    hot_start = db.session.execute(db.select(db.func.min(Location.timestamp)).where(
+        Location.vehicle_id == vehicle_id,
+        Location.timestamp >= start
+    )).scalar()
+    stop = hot_start if end is None else min(end, hot_start or end)
+
+    low = np.datetime64(start, 'us')
+    high = np.datetime64(stop, 'us') if stop is not None else None
+    pieces = []
+    for day in days:
+        if stop is not None and day >= stop:
+            break
+        columns = from_fixed(read_day_file(archive_path(vehicle_id, day)))
+        keep = (columns[0] >= low) | (columns[4] >= low)
+        if high is not None:
+            keep &= columns[0] < high
+        if keep.any():
+            pieces.append(tuple(column[keep] for column in columns))
+    return pieces
+
+def archive_locations(before):
+    """Archive closed vehicle-days before `before` that are new or have changed.
+
+    Days are found in `locations` itself, so rows that never got an hourly
+    rollup are archived too. A day is (re)written when its point count
+    differs from what was archived; late points are merged with the
+    existing file. Returns the number of days written.
+    """
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    before = min(before.replace(hour=0, minute=0, second=0, microsecond=0), today)
+
+    # Only rows that retention is about to remove are scanned
+    location_day = db.func.date(Location.timestamp)
+    counts = {}
+    for vehicle_id, date, count in db.session.execute(db.select(
+        Location.vehicle_id, location_day, db.func.sum(db.func.coalesce(Location.sample_count, 1))
+    ).where(Location.timestamp < before).group_by(Location.vehicle_id, location_day)):
+        counts[(vehicle_id, datetime.fromisoformat(str(date)))] = count
+
+    written = 0
+    for vehicle_id in sorted({vehicle_id for vehicle_id, _ in counts}):
+        days = sorted(d for v, d in counts if v == vehicle_id)
+        archived = dict(db.session.execute(db.select(LocationArchiveDay.day, LocationArchiveDay.point_count).where(
+            LocationArchiveDay.vehicle_id == vehicle_id,
+            LocationArchiveDay.day.in_(days)
+        )).all())
+        for day in days:
+            if archived.get(day) != counts[(vehicle_id, day)]:
+                written += archive_day(vehicle_id, day)
+    return written
+
+def archive_boundary(vehicle_id):
+    """Time before which read_archive() serves the vehicle's history, or None when nothing is archived.
+
+    That is the oldest row still in `locations`, or the end of the newest
+    archived day once every row has been pruned.
+    """
+    newest = db.session.execute(
+        db.select(db.func.max(LocationArchiveDay.day)).where(LocationArchiveDay.vehicle_id == vehicle_id)
+    ).scalar()
+    if newest is None:
+        return None
+    oldest = db.session.execute(
+        db.select(db.func.min(Location.timestamp)).where(Location.vehicle_id == vehicle_id)
+    ).scalar()
+    return oldest or newest + timedelta(days=1)
+
+def archived_timestamps(vehicle_id, start, end):
+    """Set of the times of archived rows in [start, end]."""
+    days = db.session.execute(db.select(LocationArchiveDay.day).where(
+        LocationArchiveDay.vehicle_id == vehicle_id,
+        LocationArchiveDay.day > start - timedelta(days=1),
+        LocationArchiveDay.day <= end
+    )).scalars().all()
+    found = set()
+    for day in days:
+        times = EPOCH + read_day_file(archive_path(vehicle_id, day))['time'].astype('timedelta64[us]')
+        times = times[(times >= np.datetime64(start, 'us')) & (times <= np.datetime64(end, 'us'))]
+        found.update(times.astype(datetime).tolist())
+    return found
+
+def archive_day(vehicle_id, day, rows=None):
+    """Write a vehicle-day to its archive file, merged with what the file already holds.
+
+    rows are (timestamp, latitude, longitude, speed, dwell_until,
+    sample_count) tuples; by default the day's rows in `locations`.
+    Returns the number of files written.
+    """
+    if rows is None:
+        rows = db.session.execute(db.select(
+            Location.timestamp, Location.latitude, Location.longitude, Location.speed,
+            Location.dwell_until, Location.sample_count
+        ).where(
+            Location.vehicle_id == vehicle_id,
+            Location.timestamp >= day,
+            Location.timestamp < day + timedelta(days=1)
+        )).all()
+    if not rows:
+        return 0
+
+    timestamps, latitudes, longitudes, speeds, dwell_until, sample_counts = zip(*rows)
+    columns = to_fixed(timestamps, latitudes, longitudes, [s or 0.0 for s in speeds], dwell_until,
+                       [c or 1 for c in sample_counts])
+
+    path = archive_path(vehicle_id, day)
+    entry = db.session.get(LocationArchiveDay, (vehicle_id, day))
+    if entry is not None and os.path.exists(path):
+        existing = read_day_file(path)
+        columns = {name: np.concatenate([existing[name], columns[name]]) for name, _ in COLUMNS}
+
+    # Sort by time and drop points present both in the file and in `locations`
+    stacked = np.unique(np.stack([columns[name] for name, _ in COLUMNS], axis=1), axis=0)
+    columns = {name: stacked[:, i].copy() for i, (name, _) in enumerate(COLUMNS)}
+
+    data = encode_day(columns)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp = f'{path}.tmp'
+    with open(temp, 'wb') as f:
+        f.write(data)
+    os.replace(temp, path)
+
+    if entry is None:
+        entry = LocationArchiveDay(vehicle_id=vehicle_id, day=day)
+        db.session.add(entry)
+    first, last = (EPOCH + np.array([columns['time'][0], columns['time'][-1] + columns['dwell'][-1]]).astype('timedelta64[us]')).astype(datetime).tolist()
+    entry.point_count = int(columns['samples'].sum())
+    entry.first_timestamp = first
+    entry.last_timestamp = last
+    entry.size_bytes = len(data)
+    entry.archived_at = datetime.utcnow()
+    db.session.commit()
+    return 1
+
+def delete_vehicle_archive(vehicle_id):
+    shutil.rmtree(os.path.join(current_app.config['ARCHIVE_DIR'], str(vehicle_id)), ignore_errors=True)
+
+def _narrowest(values):
+    if not len(values):
+        return INT_TYPES[0]
+    low, high = int(values.min()), int(values.max())
+    for dtype in INT_TYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return dtype
+    return INT_TYPES[-1]
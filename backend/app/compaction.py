@@ -0,0 +1,168 @@
+"""Stationary ping compaction at ingest.
+
+With LOCATION_COMPACTION on, consecutive zero-speed pings within
+COMPACTION_RADIUS_M of the first one are folded into that row: it keeps its
+position and timestamp and gains `dwell_until` (the last sample's time) and
+`sample_count`. Folded pings are snapped to the row's position before stops,
+rollups and geofences see them, so stats computed from the stored rows match
+the rollups exactly. They do not match an uncompacted track of the same
+pings: the jitter distance and jitter-driven moving time of parked runs are
+dropped (see stats.format_stats).
+
+A run never crosses an hour boundary or a gap longer than the stats
+sampling gap limit, which lets readers expand it back into
+`sample_count` evenly spaced samples without changing any hourly total.
+"""
+from datetime import timedelta
+import threading
+
+import numpy as np
+
+from app.geo import calculate_distance
+from app.models import db, Location
+
+MAX_RUN = timedelta(hours=1)
+
+class OpenRun:
+    __slots__ = ('timestamp', 'latitude', 'longitude', 'speed', 'last_at', 'count', 'row')
+
+    def __init__(self, timestamp, latitude, longitude, speed, last_at=None, count=1, row=None):
+        self.timestamp = timestamp
+        self.latitude = latitude
+        self.longitude = longitude
+        self.speed = speed or 0.0
+        self.last_at = last_at or timestamp
+        self.count = count or 1
+        # The pending insert dict while the run's row is not yet written
+        self.row = row
+
+class LocationCompactor:
+    def __init__(self, radius_m, max_gap_seconds):
+        self.radius_km = radius_m / 1000
+        self.max_gap_seconds = max_gap_seconds
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def compact(self, rows):
+        """Fold stationary pings of time-ordered rows into open runs.
+
+        Returns the rows that still need inserting; runs that started in an
+        earlier batch are extended with an UPDATE.
+        """
+        stored = []
+        extended = {}
+        checked = set()
+        with self._lock:
+            for row in rows:
+                vehicle_id = row['vehicle_id']
+                row['dwell_until'] = None
+                row['sample_count'] = 1
+
+                if self._stationary(row) and vehicle_id not in checked:
+                    checked.add(vehicle_id)
+                    if vehicle_id not in self._runs:
+                        self._load(vehicle_id)
+
+                run = self._runs.get(vehicle_id)
+                if run is not None and row['timestamp'] <= run.last_at:
+                    # Late point: store it as is and keep the run open
+                    stored.append(row)
+                    continue
+
+                if run is not None and self._extends(run, row):
+                    row['latitude'] = run.latitude
+                    row['longitude'] = run.longitude
+                    run.last_at = row['timestamp']
+                    run.count += 1
+                    if run.row is not None:
+                        run.row['dwell_until'] = run.last_at
+                        run.row['sample_count'] = run.count
+                    else:
+                        extended[vehicle_id] = run
+                    continue
+
+                stored.append(row)
+                self._runs[vehicle_id] = OpenRun(
+                    row['timestamp'], row['latitude'], row['longitude'], row['speed'], row=row
+                )
+
+            for run in self._runs.values():
+                run.row = None
+
+        for vehicle_id, run in extended.items():
+            db.session.execute(db.update(Location).where(
+                Location.vehicle_id == vehicle_id,
+                Location.timestamp == run.timestamp
+            ).values(dwell_until=run.last_at, sample_count=run.count))
+        return stored
+
+    def invalidate(self, vehicle_id=None):
+        with self._lock:
+            if vehicle_id is None:
+                self._runs.clear()
+            else:
+                self._runs.pop(vehicle_id, None)
+
+    def _stationary(self, row):
+        return not row['speed']
+
+    def _extends(self, run, row):
+        return (
+            self._stationary(row) and not run.speed
+            and row['timestamp'].replace(minute=0, second=0, microsecond=0) == run.timestamp.replace(minute=0, second=0, microsecond=0)
+            and (row['timestamp'] - run.last_at).total_seconds() <= self.max_gap_seconds
+            and calculate_distance(run.latitude, run.longitude, row['latitude'], row['longitude']) <= self.radius_km
+        )
+
+    def verify(self, vehicle_id, last_at):
+        """Drop the vehicle's open run unless it ends at the last stored position, last_at.
+
+        Another worker, or a rolled-back batch, may have changed the track
+        since this process last saw it. Call before compacting a batch.
+        """
+        with self._lock:
+            run = self._runs.get(vehicle_id)
+            if run is not None and run.last_at != last_at:
+                del self._runs[vehicle_id]
+
+    def _load(self, vehicle_id):
+        latest = db.session.execute(db.select(
+            Location.timestamp, Location.latitude, Location.longitude, Location.speed,
+            Location.dwell_until, Location.sample_count
+        ).where(Location.vehicle_id == vehicle_id).order_by(Location.timestamp.desc()).limit(1)).first()
+        if latest is not None:
+            self._runs[vehicle_id] = OpenRun(*latest)
+
+def covers(start):
+    """Condition for rows whose samples may fall at or after start.
+
+    Runs never exceed MAX_RUN, so the timestamp bound keeps the index range.
+    """
+    return db.and_(
+        Location.timestamp >= start - MAX_RUN,
+        db.or_(Location.timestamp >= start, Location.dwell_until >= start)
+    )
+
+def expand_row(timestamp, latitude, longitude, speed, dwell_until=None, sample_count=None):
+    """Yield (timestamp, latitude, longitude, speed) for every sample of a stored row."""
+    count = sample_count or 1
+    if count == 1 or dwell_until is None:
+        yield timestamp, latitude, longitude, speed
+        return
+    span = (dwell_until - timestamp) // timedelta(microseconds=1)
+    for k in range(count):
+        yield timestamp + timedelta(microseconds=span * k // (count - 1)), latitude, longitude, speed
+
+def expand_arrays(timestamps, latitudes, longitudes, speeds, dwell_until, sample_counts):
+    """Vectorized expand_row over columns; dwell_until uses NaT for plain rows."""
+    counts = np.maximum(sample_counts, 1)
+    if not len(counts) or (counts == 1).all():
+        return timestamps, latitudes, longitudes, speeds
+
+    index = np.repeat(np.arange(len(counts)), counts)
+    position = np.arange(len(index)) - np.repeat(np.cumsum(counts) - counts, counts)
+    span = (dwell_until - timestamps).astype('timedelta64[us]').astype(np.int64)
+    span[np.isnat(dwell_until)] = 0
+    offsets = span[index] * position // np.maximum(counts - 1, 1)[index]
+    expanded = timestamps[index] + offsets.astype('timedelta64[us]')
+    return expanded, latitudes[index], longitudes[index], speeds[index]
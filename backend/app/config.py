@@ -7,6 +7,18 @@ class Config:
     # Database
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Pool per worker process: one connection per server thread plus the
+    # ingest writer; pre-ping drops connections the server has closed
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_pre_ping': True,
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),  # seconds
+    }
+    if (SQLALCHEMY_DATABASE_URI or '').startswith('postgresql'):
+        SQLALCHEMY_ENGINE_OPTIONS.update({
+            'pool_size': int(os.getenv('DB_POOL_SIZE', 8)),
+            'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 4)),
+            'pool_timeout': int(os.getenv('DB_POOL_TIMEOUT', 10)),
+        })
     
     # Security
     SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key')
@@ -20,3 +32,40 @@ class Config:
     
     # CORS
     CORS_ORIGINS = os.getenv('CORS_ORIGINS', 'http://localhost:3000')
+    
+    # Geocoding
+    GEOCODER_PROVIDER = os.getenv('GEOCODER_PROVIDER', 'nominatim')  # 'nominatim' or 'stub'
+    GEOCODER_STUB_FILE = os.getenv('GEOCODER_STUB_FILE')
+    GEOCODE_CACHE_TTL = int(os.getenv('GEOCODE_CACHE_TTL', 30 * 86400))  # seconds
+    GEOCODE_MEMORY_ENTRIES = int(os.getenv('GEOCODE_MEMORY_ENTRIES', 1000))
+    
+    # Per-worker cache of serialized read responses (vehicles, places, history, saved locations)
+    RESPONSE_CACHE_ENTRIES = int(os.getenv('RESPONSE_CACHE_ENTRIES', 256))  # 0 disables it
+    RESPONSE_CACHE_MB = int(os.getenv('RESPONSE_CACHE_MB', 64))
+    
+    # /api/metrics: scrapers send 'Authorization: Bearer <METRICS_TOKEN>'; without
+    # a token only logged-in users can read it. Workers of one server share METRICS_DIR.
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+    METRICS_DIR = os.getenv('METRICS_DIR')
+    
+    # GPS ingest: 'sync' commits on the request thread, 'async' queues points
+    # for a background writer and answers 202 immediately
+    INGEST_MODE = os.getenv('INGEST_MODE', 'sync')
+    INGEST_QUEUE_SIZE = int(os.getenv('INGEST_QUEUE_SIZE', 10000))
+    INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', 500))
+    INGEST_FLUSH_MS = int(os.getenv('INGEST_FLUSH_MS', 200))
+    # Each open /api/stream holds a server thread; past this many per worker
+    # new streams get 503 so requests always have threads left
+    LIVE_STREAMS_PER_WORKER = int(os.getenv('LIVE_STREAMS_PER_WORKER') or max(1, int(os.getenv('GUNICORN_THREADS', 8)) // 2))
+    # Fold consecutive zero-speed pings within this radius into one row
+    LOCATION_COMPACTION = os.getenv('LOCATION_COMPACTION', 'false').lower() == 'true'
+    COMPACTION_RADIUS_M = float(os.getenv('COMPACTION_RADIUS_M', 15))
+    
+    # Locations storage: 'month', 'day' or 'none' range partitions (PostgreSQL only)
+    LOCATIONS_PARTITION_INTERVAL = os.getenv('LOCATIONS_PARTITION_INTERVAL', 'month')
+    LOCATIONS_PARTITIONS_AHEAD_DAYS = int(os.getenv('LOCATIONS_PARTITIONS_AHEAD_DAYS', 60))
+    LOCATIONS_RETENTION_DAYS = int(os.getenv('LOCATIONS_RETENTION_DAYS', 0))  # 0 keeps everything
+    
+    # Cold history archive (one compressed file per vehicle-day)
+    ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', os.path.join(os.getcwd(), 'archive'))
+    ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 7))
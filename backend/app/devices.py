@@ -0,0 +1,59 @@
+"""Process-local device_id -> vehicle registry for the ingest path.
+
+The whole vehicle table is small and rarely changes, so each worker keeps it
+in memory. Vehicle writes bump the vehicles version counter; the registry
+compares it at most every VERSION_CHECK_SECONDS and reloads on change.
+"""
+from collections import namedtuple
+import threading
+import time
+
+from app.models import db, Vehicle
+from app.versions import get_version
+
+VEHICLES_VERSION = 'vehicles'
+VERSION_CHECK_SECONDS = 5
+
+DeviceEntry = namedtuple('DeviceEntry', ['vehicle_id', 'name', 'is_active'])
+
+class DeviceRegistry:
+    def __init__(self):
+        self._devices = None
+        self._version = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def get(self, device_id):
+        """Return the DeviceEntry for device_id, or None if it is unknown."""
+        return self._current().get(device_id)
+
+    def load(self):
+        with self._lock:
+            self._reload(get_version(VEHICLES_VERSION))
+
+    def invalidate(self):
+        with self._lock:
+            self._devices = None
+
+    def _current(self):
+        devices = self._devices
+        if devices is not None and time.monotonic() - self._checked_at < VERSION_CHECK_SECONDS:
+            return devices
+
+        with self._lock:
+            version = get_version(VEHICLES_VERSION)
+            if self._devices is None or version != self._version:
+                self._reload(version)
+            self._checked_at = time.monotonic()
+            return self._devices
+
+    def _reload(self, version):
+        rows = db.session.execute(db.select(Vehicle.device_id, Vehicle.id, Vehicle.name, Vehicle.is_active)).all()
+        self._devices = {
+            device_id: DeviceEntry(vehicle_id, name, is_active is not False)
+            for device_id, vehicle_id, name, is_active in rows
+        }
+        self._version = version
+        self._checked_at = time.monotonic()
+
+device_registry = DeviceRegistry()
@@ -0,0 +1,192 @@
+"""Streaming exporters for location history.
+
+Rows are read through a server-side cursor in chunks of EXPORT_CHUNK_SIZE and
+written out as they arrive, so memory use does not depend on export size.
+Archived days are streamed first, one day at a time.
+"""
+import csv
+from datetime import datetime
+import io
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+
+from app.archive import read_archive
+from app.compaction import expand_row
+from app.fastjson import dumps
+from app.models import db, Location
+from app.pagination import seek
+
+EXPORT_CHUNK_SIZE = 2000
+
+LOCATION_FIELDS = ('timestamp', 'latitude', 'longitude', 'speed', 'dwell_until', 'sample_count')
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'json': ('application/json', 'json'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'gpx': ('application/gpx+xml', 'gpx'),
+}
+
+def iter_locations(vehicle_id, start, end=None):
+    """Yield chunks of (timestamp, latitude, longitude, speed, dwell_until, sample_count) rows."""
+    for timestamps, latitudes, longitudes, speeds, dwell_until, sample_counts in read_archive(vehicle_id, start, end):
+        for i in range(0, len(timestamps), EXPORT_CHUNK_SIZE):
+            window = slice(i, i + EXPORT_CHUNK_SIZE)
+            yield list(zip(
+                timestamps[window].astype(datetime).tolist(),
+                latitudes[window].tolist(),
+                longitudes[window].tolist(),
+                speeds[window].tolist(),
+                dwell_until[window].astype(datetime).tolist(),
+                sample_counts[window].tolist()
+            ))
+
+    query = db.select(
+        Location.timestamp, Location.latitude, Location.longitude, Location.speed,
+        Location.dwell_until, Location.sample_count
+    ).where(
+        Location.vehicle_id == vehicle_id,
+        Location.timestamp >= start
+    )
+    if end is not None:
+        query = query.where(Location.timestamp < end)
+    query = query.order_by(Location.timestamp.asc())
+
+    result = db.session.execute(query.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+    for chunk in result.partitions():
+        yield chunk
+
+def location_page(vehicle_id, start, end, limit, after=None):
+    """One page of stored rows in time order, after an optional (timestamp, id) position.
+
+    Returns (rows, position of the last row, or None on the last page).
+    Archived rows have no id; they are told apart by their order among rows
+    with the same timestamp, which never collide with hot rows.
+    """
+    low = start if after is None else max(start, after[0])
+    rows = []
+    positions = []
+    for timestamps, latitudes, longitudes, speeds, dwell_until, sample_counts in read_archive(vehicle_id, low, end):
+        first = np.r_[True, timestamps[1:] != timestamps[:-1]]
+        starts = np.flatnonzero(first)
+        ranks = np.arange(len(timestamps)) - np.repeat(starts, np.diff(np.r_[starts, len(timestamps)]))
+        keep = timestamps >= np.datetime64(low, 'us')
+        if after is not None:
+            at = np.datetime64(after[0], 'us')
+            keep &= (timestamps > at) | ((timestamps == at) & (ranks > after[1]))
+        indices = np.flatnonzero(keep)[:limit + 1 - len(rows)]
+        times = timestamps[indices].astype(datetime).tolist()
+        rows.extend(zip(
+            times,
+            latitudes[indices].tolist(),
+            longitudes[indices].tolist(),
+            speeds[indices].tolist(),
+            dwell_until[indices].astype(datetime).tolist(),
+            sample_counts[indices].tolist()
+        ))
+        positions.extend(zip(times, ranks[indices].tolist()))
+        if len(rows) > limit:
+            break
+
+    if len(rows) <= limit:
+        query = db.select(
+            Location.id, Location.timestamp, Location.latitude, Location.longitude, Location.speed,
+            Location.dwell_until, Location.sample_count
+        ).where(
+            Location.vehicle_id == vehicle_id,
+            Location.timestamp >= start
+        )
+        if end is not None:
+            query = query.where(Location.timestamp < end)
+        if after is not None:
+            query = query.where(seek(Location.timestamp, Location.id, after, descending=False))
+        query = query.order_by(Location.timestamp.asc(), Location.id.asc()).limit(limit + 1 - len(rows))
+        for row_id, *row in db.session.execute(query):
+            rows.append(tuple(row))
+            positions.append((row[0], row_id))
+
+    if len(rows) <= limit:
+        return rows, None
+    return rows[:limit], positions[limit - 1]
+
+def stream_csv(chunks, dwell_columns=False):
+    """CSV of the rows; with dwell_columns, compacted rows keep their dwell span.
+
+    Without it the header is the plain Timestamp..Speed one and compacted
+    rows are written out as their samples instead.
+    """
+    output = io.StringIO()
+    writer = csv.writer(output)
+    header = ['Timestamp', 'Latitude', 'Longitude', 'Speed']
+    writer.writerow(header + ['Dwell Until', 'Sample Count'] if dwell_columns else header)
+
+    for chunk in chunks:
+        for timestamp, latitude, longitude, speed, dwell_until, sample_count in chunk:
+            if dwell_columns:
+                writer.writerow([
+                    timestamp.isoformat(), latitude, longitude, speed,
+                    dwell_until.isoformat() if dwell_until else '', sample_count or 1
+                ])
+                continue
+            for point in expand_row(timestamp, latitude, longitude, speed, dwell_until, sample_count):
+                writer.writerow([point[0].isoformat(), *point[1:]])
+        yield output.getvalue()
+        output.seek(0)
+        output.truncate()
+
+    yield output.getvalue()
+
+def stream_json(chunks):
+    yield b'['
+    separator = b''
+    for chunk in chunks:
+        if chunk:
+            # Encode the whole chunk as one array and drop its brackets
+            yield separator + dumps([row_dict(row) for row in chunk])[1:-1]
+            separator = b','
+    yield b']'
+
+def stream_ndjson(chunks):
+    for chunk in chunks:
+        yield b''.join(dumps(row_dict(row)) + b'\n' for row in chunk)
+
+def stream_gpx(chunks, name):
+    # GPX speed is in m/s; we store km/h
+    yield ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<gpx version="1.1" creator="GPS-Tracker-App/1.0" xmlns="http://www.topografix.com/GPX/1/1"'
+           ' xmlns:gpxtpx="http://www.garmin.com/xmlschemas/TrackPointExtension/v2">\n'
+           f'<trk><name>{escape(name)}</name><trkseg>\n')
+
+    for chunk in chunks:
+        parts = []
+        for timestamp, latitude, longitude, speed, dwell_until, _ in chunk:
+            parts.append(_trkpt(timestamp, latitude, longitude, speed))
+            if dwell_until:
+                # A compacted stationary run: close it with a point at its last sample
+                parts.append(_trkpt(dwell_until, latitude, longitude, speed))
+        yield ''.join(parts)
+
+    yield '</trkseg></trk>\n</gpx>\n'
+
+def row_dict(row):
+    """JSON record for a location row; datetimes are left to app.fastjson."""
+    timestamp, latitude, longitude, speed, dwell_until, sample_count = row
+    data = {
+        'timestamp': timestamp,
+        'latitude': latitude,
+        'longitude': longitude,
+        'speed': speed
+    }
+    if dwell_until:
+        data['dwell_until'] = dwell_until
+        data['sample_count'] = sample_count
+    return data
+
+def _trkpt(timestamp, latitude, longitude, speed):
+    return (
+        f'<trkpt lat={quoteattr(repr(latitude))} lon={quoteattr(repr(longitude))}>'
+        f'<time>{timestamp.isoformat()}Z</time>'
+        f'<extensions><gpxtpx:TrackPointExtension><gpxtpx:speed>{round((speed or 0.0) / 3.6, 3)}'
+        '</gpxtpx:speed></gpxtpx:TrackPointExtension></extensions></trkpt>\n'
+    )
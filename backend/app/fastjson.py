@@ -0,0 +1,36 @@
+"""JSON encoding for the hot read paths.
+
+Endpoints that return many rows select plain column tuples, build dicts
+straight from them and pass datetimes to the encoder unformatted, so no ORM
+objects are created and no per-row isoformat() runs in Python. orjson
+formats them in C when it is installed; the standard library encoder is the
+fallback. Both write compact JSON with sorted keys, as jsonify does, and
+naive datetimes as isoformat() would.
+"""
+from datetime import datetime
+import json
+
+from flask import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps(obj):
+    """Encode obj to UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'), default=_default).encode()
+
+def json_response(obj, status=200):
+    return Response(dumps(obj), status, mimetype='application/json')
+
+def row_records(rows):
+    """Dicts keyed by column name from SQLAlchemy rows."""
+    return [row._asdict() for row in rows]
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
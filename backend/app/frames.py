@@ -0,0 +1,89 @@
+"""Compact binary ingest frames for trackers.
+
+POST /api/gps (or /api/gps/batch) with Content-Type application/x-gps-frame
+sends one or more frames back to back instead of JSON. A frame carries the
+points of one device, little-endian:
+
+    uint8  version (1)
+    uint8  device_id length, then the device_id in UTF-8
+    uint16 point count
+    int64  time of the first point, milliseconds since the Unix epoch (UTC);
+           0 means the time the server receives the frame
+    count x 14-byte points:
+        int32  milliseconds since the previous point (0 for the first)
+        int32  latitude, 1e-7 degrees
+        int32  longitude, 1e-7 degrees
+        uint16 speed, 0.01 km/h
+
+A single ping from device_1 is 34 bytes against about 100 as JSON. Points
+are unpacked by struct in C, and the device is looked up once per frame
+rather than once per point. The reference encoder for browsers is
+encodeGpsFrame() in mobile/index.html.
+"""
+from datetime import datetime, timedelta
+import struct
+
+FRAME_MIMETYPE = 'application/x-gps-frame'
+FRAME_VERSION = 1
+_COUNT_TIME = struct.Struct('<Hq')
+POINT = struct.Struct('<iiiH')
+EPOCH = datetime(1970, 1, 1)
+MAX_SPEED = 0xFFFF / 100
+
+def encode_frame(device_id, points):
+    """Encode [(timestamp, latitude, longitude, speed)] of one device into a frame.
+
+    Timestamps are naive UTC datetimes, or all None to use the receive time.
+    """
+    device = device_id.encode()
+    if len(device) > 255:
+        raise ValueError('device_id is longer than 255 bytes')
+    if len(points) > 0xFFFF:
+        raise ValueError('Too many points for one frame')
+
+    times = [0 if p[0] is None else (p[0] - EPOCH) // timedelta(milliseconds=1) for p in points]
+    parts = [bytes((FRAME_VERSION, len(device))), device, _COUNT_TIME.pack(len(points), times[0] if times else 0)]
+    previous = times[0] if times else 0
+    try:
+        for time, (_, latitude, longitude, speed) in zip(times, points):
+            parts.append(POINT.pack(time - previous, round(latitude * 1e7), round(longitude * 1e7),
+                                    round(min(max(speed or 0.0, 0.0), MAX_SPEED) * 100)))
+            previous = time
+    except struct.error as e:
+        raise ValueError(f'Point out of range: {e}')
+    return b''.join(parts)
+
+def decode_frames(body, now):
+    """Decode a request body into [(device_id, [(timestamp, latitude, longitude, speed)])].
+
+    Raises ValueError when the body is not a sequence of whole frames.
+    """
+    view = memoryview(body)
+    frames = []
+    offset = 0
+    while offset < len(view):
+        if view[offset] != FRAME_VERSION:
+            raise ValueError(f'Unsupported frame version {view[offset]}')
+        if offset + 2 > len(view):
+            raise ValueError('Truncated frame')
+        start = offset + 2 + view[offset + 1]
+        if start + _COUNT_TIME.size > len(view):
+            raise ValueError('Truncated frame')
+        device_id = bytes(view[offset + 2:start]).decode()
+        count, first = _COUNT_TIME.unpack_from(view, start)
+        start += _COUNT_TIME.size
+        offset = start + count * POINT.size
+        if offset > len(view):
+            raise ValueError('Truncated frame')
+
+        points = []
+        elapsed = 0
+        try:
+            base = EPOCH + timedelta(milliseconds=first) if first else now
+            for delta, latitude, longitude, speed in POINT.iter_unpack(view[start:offset]):
+                elapsed += delta
+                points.append((base + timedelta(milliseconds=elapsed), latitude / 1e7, longitude / 1e7, speed / 100))
+        except OverflowError:
+            raise ValueError('Timestamp out of range')
+        frames.append((device_id, points))
+    return frames
@@ -0,0 +1,139 @@
+"""Geocoding with caching and request coalescing.
+
+Lookups go through an in-memory LRU with TTL, then the geocode_cache table,
+and only then to the configured provider. Concurrent lookups for the same
+normalized query share one provider call.
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import json
+import threading
+import time
+import unicodedata
+import urllib.parse
+import urllib.request
+
+from sqlalchemy.exc import IntegrityError
+
+from app.models import db, GeocodeCacheEntry
+
+class NominatimProvider:
+    url = 'https://nominatim.openstreetmap.org/search'
+    timeout = 5
+
+    def search(self, query):
+        params = urllib.parse.urlencode({'q': query, 'format': 'json', 'limit': 5})
+        req = urllib.request.Request(f'{self.url}?{params}')
+        req.add_header('User-Agent', 'GPS-Tracker-App/1.0')
+
+        with urllib.request.urlopen(req, timeout=self.timeout) as response:
+            data = json.loads(response.read().decode())
+
+        return [{
+            'name': item.get('display_name', ''),
+            'latitude': float(item.get('lat', 0)),
+            'longitude': float(item.get('lon', 0)),
+            'type': item.get('type', ''),
+            'importance': item.get('importance', 0)
+        } for item in data]
+
+class StubProvider:
+    """Serves canned results from a JSON file of {query: [result, ...]}; never touches the network."""
+    timeout = 1
+
+    def __init__(self, path=None):
+        self.results = {}
+        if path:
+            with open(path) as f:
+                self.results = {normalize_query(k): v for k, v in json.load(f).items()}
+
+    def search(self, query):
+        return self.results.get(query, [])
+
+PROVIDERS = {
+    'nominatim': NominatimProvider,
+    'stub': StubProvider,
+}
+
+def normalize_query(query):
+    return ' '.join(unicodedata.normalize('NFKC', query).casefold().split())
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+class Geocoder:
+    def __init__(self, provider, ttl_seconds, memory_entries=1000):
+        self.provider = provider
+        self.ttl_seconds = ttl_seconds
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def search(self, query):
+        key = normalize_query(query)
+
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                self._memory.move_to_end(key)
+                return cached[1]
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            if not flight.done.wait(self.provider.timeout + 5):
+                raise TimeoutError('Timed out waiting for geocode lookup')
+            if flight.error is not None:
+                raise flight.error
+            return flight.results
+
+        try:
+            flight.results = self._load(key)
+            self._remember(key, flight.results)
+            return flight.results
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _load(self, key):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl_seconds)
+        entry = db.session.get(GeocodeCacheEntry, key)
+        if entry is not None and entry.created_at >= cutoff:
+            return json.loads(entry.results)
+
+        results = self.provider.search(key)
+
+        if entry is None:
+            entry = GeocodeCacheEntry(query=key)
+            db.session.add(entry)
+        entry.results = json.dumps(results)
+        entry.created_at = datetime.utcnow()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another worker cached the same query first
+            db.session.rollback()
+        return results
+
+    def _remember(self, key, results):
+        with self._lock:
+            self._memory[key] = (time.monotonic() + self.ttl_seconds, results)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+def create_geocoder(config):
+    provider_cls = PROVIDERS[config['GEOCODER_PROVIDER']]
+    provider = provider_cls(config['GEOCODER_STUB_FILE']) if provider_cls is StubProvider else provider_cls()
+    return Geocoder(provider, config['GEOCODE_CACHE_TTL'], config['GEOCODE_MEMORY_ENTRIES'])
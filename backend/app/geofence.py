@@ -0,0 +1,233 @@
+"""Geofence evaluation at ingest.
+
+Admin-defined circles and polygons, and every place of interest (as a
+circle of PLACE_RADIUS_M), are kept in a grid index. Each ping is tested
+only against the fences registered in its grid cell, and per-vehicle state
+turns those tests into enter, exit and dwell events. That state is read
+back from the latest events, and again whenever the vehicle's last stored
+position is not the last ping this process saw (see verify()).
+"""
+import json
+import threading
+import time
+
+from app.geo import calculate_distance
+from app.models import db, Geofence, GeofenceEvent, PlaceOfInterest, DataVersion
+from app.places import PLACES_VERSION
+from app.spatial import GridIndex
+
+GEOFENCES_VERSION = 'geofences'
+PLACE_RADIUS_M = 100
+PLACE_DWELL_SECONDS = 300
+MAX_DWELL_SECONDS = 7 * 86400
+VERSION_CHECK_SECONDS = 5
+
+class Fence:
+    __slots__ = ('key', 'name', 'latitude', 'longitude', 'radius_m', 'polygon', 'dwell_seconds')
+
+    def __init__(self, key, name, latitude, longitude, radius_m, polygon=None, dwell_seconds=PLACE_DWELL_SECONDS):
+        self.key = key
+        self.name = name
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius_m = radius_m
+        self.polygon = polygon
+        self.dwell_seconds = dwell_seconds
+
+    def contains(self, latitude, longitude):
+        if calculate_distance(self.latitude, self.longitude, latitude, longitude) * 1000 > self.radius_m:
+            return False
+        return self.polygon is None or point_in_polygon(latitude, longitude, self.polygon)
+
+def point_in_polygon(latitude, longitude, polygon):
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        lat_i, lon_i = polygon[i]
+        lat_j, lon_j = polygon[j]
+        if (lat_i > latitude) != (lat_j > latitude):
+            crossing = lon_i + (latitude - lat_i) * (lon_j - lon_i) / (lat_j - lat_i)
+            if longitude < crossing:
+                inside = not inside
+        j = i
+    return inside
+
+def polygon_bounds(polygon):
+    """Centroid of the vertices and the radius in meters that covers them all."""
+    latitude = sum(p[0] for p in polygon) / len(polygon)
+    longitude = sum(p[1] for p in polygon) / len(polygon)
+    radius_m = max(calculate_distance(latitude, longitude, p[0], p[1]) for p in polygon) * 1000
+    return latitude, longitude, radius_m
+
+class VehicleFenceState:
+    __slots__ = ('inside', 'last_timestamp')
+
+    def __init__(self, inside=None, last_timestamp=None):
+        # fence key -> [entered_at, dwell_reported]
+        self.inside = inside or {}
+        self.last_timestamp = last_timestamp
+
+class GeofenceEngine:
+    def __init__(self):
+        self._index = None
+        self._fences = {}
+        self._versions = None
+        self._checked_at = 0
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def observe(self, vehicle_id, latitude, longitude, timestamp):
+        """Feed one ping and return the geofence events it causes."""
+        with self._lock:
+            self._refresh()
+            state = self._states.get(vehicle_id)
+            if state is None:
+                state = self._states[vehicle_id] = load_fence_state(vehicle_id)
+
+            if state.last_timestamp is not None and timestamp < state.last_timestamp:
+                return []
+            state.last_timestamp = timestamp
+
+            inside_now = set()
+            for key in self._index.candidates(latitude, longitude):
+                if self._fences[key].contains(latitude, longitude):
+                    inside_now.add(key)
+
+            events = []
+            for key in list(state.inside):
+                if key not in inside_now:
+                    del state.inside[key]
+                    events.append(self._event(vehicle_id, key, 'exit', latitude, longitude, timestamp))
+
+            for key in inside_now:
+                entry = state.inside.get(key)
+                if entry is None:
+                    state.inside[key] = [timestamp, False]
+                    events.append(self._event(vehicle_id, key, 'enter', latitude, longitude, timestamp))
+                elif not entry[1] and (timestamp - entry[0]).total_seconds() >= self._fences[key].dwell_seconds:
+                    entry[1] = True
+                    events.append(self._event(vehicle_id, key, 'dwell', latitude, longitude, timestamp))
+            return events
+
+    def verify(self, vehicle_id, last_at):
+        """Drop the vehicle's state unless its last ping is the last stored position, last_at.
+
+        Another worker, or a rolled-back batch, may have raised events since
+        this process last saw the vehicle. Call before feeding a batch.
+        """
+        with self._lock:
+            state = self._states.get(vehicle_id)
+            if state is not None and state.last_timestamp != last_at:
+                del self._states[vehicle_id]
+
+    def invalidate(self, vehicle_id=None):
+        """Drop fences (and vehicle state) so they are reloaded on the next ping."""
+        with self._lock:
+            self._index = None
+            if vehicle_id is not None:
+                self._states.pop(vehicle_id, None)
+
+    def _event(self, vehicle_id, key, event_type, latitude, longitude, timestamp):
+        fence = self._fences.get(key)
+        return {
+            'vehicle_id': vehicle_id,
+            'fence_type': key[0],
+            'fence_id': key[1],
+            'fence_name': fence.name if fence else None,
+            'event_type': event_type,
+            'latitude': latitude,
+            'longitude': longitude,
+            'timestamp': timestamp
+        }
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._index is not None and now - self._checked_at < VERSION_CHECK_SECONDS:
+            return
+        self._checked_at = now
+
+        versions = dict(db.session.execute(db.select(DataVersion.name, DataVersion.version).where(
+            DataVersion.name.in_([GEOFENCES_VERSION, PLACES_VERSION])
+        )).all())
+        if self._index is not None and versions == self._versions:
+            return
+
+        self._fences = load_fences()
+        self._index = GridIndex()
+        for key, fence in self._fences.items():
+            self._index.add(key, fence.latitude, fence.longitude, fence.radius_m)
+        self._versions = versions
+
+        # Vehicles inside a fence that no longer exists get no exit event;
+        # forget them so state matches the current fences.
+        for state in self._states.values():
+            for key in [k for k in state.inside if k not in self._fences]:
+                del state.inside[key]
+
+def load_fences():
+    fences = {}
+    for g in Geofence.query.filter(Geofence.is_active.isnot(False)).all():
+        key = ('geofence', g.id)
+        if g.kind == 'polygon':
+            polygon = json.loads(g.polygon)
+            latitude, longitude, radius_m = polygon_bounds(polygon)
+            fences[key] = Fence(key, g.name, latitude, longitude, radius_m, polygon, g.dwell_seconds or 0)
+        else:
+            fences[key] = Fence(key, g.name, g.latitude, g.longitude, g.radius_m, None, g.dwell_seconds or 0)
+
+    places = db.session.execute(db.select(
+        PlaceOfInterest.id, PlaceOfInterest.name, PlaceOfInterest.latitude, PlaceOfInterest.longitude
+    )).all()
+    for place_id, name, latitude, longitude in places:
+        key = ('place', place_id)
+        fences[key] = Fence(key, name, latitude, longitude, PLACE_RADIUS_M)
+    return fences
+
+def load_fence_state(vehicle_id):
+    """Rebuild which fences a vehicle is inside from its latest event per fence."""
+    ranked = db.select(
+        GeofenceEvent.fence_type, GeofenceEvent.fence_id, GeofenceEvent.event_type, GeofenceEvent.timestamp,
+        db.func.row_number().over(
+            partition_by=(GeofenceEvent.fence_type, GeofenceEvent.fence_id),
+            order_by=GeofenceEvent.id.desc()
+        ).label('rank')
+    ).where(GeofenceEvent.vehicle_id == vehicle_id).subquery()
+
+    rows = db.session.execute(db.select(
+        ranked.c.fence_type, ranked.c.fence_id, ranked.c.event_type, ranked.c.timestamp
+    ).where(ranked.c.rank == 1)).all()
+
+    state = VehicleFenceState()
+    for fence_type, fence_id, event_type, timestamp in rows:
+        if event_type != 'exit':
+            state.inside[(fence_type, fence_id)] = [timestamp, event_type == 'dwell']
+        if state.last_timestamp is None or timestamp > state.last_timestamp:
+            state.last_timestamp = timestamp
+    return state
+
+def serialize_geofence(g):
+    return {
+        'id': g.id,
+        'name': g.name,
+        'kind': g.kind,
+        'latitude': g.latitude,
+        'longitude': g.longitude,
+        'radius_m': g.radius_m,
+        'polygon': json.loads(g.polygon) if g.polygon else None,
+        'dwell_seconds': g.dwell_seconds,
+        'is_active': g.is_active,
+        'created_at': g.created_at.isoformat() if g.created_at else None
+    }
+
+def serialize_event(e):
+    return {
+        'id': e.id,
+        'vehicle_id': e.vehicle_id,
+        'fence_type': e.fence_type,
+        'fence_id': e.fence_id,
+        'fence_name': e.fence_name,
+        'event_type': e.event_type,
+        'latitude': e.latitude,
+        'longitude': e.longitude,
+        'timestamp': e.timestamp.isoformat()
+    }
@@ -0,0 +1,100 @@
+"""Conditional GET and an in-process response cache for polled read endpoints.
+
+A cached response is identified by its path and query string plus the
+version counters of the data it is built from (app.versions), which the
+write paths bump in the same transaction as their change. The ETag is
+derived from that identity rather than from the body, so every worker hands
+out the same one and a matching If-None-Match is answered with a 304 after
+reading the counters alone.
+
+Each worker also keeps serialized bodies in a bounded LRU, so a client
+without the ETag is served from memory while the counters are unchanged:
+neither the data query nor the encoding runs again.
+"""
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone
+import hashlib
+import threading
+import time
+
+from flask import Response, current_app, request
+
+CachedBody = namedtuple('CachedBody', ['etag', 'body', 'headers', 'last_modified'])
+
+class ResponseCache:
+    """LRU of serialized 200 responses, bounded by entry count and total body size."""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, etag):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.etag != etag:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        if self.max_entries <= 0 or len(entry.body) > self.max_bytes:
+            return
+        with self._lock:
+            # A newer version of the same request replaces the old one
+            self._discard(key)
+            self._entries[key] = entry
+            self._size += len(entry.body)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._size}
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry.body)
+
+def cached_response(cache, versions, build, window_seconds=None):
+    """Serve the current request from cache, or build(), validated by `versions`.
+
+    window_seconds is for results that also depend on the clock, such as a
+    window relative to now: they are rebuilt at least that often.
+    """
+    key = (request.path, tuple(sorted(request.args.items(multi=True))))
+    identity = [key, tuple(versions)]
+    if window_seconds:
+        identity.append(int(time.time() // window_seconds))
+    etag = hashlib.sha1(repr(identity).encode()).hexdigest()
+
+    if request.if_none_match.contains_weak(etag):
+        return _with_validators(Response(status=304), etag)
+
+    entry = cache.get(key, etag)
+    if entry is None:
+        response = current_app.make_response(build())
+        if response.status_code != 200 or response.is_streamed:
+            return response
+        headers = [(name, value) for name, value in response.headers if name != 'Content-Length']
+        entry = CachedBody(etag, response.get_data(), headers, datetime.now(timezone.utc).replace(microsecond=0))
+        cache.put(key, entry)
+
+    return _with_validators(Response(entry.body, 200, entry.headers), etag, entry.last_modified)
+
+def _with_validators(response, etag, last_modified=None):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Let browsers keep the body but revalidate it on every poll
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
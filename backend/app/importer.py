@@ -0,0 +1,321 @@
+"""Bulk import of recorded tracks.
+
+An upload in CSV, NDJSON or GPX (the layouts the exporters write) is read
+as a stream and loaded IMPORT_CHUNK_SIZE points at a time. Each chunk is
+validated, sorted, stripped of fixes the vehicle already has and written in
+one statement: COPY on PostgreSQL, an executemany INSERT elsewhere. Chunks
+are committed one by one, so memory use does not depend on file size and
+importing the same file again adds nothing.
+
+Points keep their recorded time. A missing speed is derived from the
+previous fix, as the mobile page does. Points older than the vehicle's
+oldest row in `locations`, when it has an archive, are merged into the
+archived days instead: reads serve everything before that row from the
+archive, so a hot row there would hide the archived days after it. Derived data is then rebuilt in one
+pass over the imported span rather than point by point: hourly rollups,
+auto-detected stops, trips and the last known position. Geofence events
+are not replayed; they are alerts raised at ingest, and live fence state is
+read back from the latest of them. Bumping the vehicle's TRACK_VERSION at
+the end makes every worker reload its ingest state for the vehicle.
+"""
+from bisect import bisect_left
+import csv
+from datetime import datetime, timedelta
+import io
+import json
+import math
+import os
+from xml.etree import ElementTree
+
+from app.archive import archive_boundary, archive_day, archived_timestamps
+from app.geo import calculate_distance
+from app.models import db, Location, SavedLocation
+from app.partitions import ensure_partitions, is_postgresql
+from app.positions import update_last_positions
+from app.rollups import ROLLUP_PERIOD, rebuild_rollups, rebuild_track_rollups, truncate_hour
+from app.stats import load_track
+from app.stops import STOP_WINDOW, StopDetector, load_stop_state
+from app.timeparse import parse_timestamp
+from app.trips import rebuild_trips
+from app.versions import LOCATIONS_VERSION, SAVED_LOCATIONS_VERSION, TRACK_VERSION, bump_version, vehicle_key
+
+IMPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'gpx': 'application/gpx+xml',
+}
+IMPORT_CHUNK_SIZE = 50000
+MAX_REPORTED_ERRORS = 20
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+# Column order of the rows written to locations
+LOCATION_COLUMNS = ('vehicle_id', 'timestamp', 'latitude', 'longitude', 'speed', 'dwell_until', 'sample_count')
+# Other CSV header spellings, after lower-casing and replacing spaces with underscores
+CSV_ALIASES = {'time': 'timestamp', 'lat': 'latitude', 'lon': 'longitude', 'lng': 'longitude'}
+
+def detect_format(filename=None, mimetype=None):
+    """The import format for a file name or Content-Type, or None."""
+    for format_type, content_type in IMPORT_FORMATS.items():
+        if mimetype == content_type:
+            return format_type
+    extension = os.path.splitext(filename or '')[1].lstrip('.').lower()
+    return extension if extension in IMPORT_FORMATS else None
+
+def read_records(stream, format_type):
+    """Yield (record number, raw record dict) from a binary stream.
+
+    Raises ValueError, csv.Error or ElementTree.ParseError when the file
+    itself is malformed; bad values are left to parse_record().
+    """
+    if format_type == 'csv':
+        return _csv_records(stream)
+    if format_type == 'ndjson':
+        return _ndjson_records(stream)
+    if format_type == 'gpx':
+        return _gpx_records(stream)
+    raise ValueError(f'Unknown import format: {format_type}')
+
+def parse_record(record, now):
+    """Return (timestamp, latitude, longitude, speed, dwell_until, sample_count); raises ValueError.
+
+    speed is None when the record has none.
+    """
+    if not isinstance(record, dict):
+        raise ValueError('Record must be an object')
+    if any(record.get(field) in (None, '') for field in ('timestamp', 'latitude', 'longitude')):
+        raise ValueError('Missing required fields')
+
+    try:
+        latitude = float(record['latitude'])
+        longitude = float(record['longitude'])
+        speed = float(record['speed']) if record.get('speed') not in (None, '') else None
+        sample_count = int(record['sample_count']) if record.get('sample_count') not in (None, '') else None
+    except (TypeError, ValueError):
+        raise ValueError('Invalid numeric value')
+    if speed is not None and not (math.isfinite(speed) and speed >= 0):
+        raise ValueError('Invalid numeric value')
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('Coordinates out of range')
+
+    timestamp = parse_timestamp(record['timestamp'])
+    if timestamp is None:
+        raise ValueError('Invalid timestamp')
+    if timestamp > now + MAX_CLOCK_SKEW:
+        raise ValueError('Timestamp is in the future')
+
+    dwell_until = None
+    if record.get('dwell_until'):
+        dwell_until = parse_timestamp(record['dwell_until'])
+        if dwell_until is None or dwell_until < timestamp or (sample_count or 0) < 1:
+            raise ValueError('Invalid dwell_until or sample_count')
+    return timestamp, latitude, longitude, speed, dwell_until, sample_count if dwell_until else None
+
+class TrackImporter:
+    """Loads one vehicle's points chunk by chunk, then rebuilds its derived data."""
+
+    def __init__(self, vehicle_id, partition_interval=None, chunk_size=IMPORT_CHUNK_SIZE, now=None):
+        self.vehicle_id = vehicle_id
+        self.partition_interval = partition_interval
+        self.chunk_size = chunk_size
+        self.now = now or datetime.utcnow()
+        self.points = []
+        self.previous = None   # (end time, latitude, longitude) of the last point loaded
+        self.latest = None     # newest point loaded, for the last known position
+        self.first = None
+        self.last = None
+        # Points before this go to the archive; None when the vehicle has none
+        self.archive_before = archive_boundary(vehicle_id)
+        self.result = {'records': 0, 'imported': 0, 'archived': 0, 'duplicates': 0, 'rejected': 0, 'errors': []}
+
+    def add(self, number, record):
+        self.result['records'] += 1
+        try:
+            self.points.append(parse_record(record, self.now))
+        except ValueError as e:
+            self.result['rejected'] += 1
+            if len(self.result['errors']) < MAX_REPORTED_ERRORS:
+                self.result['errors'].append({'record': number, 'error': str(e)})
+            return
+        if len(self.points) >= self.chunk_size:
+            self._load()
+
+    def finish(self):
+        """Load the last chunk and rebuild derived data over the imported span. Returns the result."""
+        if self.points:
+            self._load()
+        self.result['first'] = self.first
+        self.result['last'] = self.last
+        if self.first is not None:
+            self._rebuild()
+        return self.result
+
+    def _load(self):
+        points = sorted(self.points, key=lambda p: p[0])
+        self.points = []
+        start, end = points[0][0], points[-1][0]
+        existing = set(db.session.execute(db.select(Location.timestamp).where(
+            Location.vehicle_id == self.vehicle_id,
+            Location.timestamp >= start,
+            Location.timestamp <= end
+        )).scalars())
+        if self.archive_before is not None and start < self.archive_before:
+            existing |= archived_timestamps(self.vehicle_id, start, end)
+
+        rows = []
+        for timestamp, latitude, longitude, speed, dwell_until, sample_count in points:
+            if timestamp in existing or (rows and rows[-1][1] == timestamp):
+                self.result['duplicates'] += 1
+                continue
+            if speed is None:
+                speed = 0.0
+                if self.previous is not None and timestamp > self.previous[0]:
+                    hours = (timestamp - self.previous[0]).total_seconds() / 3600
+                    speed = calculate_distance(self.previous[1], self.previous[2], latitude, longitude) / hours
+            rows.append((self.vehicle_id, timestamp, latitude, longitude, speed, dwell_until, sample_count))
+            self.previous = (dwell_until or timestamp, latitude, longitude)
+
+        archived = [row for row in rows if self.archive_before is not None and row[1] < self.archive_before]
+        hot = rows[len(archived):]
+        if archived:
+            days = {}
+            for row in archived:
+                days.setdefault(row[1].replace(hour=0, minute=0, second=0, microsecond=0), []).append(row[1:])
+            for day, day_rows in sorted(days.items()):
+                archive_day(self.vehicle_id, day, day_rows)
+            self.result['archived'] += len(archived)
+        if hot:
+            ensure_partitions(hot[0][1], hot[-1][1], self.partition_interval)
+            if is_postgresql():
+                _copy_locations(hot)
+            else:
+                db.session.execute(Location.__table__.insert(), [dict(zip(LOCATION_COLUMNS, row)) for row in hot])
+
+        if rows:
+            self.result['imported'] += len(rows)
+            self.first = min(self.first or rows[0][1], rows[0][1])
+            self.last = max(self.last or rows[-1][1], max(row[5] or row[1] for row in rows))
+            if self.latest is None or rows[-1][1] >= self.latest[1]:
+                self.latest = rows[-1]
+        db.session.commit()
+
+    def _rebuild(self):
+        vehicle_id = self.vehicle_id
+        # Archived hours are only readable through load_track
+        rebuild = rebuild_track_rollups if self.result['archived'] else rebuild_rollups
+        self.result['rollup_hours'] = rebuild(vehicle_id, self.first, truncate_hour(self.last) + ROLLUP_PERIOD)
+        self.result['stops'] = self._detect_stops()
+        update_last_positions([dict(zip(LOCATION_COLUMNS, self.latest))])
+        bump_version(vehicle_key(LOCATIONS_VERSION, vehicle_id))
+        bump_version(vehicle_key(SAVED_LOCATIONS_VERSION, vehicle_id))
+        db.session.commit()
+        self.result['trips'] = rebuild_trips(vehicle_id, self.first, self.last)
+        bump_version(vehicle_key(TRACK_VERSION, vehicle_id))
+        db.session.commit()
+
+    def _detect_stops(self):
+        """Run stop detection over the imported span, skipping stops the vehicle already has."""
+        vehicle_id = self.vehicle_id
+        # Seeded with the track before the span; saved locations are checked below instead
+        detector = StopDetector(loader=lambda v, window_start, before: (load_stop_state(v, window_start, before)[0], None))
+        saved = sorted(db.session.execute(db.select(SavedLocation.timestamp).where(
+            SavedLocation.vehicle_id == vehicle_id,
+            SavedLocation.timestamp >= self.first - STOP_WINDOW,
+            SavedLocation.timestamp <= self.last + STOP_WINDOW
+        )).scalars())
+
+        # A day at a time through load_track, which also reads archived days
+        stops = []
+        day = self.first
+        while day <= self.last:
+            end = min(day.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1),
+                      self.last + timedelta(microseconds=1))
+            track = load_track(vehicle_id, day, end)
+            for timestamp, latitude, longitude in zip(
+                track.timestamps.astype(datetime).tolist(), track.latitudes.tolist(), track.longitudes.tolist()
+            ):
+                stop = detector.observe(vehicle_id, latitude, longitude, timestamp)
+                if stop is None:
+                    continue
+                i = bisect_left(saved, stop['timestamp'] - STOP_WINDOW)
+                if i < len(saved) and saved[i] <= stop['timestamp'] + STOP_WINDOW:
+                    continue
+                stops.append({'vehicle_id': vehicle_id, **stop})
+            day = end
+        if stops:
+            db.session.execute(db.insert(SavedLocation), stops)
+        return len(stops)
+
+def import_track(vehicle_id, stream, format_type, partition_interval=None, chunk_size=IMPORT_CHUNK_SIZE):
+    """Import a track file for one vehicle and return a summary.
+
+    A malformed file stops the import at that point; what was read before
+    it is kept and the summary carries an 'error'.
+    """
+    importer = TrackImporter(vehicle_id, partition_interval, chunk_size)
+    try:
+        for number, record in read_records(stream, format_type):
+            importer.add(number, record)
+    except (ValueError, csv.Error, ElementTree.ParseError) as e:
+        importer.result['error'] = f'Malformed {format_type.upper()} file: {e}'
+    return importer.finish()
+
+def _copy_locations(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY locations ({', '.join(LOCATION_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+
+def _csv_records(stream):
+    reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    header = next(reader, None)
+    if header is None:
+        return
+    names = [CSV_ALIASES.get(name, name) for name in (h.strip().lower().replace(' ', '_') for h in header)]
+    missing = {'timestamp', 'latitude', 'longitude'} - set(names)
+    if missing:
+        raise ValueError(f"header has no {', '.join(sorted(missing))} column")
+    for number, values in enumerate(reader, 1):
+        if values:
+            yield number, dict(zip(names, values))
+
+def _ndjson_records(stream):
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+def _gpx_records(stream):
+    parents = []
+    number = 0
+    for event, element in ElementTree.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+            continue
+        parents.pop()
+        if _local_name(element.tag) != 'trkpt':
+            continue
+
+        number += 1
+        record = {'latitude': element.get('lat'), 'longitude': element.get('lon')}
+        for child in element.iter():
+            name = _local_name(child.tag)
+            if name == 'time':
+                record['timestamp'] = (child.text or '').strip()
+            elif name == 'speed' and child.text:
+                try:
+                    record['speed'] = float(child.text) * 3.6  # GPX speed is in m/s; we store km/h
+                except ValueError:
+                    record['speed'] = child.text
+        if parents:
+            # Drop read points so a long track does not build up in memory
+            parents[-1].remove(element)
+        yield number, record
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
@@ -0,0 +1,135 @@
+"""Write-behind queue for GPS ingest.
+
+Request handlers validate points and hand them over with offer(); a single
+background thread drains the queue and writes them in group commits of up
+to batch_size points, or whatever has arrived after flush_ms.
+"""
+from collections import deque
+import atexit
+import logging
+import threading
+import time
+
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+RETRY_BACKOFF_SECONDS = (0.5, 1, 2, 5)
+
+class WriteBehindQueue:
+    def __init__(self, writer, max_size=10000, batch_size=500, flush_ms=200):
+        self.writer = writer
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_seconds = flush_ms / 1000
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self._failures = 0
+        self.points_written = 0
+        self.batches_written = 0
+        self.points_dropped = 0
+        self.write_errors = 0
+
+    def offer(self, rows):
+        """Queue all rows, or none of them if there is not enough room."""
+        with self._cond:
+            if self._stopping or len(self._items) + len(rows) > self.max_size:
+                return False
+            now = time.monotonic()
+            self._items.extend((now, row) for row in rows)
+            if self._thread is None:
+                self._start()
+            if len(self._items) >= self.batch_size:
+                self._cond.notify()
+            return True
+
+    def stats(self):
+        with self._cond:
+            lag = time.monotonic() - self._items[0][0] if self._items else 0.0
+            return {
+                'mode': 'async',
+                'queue_depth': len(self._items),
+                'queue_capacity': self.max_size,
+                'lag_seconds': round(lag, 3),
+                'points_written': self.points_written,
+                'batches_written': self.batches_written,
+                'points_dropped': self.points_dropped,
+                'write_errors': self.write_errors
+            }
+
+    def stop(self, timeout=30):
+        """Stop accepting points and flush what is queued."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._items and self._stopping:
+                    return
+                deadline = self._items[0][0] + self.flush_seconds if self._items else None
+                while not self._stopping and len(self._items) < self.batch_size:
+                    timeout = None if deadline is None else deadline - time.monotonic()
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                    if deadline is None and self._items:
+                        deadline = self._items[0][0] + self.flush_seconds
+                count = min(len(self._items), self.batch_size)
+                items = [self._items.popleft() for _ in range(count)]
+
+            if items:
+                self._write(items)
+
+    def _write(self, items):
+        batch = [row for _, row in items]
+        try:
+            self.writer(batch)
+            self._failures = 0
+            self.points_written += len(batch)
+            self.batches_written += 1
+            return
+        except OperationalError:
+            # Database unavailable: put the batch back and retry after a pause
+            logger.exception('Ingest batch of %d points failed; retrying', len(batch))
+            self.write_errors += 1
+            with self._cond:
+                self._items.extendleft(reversed(items))
+            if self._stopping and self._failures >= len(RETRY_BACKOFF_SECONDS):
+                self._drop_all('database unavailable at shutdown')
+                return
+            time.sleep(RETRY_BACKOFF_SECONDS[min(self._failures, len(RETRY_BACKOFF_SECONDS) - 1)])
+            self._failures += 1
+            return
+        except Exception:
+            logger.exception('Ingest batch of %d points failed; writing points one by one', len(batch))
+            self.write_errors += 1
+
+        # Isolate the rows that cannot be written
+        for row in batch:
+            try:
+                self.writer([row])
+                self.points_written += 1
+            except Exception:
+                logger.exception('Dropping GPS point that could not be written: %r', row)
+                self.points_dropped += 1
+        self.batches_written += 1
+
+    def _drop_all(self, reason):
+        with self._cond:
+            dropped = len(self._items)
+            self._items.clear()
+        if dropped:
+            logger.error('Dropping %d queued GPS points: %s', dropped, reason)
+            self.points_dropped += dropped
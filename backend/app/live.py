@@ -0,0 +1,208 @@
+"""In-process pub/sub hub for live position and stop events.
+
+Ingest publishes after each commit and every open Server-Sent Events stream
+gets its own bounded queue. Recent events are kept so a client that
+reconnects with Last-Event-ID receives what it missed. When that is no
+longer possible the client is sent a `reset` event and should reload the
+fleet snapshot.
+
+The hub only sees events published by the same process. With several
+worker processes on PostgreSQL, PostgresRelay carries each event to the
+hubs of the others with NOTIFY.
+"""
+from collections import deque
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+import uuid
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+EVENT_HISTORY = 2000
+NOTIFY_CHANNEL = 'live_events'
+NOTIFY_PAYLOAD_BYTES = 7000  # PostgreSQL caps a payload at 8000
+LISTEN_POLL_SECONDS = 30
+LISTEN_RETRY_SECONDS = 5
+SUBSCRIBER_QUEUE_SIZE = 1000
+KEEPALIVE_SECONDS = 15
+RETRY_MILLISECONDS = 3000
+
+class Subscription:
+    def __init__(self, vehicle_ids):
+        self.vehicle_ids = vehicle_ids
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.needs_reset = False
+
+    def wants(self, vehicle_id):
+        return self.vehicle_ids is None or vehicle_id in self.vehicle_ids
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.needs_reset = True
+
+class EventHub:
+    def __init__(self, history=EVENT_HISTORY):
+        # Ids are "<epoch>-<sequence>" so ids from before a restart are recognized as stale.
+        self.epoch = f'{int(time.time())}.{os.getpid()}'
+        self._sequence = 0
+        self._history = deque(maxlen=history)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def publish(self, event, vehicle_id, data):
+        with self._lock:
+            self._sequence += 1
+            item = (self._sequence, event, vehicle_id, json.dumps(data))
+            self._history.append(item)
+            for subscription in self._subscribers:
+                if subscription.wants(vehicle_id):
+                    subscription.offer(item)
+
+    def subscribe(self, vehicle_ids=None, last_event_id=None, limit=None):
+        """Open a subscription, or return None when `limit` streams are already open."""
+        subscription = Subscription(vehicle_ids)
+        with self._lock:
+            if limit is not None and len(self._subscribers) >= limit:
+                return None
+            if last_event_id:
+                sequence = self._parse_event_id(last_event_id)
+                oldest = self._history[0][0] if self._history else self._sequence + 1
+                if sequence is None or sequence > self._sequence or sequence + 1 < oldest:
+                    subscription.needs_reset = True
+                else:
+                    for item in self._history:
+                        if item[0] > sequence and subscription.wants(item[2]):
+                            subscription.offer(item)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def reset_subscribers(self):
+        """Tell every open stream to reload, e.g. after events may have been missed."""
+        with self._lock:
+            for subscription in self._subscribers:
+                subscription.needs_reset = True
+
+    def stream(self, subscription):
+        """Yield SSE frames for a subscription until the client disconnects."""
+        try:
+            yield f'retry: {RETRY_MILLISECONDS}\n\n'
+            while True:
+                if subscription.needs_reset:
+                    subscription.needs_reset = False
+                    self._drain(subscription)
+                    yield self._frame(self._sequence, 'reset', '{}')
+                    continue
+
+                try:
+                    sequence, event, _, data = subscription.queue.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+
+                yield self._frame(sequence, event, data)
+        finally:
+            self.unsubscribe(subscription)
+
+    def _frame(self, sequence, event, data):
+        return f'id: {self.epoch}-{sequence}\nevent: {event}\ndata: {data}\n\n'
+
+    def _drain(self, subscription):
+        while True:
+            try:
+                subscription.queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def _parse_event_id(self, event_id):
+        epoch, _, sequence = event_id.partition('-')
+        if epoch != self.epoch or not sequence.isdigit():
+            return None
+        return int(sequence)
+
+class PostgresRelay:
+    """Shares hub events between processes through PostgreSQL LISTEN/NOTIFY.
+
+    notify() sends events inside the writer's transaction, so other
+    processes get them only once it commits. Each process starts a listener
+    thread with its first live stream; it holds one connection of its own and
+    republishes events from other processes into the local hub.
+    """
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.origin = uuid.uuid4().hex
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def notify(self, session, events):
+        """Queue [(event, vehicle_id, data)] for the other processes on session's transaction."""
+        chunk = []
+        size = 0
+        for item in events:
+            encoded = json.dumps(item)
+            if chunk and size + len(encoded) > NOTIFY_PAYLOAD_BYTES:
+                self._send(session, chunk)
+                chunk = []
+                size = 0
+            chunk.append(encoded)
+            size += len(encoded) + 1
+        if chunk:
+            self._send(session, chunk)
+
+    def start(self, engine):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._listen, args=(engine,), name='live-relay', daemon=True)
+                self._thread.start()
+
+    def _send(self, session, encoded):
+        payload = f'{{"origin":"{self.origin}","events":[{",".join(encoded)}]}}'
+        session.execute(text('SELECT pg_notify(:channel, :payload)'), {'channel': NOTIFY_CHANNEL, 'payload': payload})
+
+    def _listen(self, engine):
+        while True:
+            connection = None
+            try:
+                connection = engine.raw_connection()
+                # Held for as long as the process runs, so keep it out of the pool
+                connection.detach()
+                listener = connection.dbapi_connection
+                listener.autocommit = True
+                listener.cursor().execute(f'LISTEN {NOTIFY_CHANNEL}')
+                while True:
+                    if select.select([listener], [], [], LISTEN_POLL_SECONDS) != ([], [], []):
+                        listener.poll()
+                        while listener.notifies:
+                            self._receive(listener.notifies.pop(0).payload)
+            except Exception:
+                logger.exception('Live event listener failed, reconnecting')
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+                # Events sent while disconnected are gone
+                self.hub.reset_subscribers()
+                time.sleep(LISTEN_RETRY_SECONDS)
+
+    def _receive(self, payload):
+        message = json.loads(payload)
+        if message['origin'] == self.origin:
+            return  # already published here
+        for event, vehicle_id, data in message['events']:
+            self.hub.publish(event, vehicle_id, data)
+
+live_hub = EventHub()
+live_relay = PostgresRelay(live_hub)
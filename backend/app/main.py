@@ -1,36 +1,115 @@
-from flask import Flask, request, jsonify, session
+"""HTTP API and management commands, registered on the app by create_app().
+
+Importing this module does no database work. Schema creation, default data
+and location partitions are set up once per deployment by `flask bootstrap`;
+the ingest engines below are per process, load their state on first use and
+reload it when another process has written to the vehicle since.
+"""
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, session, stream_with_context
 from flask_cors import CORS
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_bcrypt import Bcrypt
 from app.config import Config
-from app.models import db, Vehicle, Location, SavedLocation, User
+from app.models import db, Vehicle, Location, SavedLocation, User, VehicleLastPosition, Geofence, GeofenceEvent, Trip
+from app.positions import update_last_positions, backfill_last_positions
+from app.stats import MAX_SAMPLE_GAP_SECONDS, format_stats, load_track
+from app.rollups import update_rollups, window_summary, backfill_rollups
+from app.simplify import MAX_SIMPLIFIED_POINTS, simplified_history
+from app.export import EXPORT_FORMATS, LOCATION_FIELDS, iter_locations, location_page, row_dict, stream_csv, stream_json, stream_ndjson, stream_gpx
+from app.stops import StopDetector, load_stop_state
+from app.live import live_hub, live_relay
+from app.ingest_queue import WriteBehindQueue
+from app.devices import VEHICLES_VERSION, device_registry
+from app.partitions import ensure_location_schema, is_postgresql, migrate_locations, prune_locations, partition_info
+from app.archive import archive_locations, delete_vehicle_archive
+from app.compaction import LocationCompactor
+from app.trips import TRIP_FIELDS, TripSegmenter, load_trip_state, rebuild_trips, serialize_trip, track_polyline
+from app.fastjson import json_response, row_records
+from app.frames import FRAME_MIMETYPE, decode_frames
+from app.timeparse import parse_timestamp
+from app.importer import IMPORT_FORMATS, detect_format, import_track
+from app.pagination import NEXT_CURSOR_HEADER, encode_cursor, page_params, page_response, paginate, paginate_list, parse_fields
+from app.geocode import create_geocoder, normalize_query
+from app.places import PLACES_VERSION, find_places
+from app.versions import LOCATIONS_VERSION, SAVED_LOCATIONS_VERSION, TRACK_VERSION, USERS_VERSION, bump_version, get_versions, vehicle_key
+from app.http_cache import ResponseCache, cached_response
+from app.metrics import init_metrics, metrics, render as render_metrics
+from app.geofence import GEOFENCES_VERSION, MAX_DWELL_SECONDS, GeofenceEngine, polygon_bounds, serialize_event, serialize_geofence
 from datetime import datetime, timedelta
-import math
-import os
-
-app = Flask(__name__)
-app.config.from_object(Config)
-
-# Get CORS origins from environment variable or use defaults
-cors_origins = os.getenv('CORS_ORIGINS', 'http://localhost:3000').split(',')
+from collections import Counter
+import click
+import hmac
+import io
+import json
+import time
 
-CORS(app, 
-     supports_credentials=True, 
-     origins=cors_origins,
-     allow_headers=['Content-Type', 'Authorization'],
-     methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'])
+api = Blueprint('api', __name__, cli_group=None)
+bcrypt = Bcrypt()
+login_manager = LoginManager()
+login_manager.login_view = 'api.login'
+stop_detector = StopDetector(loader=load_stop_state)
+geofence_engine = GeofenceEngine()
+trip_segmenter = TripSegmenter(loader=load_trip_state)
+# Set from the configuration by create_app()
+ingest_queue = None
+location_compactor = None
+geocoder = None
+response_cache = None
 
-db.init_app(app)
-bcrypt = Bcrypt(app)
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
+def create_app(config=Config):
+    """Build the application. Does no database work, so workers start serving right away."""
+    global ingest_queue, location_compactor, geocoder, response_cache
+    
+    app = Flask(__name__)
+    app.config.from_object(config)
+    
+    CORS(app, 
+         supports_credentials=True, 
+         origins=app.config['CORS_ORIGINS'].split(','),
+         allow_headers=['Content-Type', 'Authorization'],
+         expose_headers=[NEXT_CURSOR_HEADER],
+         methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'])
+    
+    db.init_app(app)
+    bcrypt.init_app(app)
+    login_manager.init_app(app)
+    init_metrics(app)
+    app.register_blueprint(api)
+    
+    location_compactor = None
+    if app.config['LOCATION_COMPACTION']:
+        location_compactor = LocationCompactor(app.config['COMPACTION_RADIUS_M'], MAX_SAMPLE_GAP_SECONDS)
+    geocoder = create_geocoder(app.config)
+    response_cache = ResponseCache(app.config['RESPONSE_CACHE_ENTRIES'], app.config['RESPONSE_CACHE_MB'] * 1024 * 1024)
+    
+    ingest_queue = None
+    if app.config['INGEST_MODE'] == 'async':
+        def write_ingest_batch(rows):
+            with app.app_context():
+                ingest_rows(rows)
+        
+        ingest_queue = WriteBehindQueue(
+            write_ingest_batch,
+            max_size=app.config['INGEST_QUEUE_SIZE'],
+            batch_size=app.config['INGEST_BATCH_SIZE'],
+            flush_ms=app.config['INGEST_FLUSH_MS']
+        )
+    return app
 
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
 
-with app.app_context():
+@api.cli.command('bootstrap')
+def bootstrap_command():
+    """Create tables, indexes and partitions, and the default vehicles and admin user."""
     db.create_all()
+    # create_all() does not add indexes to tables that already exist
+    for index in SavedLocation.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+    created = ensure_location_schema(current_app.config['LOCATIONS_PARTITION_INTERVAL'], current_app.config['LOCATIONS_PARTITIONS_AHEAD_DAYS'])
+    if created:
+        print(f"Created partitions: {', '.join(created)}")
     
     if Vehicle.query.count() == 0:
         for i in range(1, 6):
@@ -50,12 +129,108 @@ with app.app_context():
         db.session.add(admin_user)
         db.session.commit()
         print("Created default admin user (username: admin, password: admin123)")
+    
+    if VehicleLastPosition.query.first() is None and Location.query.first() is not None:
+        print(f"Backfilled last known position for {backfill_last_positions()} vehicles")
+
+@api.cli.command('backfill-rollups')
+@click.option('--all', 'rebuild_all', is_flag=True, help='Rebuild every hour instead of only history before the first rollup.')
+def backfill_rollups_command(rebuild_all):
+    """Build hourly stats rollups from existing location data."""
+    print(f"Wrote {backfill_rollups(rebuild_all)} hourly rollups")
+
+@api.cli.command('segment-trips')
+@click.option('--vehicle', 'vehicle_id', type=int, default=None, help='Only this vehicle.')
+def segment_trips_command(vehicle_id):
+    """Rebuild the trips table from the full location history."""
+    vehicle_ids = [vehicle_id] if vehicle_id is not None else db.session.execute(db.select(Vehicle.id).order_by(Vehicle.id)).scalars().all()
+    for vid in vehicle_ids:
+        print(f"Vehicle {vid}: {rebuild_trips(vid)} trips")
+        bump_version(vehicle_key(TRACK_VERSION, vid))
+        db.session.commit()
+
+@api.cli.command('import-track')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--vehicle', 'vehicle_id', type=int, required=True, help='Vehicle to import into.')
+@click.option('--format', 'format_type', type=click.Choice(list(IMPORT_FORMATS)), default=None, help='File format (default: from the file name).')
+def import_track_command(path, vehicle_id, format_type):
+    """Bulk-load a recorded CSV, NDJSON or GPX track into a vehicle's history."""
+    if db.session.get(Vehicle, vehicle_id) is None:
+        raise click.ClickException(f'Vehicle {vehicle_id} not found')
+    format_type = format_type or detect_format(path)
+    if format_type is None:
+        raise click.ClickException('Cannot tell the format from the file name; use --format')
+    
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        result = import_track(vehicle_id, f, format_type, current_app.config['LOCATIONS_PARTITION_INTERVAL'])
+    invalidate_vehicle_state(vehicle_id)
+    for error in result['errors']:
+        print(f"Record {error['record']}: {error['error']}")
+    print(f"Imported {result['imported']} points in {time.perf_counter() - started:.1f}s "
+          f"({result['archived']} older than the hot table, merged into the archive; "
+          f"{result['duplicates']} already present, {result['rejected']} rejected)")
+    if 'trips' in result:
+        print(f"Rebuilt {result['rollup_hours']} rollup hours; {result['stops']} new stops; {result['trips']} trips in total")
+    if result.get('error'):
+        raise click.ClickException(result['error'])
 
-@app.route('/api/health', methods=['GET'])
+@api.cli.command('partition-locations')
+def partition_locations_command():
+    """Move existing location data into time-range partitions (PostgreSQL)."""
+    try:
+        created = migrate_locations(current_app.config['LOCATIONS_PARTITION_INTERVAL'], current_app.config['LOCATIONS_PARTITIONS_AHEAD_DAYS'])
+    except (RuntimeError, ValueError) as e:
+        raise click.ClickException(str(e))
+    if created is None:
+        print("locations is already partitioned")
+    else:
+        print(f"Migrated locations into {len(created)} partitions")
+
+@api.cli.command('archive-locations')
+@click.option('--days', type=int, default=None, help='Archive days older than this (default ARCHIVE_AFTER_DAYS).')
+def archive_locations_command(days):
+    """Copy closed vehicle-days into the compressed history archive."""
+    days = days if days is not None else current_app.config['ARCHIVE_AFTER_DAYS']
+    print(f"Archived {archive_locations(datetime.utcnow() - timedelta(days=days))} vehicle-days")
+
+@api.cli.command('prune-locations')
+@click.option('--days', type=int, default=None, help='Keep this many days of history (default LOCATIONS_RETENTION_DAYS).')
+@click.option('--no-archive', is_flag=True, help='Do not archive the data before removing it.')
+def prune_locations_command(days, no_archive):
+    """Create upcoming partitions and remove location data past the retention period."""
+    created = ensure_location_schema(current_app.config['LOCATIONS_PARTITION_INTERVAL'], current_app.config['LOCATIONS_PARTITIONS_AHEAD_DAYS'])
+    if created:
+        print(f"Created partitions: {', '.join(created)}")
+    
+    days = days if days is not None else current_app.config['LOCATIONS_RETENTION_DAYS']
+    if not days:
+        print("No retention period set; keeping all location data")
+        return
+    
+    if not no_archive:
+        # Archive every day that retention will touch, including the partial one
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        print(f"Archived {archive_locations(cutoff + timedelta(days=1))} vehicle-days")
+    
+    dropped, deleted = prune_locations(days)
+    if dropped or deleted:
+        bump_version(LOCATIONS_VERSION)
+        db.session.commit()
+    if dropped:
+        print(f"Dropped partitions: {', '.join(dropped)}")
+    if deleted:
+        print(f"Deleted {deleted} location rows")
+    if not dropped and not deleted:
+        print(f"Nothing older than {days} days to remove")
+    for name, start, end in partition_info():
+        print(f"  {name}: {start:%Y-%m-%d} .. {end:%Y-%m-%d}")
+
+@api.route('/api/health', methods=['GET'])
 def health():
     return jsonify({'status': 'healthy', 'message': 'GPS Tracker API is running'})
 
-@app.route('/api/auth/register', methods=['POST'])
+@api.route('/api/auth/register', methods=['POST'])
 def register():
     data = request.json
     
@@ -78,7 +253,7 @@ def register():
     
     return jsonify({'message': 'User registered successfully'}), 201
 
-@app.route('/api/auth/login', methods=['POST'])
+@api.route('/api/auth/login', methods=['POST'])
 def login():
     data = request.json
     user = User.query.filter_by(username=data['username']).first()
@@ -97,13 +272,13 @@ def login():
     
     return jsonify({'error': 'Invalid username or password'}), 401
 
-@app.route('/api/auth/logout', methods=['POST'])
+@api.route('/api/auth/logout', methods=['POST'])
 @login_required
 def logout():
     logout_user()
     return jsonify({'message': 'Logged out successfully'})
 
-@app.route('/api/auth/check', methods=['GET'])
+@api.route('/api/auth/check', methods=['GET'])
 def check_auth():
     if current_user.is_authenticated:
         return jsonify({
@@ -117,94 +292,390 @@ def check_auth():
         })
     return jsonify({'authenticated': False})
 
-@app.route('/api/gps', methods=['POST'])
+@api.route('/api/gps', methods=['POST'])
 def receive_gps():
+    if request.mimetype == FRAME_MIMETYPE:
+        return receive_gps_frames()
     data = request.json
     
     required_fields = ['device_id', 'latitude', 'longitude']
     if not all(field in data for field in required_fields):
         return jsonify({'error': 'Missing required fields'}), 400
     
-    vehicle = Vehicle.query.filter_by(device_id=data['device_id']).first()
+    vehicle = device_registry.get(data['device_id'])
     if not vehicle:
         return jsonify({'error': 'Vehicle not found'}), 404
+    if not vehicle.is_active:
+        return jsonify({'error': 'Vehicle is inactive'}), 403
+    
+    row = {
+        'vehicle_id': vehicle.vehicle_id,
+        'latitude': float(data['latitude']),
+        'longitude': float(data['longitude']),
+        'speed': float(data.get('speed', 0.0)),
+        'timestamp': datetime.utcnow()
+    }
+    
+    if ingest_queue is not None:
+        if not ingest_queue.offer([row]):
+            return ingest_busy()
+        return jsonify({'message': 'GPS data queued', 'vehicle': vehicle.name}), 202
+    
+    ingest_rows([row])
+    return jsonify({'message': 'GPS data received', 'vehicle': vehicle.name}), 201
+
+MAX_BATCH_POINTS = 5000
+
+@api.route('/api/gps/batch', methods=['POST'])
+def receive_gps_batch():
+    if request.mimetype == FRAME_MIMETYPE:
+        return receive_gps_frames()
+    data = request.json
+    points = data.get('points') if isinstance(data, dict) else None
     
-    location = Location(
-        vehicle_id=vehicle.id,
-        latitude=float(data['latitude']),
-        longitude=float(data['longitude']),
-        speed=float(data.get('speed', 0.0)),
-        timestamp=datetime.utcnow()
-    )
-    db.session.add(location)
-    detect_and_save_stops(vehicle.id, location)
-    db.session.commit()
+    if not isinstance(points, list) or not points:
+        return jsonify({'error': 'points must be a non-empty list'}), 400
     
-    return jsonify({'message': 'GPS data received', 'vehicle': vehicle.name, 'location_id': location.id}), 201
-
-def detect_and_save_stops(vehicle_id, current_location):
-    time_window = datetime.utcnow() - timedelta(minutes=10)
-    recent_locations = Location.query.filter(
-        Location.vehicle_id == vehicle_id,
-        Location.timestamp >= time_window
-    ).order_by(Location.timestamp.desc()).all()
+    if len(points) > MAX_BATCH_POINTS:
+        return jsonify({'error': f'Batch too large (max {MAX_BATCH_POINTS} points)'}), 413
     
-    if len(recent_locations) < 5:
-        return
+    now = datetime.utcnow()
+    results = []
+    rows = []
     
-    first_loc = recent_locations[-1]
-    distance = calculate_distance(
-        first_loc.latitude, first_loc.longitude,
-        current_location.latitude, current_location.longitude
-    )
+    for index, point in enumerate(points):
+        row, error = parse_gps_point(point, now)
+        if error:
+            results.append({'index': index, 'status': 'rejected', 'error': error})
+            continue
+        
+        rows.append(row)
+        results.append({'index': index, 'status': 'accepted'})
+    
+    status = 201
+    if rows and ingest_queue is not None:
+        if not ingest_queue.offer(rows):
+            return ingest_busy()
+        status = 202
+    elif rows:
+        ingest_rows(rows)
     
-    if distance < 0.05 and len(recent_locations) >= 5:
-        time_diff = (current_location.timestamp - first_loc.timestamp).total_seconds() / 60
+    return jsonify({
+        'message': 'GPS batch queued' if status == 202 else 'GPS batch processed',
+        'accepted': len(rows),
+        'rejected': len(points) - len(rows),
+        'results': results
+    }), status if rows else 400
+
+def receive_gps_frames():
+    if (request.content_length or 0) > MAX_BATCH_POINTS * 64:
+        return jsonify({'error': f'Batch too large (max {MAX_BATCH_POINTS} points)'}), 413
+    
+    now = datetime.utcnow()
+    try:
+        frames = decode_frames(request.get_data(cache=False), now)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid frame: {e}'}), 400
+    
+    total = sum(len(points) for _, points in frames)
+    if not total:
+        return jsonify({'error': 'Frame has no points'}), 400
+    if total > MAX_BATCH_POINTS:
+        return jsonify({'error': f'Batch too large (max {MAX_BATCH_POINTS} points)'}), 413
+    
+    latest = now + timedelta(minutes=5)
+    rows = []
+    rejected = Counter()
+    for device_id, points in frames:
+        vehicle = device_registry.get(device_id)
+        if not vehicle or not vehicle.is_active:
+            rejected[device_id, 'Vehicle is inactive' if vehicle else 'Vehicle not found'] += len(points)
+            continue
         
-        if time_diff >= 5:
-            existing_stop = SavedLocation.query.filter(
-                SavedLocation.vehicle_id == vehicle_id,
-                SavedLocation.timestamp >= time_window
-            ).first()
-            
-            if not existing_stop:
-                saved_loc = SavedLocation(
-                    vehicle_id=vehicle_id,
-                    name='Auto-detected Stop',
-                    latitude=current_location.latitude,
-                    longitude=current_location.longitude,
-                    stop_duration_minutes=int(time_diff),
-                    visit_type='auto_detected',
-                    timestamp=first_loc.timestamp
-                )
-                db.session.add(saved_loc)
-
-def calculate_distance(lat1, lon1, lat2, lon2):
-    R = 6371
-    lat1_rad = math.radians(lat1)
-    lat2_rad = math.radians(lat2)
-    delta_lat = math.radians(lat2 - lat1)
-    delta_lon = math.radians(lon2 - lon1)
-    
-    a = math.sin(delta_lat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-    return R * c
-
-@app.route('/api/vehicles', methods=['GET'])
+        for timestamp, latitude, longitude, speed in points:
+            if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                rejected[device_id, 'Coordinates out of range'] += 1
+            elif timestamp > latest:
+                rejected[device_id, 'Timestamp is in the future'] += 1
+            else:
+                rows.append({
+                    'vehicle_id': vehicle.vehicle_id,
+                    'latitude': latitude,
+                    'longitude': longitude,
+                    'speed': speed,
+                    'timestamp': timestamp
+                })
+    
+    status = 201
+    if rows and ingest_queue is not None:
+        if not ingest_queue.offer(rows):
+            return ingest_busy()
+        status = 202
+    elif rows:
+        ingest_rows(rows)
+    
+    return jsonify({
+        'message': 'GPS data queued' if status == 202 else 'GPS data received',
+        'accepted': len(rows),
+        'rejected': total - len(rows),
+        'errors': [{'device_id': device_id, 'error': error, 'points': count}
+                   for (device_id, error), count in rejected.items()]
+    }), status if rows else 400
+
+def ingest_rows(rows):
+    started = time.perf_counter()
+    rows = sorted(rows, key=lambda r: r['timestamp'])
+    verify_engine_state({row['vehicle_id'] for row in rows})
+    stored = location_compactor.compact(rows) if location_compactor is not None else rows
+    if stored:
+        db.session.execute(db.insert(Location), stored)
+    
+    stops = []
+    for row in rows:
+        stop = detect_and_save_stops(row['vehicle_id'], row['latitude'], row['longitude'], row['timestamp'])
+        if stop:
+            stops.append(stop)
+    trip_segmenter.segment(rows)
+    update_last_positions(rows)
+    update_rollups(rows)
+    fence_events = evaluate_geofences(rows)
+    # Sorted so concurrent batches take the counter row locks in the same order
+    for vehicle_id in sorted({row['vehicle_id'] for row in rows}):
+        bump_version(vehicle_key(LOCATIONS_VERSION, vehicle_id))
+    for vehicle_id in sorted({stop.vehicle_id for stop in stops}):
+        bump_version(vehicle_key(SAVED_LOCATIONS_VERSION, vehicle_id))
+    if stops:
+        db.session.flush()  # assigns the ids sent with stop events
+    events = ingest_events(rows, stops, fence_events)
+    if is_postgresql():
+        # Delivered to the other worker processes when the batch commits
+        live_relay.notify(db.session, events)
+    db.session.commit()
+    metrics.record_ingest(len(rows), len(stored), len(stops), len(fence_events), time.perf_counter() - started)
+    for event in events:
+        live_hub.publish(*event)
+
+# TRACK_VERSION of each vehicle when this process last checked it
+track_versions = {}
+
+def verify_engine_state(vehicle_ids):
+    """Reload ingest state that other workers, an import or a rolled-back batch have made stale.
+
+    Every engine checks its state against the same last stored positions,
+    read here in one query for the batch.
+    """
+    vehicle_ids = sorted(vehicle_ids)
+    versions = get_versions([vehicle_key(TRACK_VERSION, vehicle_id) for vehicle_id in vehicle_ids])
+    for vehicle_id, version in zip(vehicle_ids, versions):
+        if track_versions.get(vehicle_id, version) != version:
+            invalidate_vehicle_state(vehicle_id)
+            geofence_engine.invalidate(vehicle_id)
+        track_versions[vehicle_id] = version
+
+    last_positions = dict(db.session.execute(db.select(VehicleLastPosition.vehicle_id, VehicleLastPosition.timestamp).where(
+        VehicleLastPosition.vehicle_id.in_(vehicle_ids)
+    )).all())
+    for vehicle_id in vehicle_ids:
+        last_at = last_positions.get(vehicle_id)
+        if location_compactor is not None:
+            location_compactor.verify(vehicle_id, last_at)
+        stop_detector.verify(vehicle_id, last_at)
+        trip_segmenter.verify(vehicle_id, last_at)
+        geofence_engine.verify(vehicle_id, last_at)
+
+def ingest_busy():
+    response = jsonify({'error': 'Ingest queue is full, retry later'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+@api.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    token = current_app.config['METRICS_TOKEN']
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            return jsonify({'error': 'Invalid metrics token'}), 401
+    elif not current_user.is_authenticated:
+        return login_manager.unauthorized()
+    
+    return Response(render_metrics(current_app.config['METRICS_DIR']), 200, mimetype='text/plain; version=0.0.4')
+
+@api.route('/api/ingest/status', methods=['GET'])
+@login_required
+def ingest_status():
+    if ingest_queue is None:
+        return jsonify({'mode': 'sync'})
+    return jsonify(ingest_queue.stats())
+
+def parse_gps_point(point, now):
+    if not isinstance(point, dict):
+        return None, 'Point must be an object'
+    
+    if not all(field in point for field in ['device_id', 'latitude', 'longitude']):
+        return None, 'Missing required fields'
+    
+    vehicle = device_registry.get(point['device_id'])
+    if not vehicle:
+        return None, 'Vehicle not found'
+    if not vehicle.is_active:
+        return None, 'Vehicle is inactive'
+    
+    try:
+        latitude = float(point['latitude'])
+        longitude = float(point['longitude'])
+        speed = float(point.get('speed') or 0.0)
+    except (TypeError, ValueError):
+        return None, 'Invalid numeric value'
+    
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None, 'Coordinates out of range'
+    
+    timestamp = now
+    if point.get('timestamp'):
+        timestamp = parse_timestamp(point['timestamp'])
+        if timestamp is None:
+            return None, 'Invalid timestamp'
+        if timestamp > now + timedelta(minutes=5):
+            return None, 'Timestamp is in the future'
+    
+    return {
+        'vehicle_id': vehicle.vehicle_id,
+        'latitude': latitude,
+        'longitude': longitude,
+        'speed': speed,
+        'timestamp': timestamp
+    }, None
+
+def detect_and_save_stops(vehicle_id, latitude, longitude, timestamp):
+    stop = stop_detector.observe(vehicle_id, latitude, longitude, timestamp)
+    if stop:
+        saved_loc = SavedLocation(vehicle_id=vehicle_id, **stop)
+        db.session.add(saved_loc)
+        return saved_loc
+    return None
+
+def evaluate_geofences(rows):
+    events = []
+    for row in rows:
+        events.extend(geofence_engine.observe(row['vehicle_id'], row['latitude'], row['longitude'], row['timestamp']))
+    
+    if events:
+        db.session.execute(db.insert(GeofenceEvent), events)
+    return events
+
+def ingest_events(rows, stops, fence_events=()):
+    """Live events for an ingested batch, as [(event, vehicle_id, data)]."""
+    events = []
+    latest = {}
+    for row in rows:
+        if row['vehicle_id'] not in latest or row['timestamp'] >= latest[row['vehicle_id']]['timestamp']:
+            latest[row['vehicle_id']] = row
+    
+    for vehicle_id, row in latest.items():
+        events.append(('position', vehicle_id, {
+            'vehicle_id': vehicle_id,
+            'latitude': row['latitude'],
+            'longitude': row['longitude'],
+            'speed': row['speed'],
+            'timestamp': row['timestamp'].isoformat()
+        }))
+    
+    for sl in stops:
+        events.append(('stop', sl.vehicle_id, {
+            'vehicle_id': sl.vehicle_id,
+            'id': sl.id,
+            'name': sl.name,
+            'latitude': sl.latitude,
+            'longitude': sl.longitude,
+            'stop_duration_minutes': sl.stop_duration_minutes,
+            'visit_type': sl.visit_type,
+            'timestamp': sl.timestamp.isoformat(),
+            'notes': sl.notes
+        }))
+    
+    for event in fence_events:
+        events.append(('geofence', event['vehicle_id'], {**event, 'timestamp': event['timestamp'].isoformat()}))
+    return events
+
+@api.route('/api/stream', methods=['GET'])
+@login_required
+def stream_events():
+    vehicle_ids = None
+    if request.args.get('vehicles'):
+        try:
+            vehicle_ids = {int(v) for v in request.args['vehicles'].split(',')}
+        except ValueError:
+            return jsonify({'error': 'vehicles must be a comma-separated list of ids'}), 400
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    if is_postgresql():
+        live_relay.start(db.engine)
+    subscription = live_hub.subscribe(vehicle_ids, last_event_id, current_app.config['LIVE_STREAMS_PER_WORKER'])
+    if subscription is None:
+        response = jsonify({'error': 'Too many live streams, retry later'})
+        response.headers['Retry-After'] = '10'
+        return response, 503
+    
+    response = Response(live_hub.stream(subscription), 200, {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Frees the slot even if the client leaves before the stream starts
+    response.call_on_close(lambda: live_hub.unsubscribe(subscription))
+    return response
+
+MAX_VEHICLES_PAGE = 1000
+VEHICLE_FIELDS = ('id', 'name', 'device_id', 'is_active')
+
+@api.route('/api/vehicles', methods=['GET'])
 @login_required
 def get_vehicles():
-    vehicles = Vehicle.query.all()
-    return jsonify([{
+    return cached_response(response_cache, get_versions([VEHICLES_VERSION]), build_vehicles_page)
+
+def build_vehicles_page():
+    try:
+        limit, after = page_params(request.args, MAX_VEHICLES_PAGE, MAX_VEHICLES_PAGE)
+        fields = parse_fields(request.args, VEHICLE_FIELDS)
+        vehicles, next_cursor = paginate(Vehicle.query, None, Vehicle.id, limit, after, descending=False)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return page_response([{
         'id': v.id,
         'name': v.name,
         'device_id': v.device_id,
         'is_active': v.is_active
-    } for v in vehicles])
+    } for v in vehicles], next_cursor, fields)
+
+@api.route('/api/fleet/snapshot', methods=['GET'])
+@login_required
+def get_fleet_snapshot():
+    versions = get_versions([VEHICLES_VERSION], prefix=vehicle_key(LOCATIONS_VERSION, ''))
+    return cached_response(response_cache, versions, build_fleet_snapshot)
+
+def build_fleet_snapshot():
+    rows = db.session.execute(db.select(
+        Vehicle.id, Vehicle.name, Vehicle.device_id, Vehicle.is_active,
+        VehicleLastPosition.latitude, VehicleLastPosition.longitude, VehicleLastPosition.speed, VehicleLastPosition.timestamp
+    ).outerjoin(VehicleLastPosition, VehicleLastPosition.vehicle_id == Vehicle.id).order_by(Vehicle.id)).all()
+    
+    return json_response([{
+        'id': vehicle_id,
+        'name': name,
+        'device_id': device_id,
+        'is_active': is_active,
+        'last_location': {
+            'latitude': latitude,
+            'longitude': longitude,
+            'speed': speed,
+            'timestamp': timestamp
+        } if timestamp is not None else None
+    } for vehicle_id, name, device_id, is_active, latitude, longitude, speed, timestamp in rows])
 
-@app.route('/api/vehicles/<int:vehicle_id>/location', methods=['GET'])
+@api.route('/api/vehicles/<int:vehicle_id>/location', methods=['GET'])
 @login_required
 def get_vehicle_location(vehicle_id):
-    location = Location.query.filter_by(vehicle_id=vehicle_id).order_by(Location.timestamp.desc()).first()
+    location = db.session.get(VehicleLastPosition, vehicle_id)
     
     if not location:
         return jsonify({'error': 'No location data'}), 404
@@ -216,41 +687,113 @@ def get_vehicle_location(vehicle_id):
         'timestamp': location.timestamp.isoformat()
     })
 
-@app.route('/api/vehicles/<int:vehicle_id>/history', methods=['GET'])
+MAX_HISTORY_PAGE = MAX_SIMPLIFIED_POINTS
+RELATIVE_WINDOW_CACHE_SECONDS = 30
+
+@api.route('/api/vehicles/<int:vehicle_id>/history', methods=['GET'])
 @login_required
 def get_vehicle_history(vehicle_id):
-    hours = request.args.get('hours', default=24, type=int)
-    time_window = datetime.utcnow() - timedelta(hours=hours)
+    versions = get_versions([LOCATIONS_VERSION, vehicle_key(LOCATIONS_VERSION, vehicle_id)])
+    # A window given in hours ends now, so its tail moves even without new data
+    window_seconds = RELATIVE_WINDOW_CACHE_SECONDS if not request.args.get('start') else None
+    return cached_response(response_cache, versions, lambda: build_vehicle_history(vehicle_id), window_seconds)
+
+def build_vehicle_history(vehicle_id):
+    start, end, error = parse_time_range(request.args)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    max_points = request.args.get('max_points', type=int)
+    tolerance_m = request.args.get('tolerance_m', type=float)
+    zoom = request.args.get('zoom', type=int)
+    
+    if max_points is not None or tolerance_m is not None or zoom is not None:
+        if max_points is not None and not 2 <= max_points <= MAX_HISTORY_PAGE:
+            return jsonify({'error': f'max_points must be between 2 and {MAX_HISTORY_PAGE}'}), 400
+        if tolerance_m is not None and not tolerance_m >= 0:
+            return jsonify({'error': 'tolerance_m must not be negative'}), 400
+        if zoom is not None and not 0 <= zoom <= 22:
+            return jsonify({'error': 'zoom must be between 0 and 22'}), 400
+        return json_response(simplified_history(vehicle_id, start, end, tolerance_m, max_points, zoom))
     
-    locations = Location.query.filter(
-        Location.vehicle_id == vehicle_id,
-        Location.timestamp >= time_window
-    ).order_by(Location.timestamp.asc()).all()
+    try:
+        limit, after = page_params(request.args, MAX_HISTORY_PAGE, MAX_HISTORY_PAGE)
+        fields = parse_fields(request.args, LOCATION_FIELDS)
+        if after is not None and (len(after) != 2 or not isinstance(after[0], datetime)):
+            raise ValueError('Invalid cursor')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    rows, position = location_page(vehicle_id, start, end, limit, after)
+    return page_response([row_dict(row) for row in rows], encode_cursor(*position) if position else None, fields)
+
+MAX_TRIPS_PAGE = 500
+
+@api.route('/api/vehicles/<int:vehicle_id>/trips', methods=['GET'])
+@login_required
+def get_vehicle_trips(vehicle_id):
+    try:
+        limit, after = page_params(request.args, 50, MAX_TRIPS_PAGE)
+        fields = parse_fields(request.args, TRIP_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    query = Trip.query.filter(Trip.vehicle_id == vehicle_id)
+    if request.args.get('start'):
+        start = parse_timestamp(request.args['start'])
+        if start is None:
+            return jsonify({'error': 'Invalid start timestamp'}), 400
+        query = query.filter(Trip.start_time >= start)
+    if request.args.get('end'):
+        end = parse_timestamp(request.args['end'])
+        if end is None:
+            return jsonify({'error': 'Invalid end timestamp'}), 400
+        query = query.filter(Trip.start_time < end)
+    
+    try:
+        trips, next_cursor = paginate(query, Trip.start_time, Trip.id, limit, after)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    return jsonify([{
-        'latitude': loc.latitude,
-        'longitude': loc.longitude,
-        'speed': loc.speed,
-        'timestamp': loc.timestamp.isoformat()
-    } for loc in locations])
+    return page_response([serialize_trip(t) for t in trips], next_cursor, fields)
 
-@app.route('/api/vehicles/<int:vehicle_id>/saved-locations', methods=['GET'])
+@api.route('/api/vehicles/<int:vehicle_id>/trips/<int:trip_id>', methods=['GET'])
+@login_required
+def get_vehicle_trip(vehicle_id, trip_id):
+    trip = Trip.query.filter_by(id=trip_id, vehicle_id=vehicle_id).first()
+    if not trip:
+        return jsonify({'error': 'Trip not found'}), 404
+    
+    if trip.polyline:
+        polyline = json.loads(trip.polyline)
+    else:
+        polyline = track_polyline(load_track(vehicle_id, trip.start_time, trip.end_time + timedelta(microseconds=1)))
+    return jsonify(serialize_trip(trip, polyline))
+
+MAX_SAVED_LOCATIONS_PAGE = 1000
+SAVED_LOCATION_FIELDS = ('id', 'name', 'latitude', 'longitude', 'stop_duration_minutes', 'visit_type', 'timestamp', 'notes')
+
+@api.route('/api/vehicles/<int:vehicle_id>/saved-locations', methods=['GET'])
 @login_required
 def get_saved_locations(vehicle_id):
-    saved_locs = SavedLocation.query.filter_by(vehicle_id=vehicle_id).order_by(SavedLocation.timestamp.desc()).all()
-    
-    return jsonify([{
-        'id': sl.id,
-        'name': sl.name,
-        'latitude': sl.latitude,
-        'longitude': sl.longitude,
-        'stop_duration_minutes': sl.stop_duration_minutes,
-        'visit_type': sl.visit_type,
-        'timestamp': sl.timestamp.isoformat(),
-        'notes': sl.notes
-    } for sl in saved_locs])
+    versions = get_versions([vehicle_key(SAVED_LOCATIONS_VERSION, vehicle_id)])
+    return cached_response(response_cache, versions, lambda: build_saved_locations_page(vehicle_id))
+
+def build_saved_locations_page(vehicle_id):
+    try:
+        limit, after = page_params(request.args, MAX_SAVED_LOCATIONS_PAGE, MAX_SAVED_LOCATIONS_PAGE)
+        fields = parse_fields(request.args, SAVED_LOCATION_FIELDS)
+        query = db.session.query(
+            SavedLocation.id, SavedLocation.name, SavedLocation.latitude, SavedLocation.longitude,
+            SavedLocation.stop_duration_minutes, SavedLocation.visit_type, SavedLocation.timestamp, SavedLocation.notes
+        ).filter(SavedLocation.vehicle_id == vehicle_id)
+        rows, next_cursor = paginate(query, SavedLocation.timestamp, SavedLocation.id, limit, after)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return page_response(row_records(rows), next_cursor, fields)
 
-@app.route('/api/vehicles/<int:vehicle_id>/saved-locations', methods=['POST'])
+@api.route('/api/vehicles/<int:vehicle_id>/saved-locations', methods=['POST'])
 @login_required
 def save_location(vehicle_id):
     data = request.json
@@ -264,11 +807,13 @@ def save_location(vehicle_id):
         notes=data.get('notes', '')
     )
     db.session.add(saved_loc)
+    bump_version(vehicle_key(SAVED_LOCATIONS_VERSION, vehicle_id))
     db.session.commit()
+    stop_detector.note_saved_location(vehicle_id, saved_loc.timestamp)
     
     return jsonify({'message': 'Location saved', 'id': saved_loc.id}), 201
 
-@app.route('/api/vehicles/<int:vehicle_id>/saved-locations/<int:location_id>', methods=['PUT'])
+@api.route('/api/vehicles/<int:vehicle_id>/saved-locations/<int:location_id>', methods=['PUT'])
 @login_required
 def update_saved_location(vehicle_id, location_id):
     data = request.json
@@ -282,10 +827,11 @@ def update_saved_location(vehicle_id, location_id):
     if 'notes' in data:
         saved_loc.notes = data['notes']
     
+    bump_version(vehicle_key(SAVED_LOCATIONS_VERSION, vehicle_id))
     db.session.commit()
     return jsonify({'message': 'Location updated', 'id': saved_loc.id})
 
-@app.route('/api/vehicles/<int:vehicle_id>/saved-locations/<int:location_id>', methods=['DELETE'])
+@api.route('/api/vehicles/<int:vehicle_id>/saved-locations/<int:location_id>', methods=['DELETE'])
 @login_required
 def delete_saved_location(vehicle_id, location_id):
     saved_loc = SavedLocation.query.filter_by(id=location_id, vehicle_id=vehicle_id).first()
@@ -294,90 +840,95 @@ def delete_saved_location(vehicle_id, location_id):
         return jsonify({'error': 'Location not found'}), 404
     
     db.session.delete(saved_loc)
+    bump_version(vehicle_key(SAVED_LOCATIONS_VERSION, vehicle_id))
     db.session.commit()
+    stop_detector.invalidate(vehicle_id)
     return jsonify({'message': 'Location deleted'})
 
-@app.route('/api/vehicles/<int:vehicle_id>/export', methods=['GET'])
+@api.route('/api/vehicles/<int:vehicle_id>/export', methods=['GET'])
 @login_required
 def export_vehicle_data(vehicle_id):
     format_type = request.args.get('format', 'json')
-    hours = request.args.get('hours', default=24, type=int)
-    time_window = datetime.utcnow() - timedelta(hours=hours)
+    if format_type not in EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported format (use {", ".join(EXPORT_FORMATS)})'}), 400
     
-    locations = Location.query.filter(
-        Location.vehicle_id == vehicle_id,
-        Location.timestamp >= time_window
-    ).order_by(Location.timestamp.asc()).all()
+    start, end, error = parse_time_range(request.args)
+    if error:
+        return jsonify({'error': error}), 400
     
-    if format_type == 'csv':
-        import io
-        import csv
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['Timestamp', 'Latitude', 'Longitude', 'Speed'])
-        
-        for loc in locations:
-            writer.writerow([loc.timestamp.isoformat(), loc.latitude, loc.longitude, loc.speed])
-        
-        return output.getvalue(), 200, {
-            'Content-Type': 'text/csv',
-            'Content-Disposition': f'attachment; filename=vehicle_{vehicle_id}_data.csv'
-        }
+    chunks = iter_locations(vehicle_id, start, end)
+    content_type, extension = EXPORT_FORMATS[format_type]
     
-    return jsonify([{
-        'timestamp': loc.timestamp.isoformat(),
-        'latitude': loc.latitude,
-        'longitude': loc.longitude,
-        'speed': loc.speed
-    } for loc in locations])
+    if format_type == 'csv':
+        # The dwell columns are only added where compaction is on, so plain exports keep their format
+        body = stream_csv(chunks, current_app.config['LOCATION_COMPACTION'])
+    elif format_type == 'ndjson':
+        body = stream_ndjson(chunks)
+    elif format_type == 'gpx':
+        vehicle = db.session.get(Vehicle, vehicle_id)
+        body = stream_gpx(chunks, vehicle.name if vehicle else f'Vehicle {vehicle_id}')
+    else:
+        body = stream_json(chunks)
+    
+    headers = {'Content-Type': content_type}
+    if format_type != 'json':
+        headers['Content-Disposition'] = f'attachment; filename=vehicle_{vehicle_id}_data.{extension}'
+    
+    return Response(stream_with_context(body), 200, headers)
 
-@app.route('/api/vehicles/<int:vehicle_id>/stats', methods=['GET'])
+def parse_time_range(args, default_hours=24):
+    end = None
+    if args.get('end'):
+        end = parse_timestamp(args['end'])
+        if end is None:
+            return None, None, 'Invalid end timestamp'
+    
+    if args.get('start'):
+        start = parse_timestamp(args['start'])
+        if start is None:
+            return None, None, 'Invalid start timestamp'
+    else:
+        hours = args.get('hours', default=default_hours, type=int)
+        start = (end or datetime.utcnow()) - timedelta(hours=hours)
+    
+    if end is not None and end <= start:
+        return None, None, 'end must be after start'
+    
+    return start, end, None
+
+@api.route('/api/vehicles/<int:vehicle_id>/stats', methods=['GET'])
 @login_required
 def get_vehicle_stats(vehicle_id):
     hours = request.args.get('hours', default=24, type=int)
     time_window = datetime.utcnow() - timedelta(hours=hours)
     
-    locations = Location.query.filter(
-        Location.vehicle_id == vehicle_id,
-        Location.timestamp >= time_window
-    ).all()
-    
-    if not locations:
-        return jsonify({'total_points': 0, 'avg_speed': 0, 'max_speed': 0, 'distance_km': 0})
-    
-    speeds = [loc.speed for loc in locations]
-    avg_speed = sum(speeds) / len(speeds) if speeds else 0
-    max_speed = max(speeds) if speeds else 0
-    
-    total_distance = 0
-    for i in range(1, len(locations)):
-        prev = locations[i-1]
-        curr = locations[i]
-        total_distance += calculate_distance(prev.latitude, prev.longitude, curr.latitude, curr.longitude)
-    
-    return jsonify({
-        'total_points': len(locations),
-        'avg_speed': round(avg_speed, 2),
-        'max_speed': round(max_speed, 2),
-        'distance_km': round(total_distance, 2),
-        'time_period_hours': hours
-    })
+    stats = format_stats(window_summary(vehicle_id, time_window))
+    stats['time_period_hours'] = hours
+    return jsonify(stats)
 
-@app.route('/api/users', methods=['GET'])
+MAX_USERS_PAGE = 1000
+USER_FIELDS = ('id', 'username', 'email', 'is_active', 'role', 'created_at')
+
+@api.route('/api/users', methods=['GET'])
 @login_required
 def get_users():
-    users = User.query.all()
-    return jsonify([{
+    try:
+        limit, after = page_params(request.args, MAX_USERS_PAGE, MAX_USERS_PAGE)
+        fields = parse_fields(request.args, USER_FIELDS)
+        users, next_cursor = paginate(User.query, None, User.id, limit, after, descending=False)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return page_response([{
         'id': u.id,
         'username': u.username,
         'email': u.email,
         'is_active': u.is_active,
         'role': u.role,
         'created_at': u.created_at.isoformat()
-    } for u in users])
+    } for u in users], next_cursor, fields)
 
-@app.route('/api/users/<int:user_id>', methods=['PUT'])
+@api.route('/api/users/<int:user_id>', methods=['PUT'])
 @login_required
 def update_user(user_id):
     data = request.json
@@ -407,10 +958,11 @@ def update_user(user_id):
     if 'role' in data:
         user.role = data['role']
     
+    bump_version(USERS_VERSION)
     db.session.commit()
     return jsonify({'message': 'User updated successfully'})
 
-@app.route('/api/users/<int:user_id>', methods=['DELETE'])
+@api.route('/api/users/<int:user_id>', methods=['DELETE'])
 @login_required
 def delete_user(user_id):
     if user_id == current_user.id:
@@ -421,10 +973,11 @@ def delete_user(user_id):
         return jsonify({'error': 'User not found'}), 404
     
     db.session.delete(user)
+    bump_version(USERS_VERSION)
     db.session.commit()
     return jsonify({'message': 'User deleted successfully'})
 
-@app.route('/api/vehicles', methods=['POST'])
+@api.route('/api/vehicles', methods=['POST'])
 @login_required
 def create_vehicle():
     data = request.json
@@ -440,7 +993,9 @@ def create_vehicle():
     )
     
     db.session.add(vehicle)
+    bump_version(VEHICLES_VERSION)
     db.session.commit()
+    device_registry.invalidate()
     
     return jsonify({
         'message': 'Vehicle created successfully',
@@ -452,7 +1007,7 @@ def create_vehicle():
         }
     }), 201
 
-@app.route('/api/vehicles/<int:vehicle_id>', methods=['PUT'])
+@api.route('/api/vehicles/<int:vehicle_id>', methods=['PUT'])
 @login_required
 def update_vehicle(vehicle_id):
     data = request.json
@@ -473,10 +1028,12 @@ def update_vehicle(vehicle_id):
     if 'is_active' in data:
         vehicle.is_active = data['is_active']
     
+    bump_version(VEHICLES_VERSION)
     db.session.commit()
+    device_registry.invalidate()
     return jsonify({'message': 'Vehicle updated successfully'})
 
-@app.route('/api/vehicles/<int:vehicle_id>', methods=['DELETE'])
+@api.route('/api/vehicles/<int:vehicle_id>', methods=['DELETE'])
 @login_required
 def delete_vehicle(vehicle_id):
     vehicle = Vehicle.query.get(vehicle_id)
@@ -485,16 +1042,105 @@ def delete_vehicle(vehicle_id):
         return jsonify({'error': 'Vehicle not found'}), 404
     
     db.session.delete(vehicle)
+    bump_version(VEHICLES_VERSION)
+    bump_version(vehicle_key(LOCATIONS_VERSION, vehicle_id))
+    bump_version(vehicle_key(SAVED_LOCATIONS_VERSION, vehicle_id))
     db.session.commit()
+    delete_vehicle_archive(vehicle_id)
+    device_registry.invalidate()
+    invalidate_vehicle_state(vehicle_id)
+    geofence_engine.invalidate(vehicle_id)
     return jsonify({'message': 'Vehicle deleted successfully'})
 
-@app.route('/api/places-of-interest', methods=['GET'])
+def invalidate_vehicle_state(vehicle_id):
+    """Drop this process's ingest state for a vehicle whose history changed."""
+    if location_compactor is not None:
+        location_compactor.invalidate(vehicle_id)
+    stop_detector.invalidate(vehicle_id)
+    trip_segmenter.invalidate(vehicle_id)
+
+@api.route('/api/vehicles/<int:vehicle_id>/import', methods=['POST'])
+@login_required
+def import_vehicle_track(vehicle_id):
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Admin access required'}), 403
+    if db.session.get(Vehicle, vehicle_id) is None:
+        return jsonify({'error': 'Vehicle not found'}), 404
+    
+    # A raw body is read as it arrives; multipart files are spooled to disk by the form parser
+    upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+    format_type = request.args.get('format') or detect_format(upload.filename if upload else None, request.mimetype)
+    if format_type not in IMPORT_FORMATS:
+        return jsonify({'error': f'Unsupported format (use {", ".join(IMPORT_FORMATS)})'}), 400
+    
+    stream = upload.stream if upload else io.BufferedReader(request.stream)
+    result = import_track(vehicle_id, stream, format_type, current_app.config['LOCATIONS_PARTITION_INTERVAL'])
+    invalidate_vehicle_state(vehicle_id)
+    failed = result.get('error') or not (result['imported'] or result['duplicates'])
+    return json_response(result, 400 if failed else 200)
+
+MAX_PLACES_PAGE = 1000
+PLACE_FIELDS = ('id', 'name', 'address', 'latitude', 'longitude', 'category', 'description', 'created_at', 'created_by', 'distance_m')
+MAX_PLACES_RADIUS_M = 100000
+
+@api.route('/api/places-of-interest', methods=['GET'])
 @login_required
 def get_places_of_interest():
+    # Places show their creator's username
+    versions = get_versions([PLACES_VERSION, USERS_VERSION])
+    return cached_response(response_cache, versions, build_places_page)
+
+def build_places_page():
     from app.models import PlaceOfInterest
-    places = PlaceOfInterest.query.order_by(PlaceOfInterest.created_at.desc()).all()
+    try:
+        limit, after = page_params(request.args, MAX_PLACES_PAGE, MAX_PLACES_PAGE)
+        fields = parse_fields(request.args, PLACE_FIELDS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if request.args.get('bbox') and request.args.get('near'):
+        return jsonify({'error': 'Use either bbox or near, not both'}), 400
     
-    return jsonify([{
+    bbox = near = radius_m = None
+    try:
+        if request.args.get('bbox'):
+            west, south, east, north = [float(v) for v in request.args['bbox'].split(',')]
+            bbox = (south, west, north, east)
+        if request.args.get('near'):
+            near = tuple(float(v) for v in request.args['near'].split(','))
+            radius_m = float(request.args.get('radius_m', 1000))
+            if len(near) != 2 or not 0 < radius_m <= MAX_PLACES_RADIUS_M:
+                raise ValueError
+    except ValueError:
+        return jsonify({'error': f'Use bbox=west,south,east,north or near=lat,lon&radius_m=1..{MAX_PLACES_RADIUS_M}'}), 400
+    
+    try:
+        if bbox is None and near is None:
+            query = PlaceOfInterest.query.options(db.joinedload(PlaceOfInterest.creator))
+            places, next_cursor = paginate(query, None, PlaceOfInterest.id, limit, after)
+            return page_response([serialize_place(p) for p in places], next_cursor, fields)
+        
+        # Newest first for bbox, nearest first for near; the grid index already holds them in memory
+        if near is not None:
+            position = lambda match: (match[1], match[0])
+        else:
+            position = lambda match: (-match[0],)
+        matches = sorted(find_places(bbox, near, radius_m), key=position)
+        matches, next_cursor = paginate_list(matches, position, limit, after)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid cursor'}), 400
+    
+    places = {p.id: p for p in PlaceOfInterest.query.options(db.joinedload(PlaceOfInterest.creator)).filter(
+        PlaceOfInterest.id.in_([place_id for place_id, _ in matches])
+    )}
+    
+    return page_response([
+        serialize_place(places[place_id], distance_m)
+        for place_id, distance_m in matches if place_id in places
+    ], next_cursor, fields)
+
+def serialize_place(p, distance_m=None):
+    place = {
         'id': p.id,
         'name': p.name,
         'address': p.address,
@@ -504,9 +1150,12 @@ def get_places_of_interest():
         'description': p.description,
         'created_at': p.created_at.isoformat(),
         'created_by': p.creator.username if p.creator else None
-    } for p in places])
+    }
+    if distance_m is not None:
+        place['distance_m'] = round(distance_m, 1)
+    return place
 
-@app.route('/api/places-of-interest', methods=['POST'])
+@api.route('/api/places-of-interest', methods=['POST'])
 @login_required
 def create_place_of_interest():
     from app.models import PlaceOfInterest
@@ -523,7 +1172,9 @@ def create_place_of_interest():
     )
     
     db.session.add(place)
+    bump_version(PLACES_VERSION)
     db.session.commit()
+    geofence_engine.invalidate()
     
     return jsonify({
         'message': 'Place of interest created successfully',
@@ -535,7 +1186,7 @@ def create_place_of_interest():
         }
     }), 201
 
-@app.route('/api/places-of-interest/<int:place_id>', methods=['PUT'])
+@api.route('/api/places-of-interest/<int:place_id>', methods=['PUT'])
 @login_required
 def update_place_of_interest(place_id):
     from app.models import PlaceOfInterest
@@ -559,10 +1210,12 @@ def update_place_of_interest(place_id):
     if 'description' in data:
         place.description = data['description']
     
+    bump_version(PLACES_VERSION)
     db.session.commit()
+    geofence_engine.invalidate()
     return jsonify({'message': 'Place updated successfully'})
 
-@app.route('/api/places-of-interest/<int:place_id>', methods=['DELETE'])
+@api.route('/api/places-of-interest/<int:place_id>', methods=['DELETE'])
 @login_required
 def delete_place_of_interest(place_id):
     from app.models import PlaceOfInterest
@@ -572,44 +1225,154 @@ def delete_place_of_interest(place_id):
         return jsonify({'error': 'Place not found'}), 404
     
     db.session.delete(place)
+    bump_version(PLACES_VERSION)
     db.session.commit()
+    geofence_engine.invalidate()
     return jsonify({'message': 'Place deleted successfully'})
 
-@app.route('/api/geocode', methods=['GET'])
+@api.route('/api/geofences', methods=['GET'])
+@login_required
+def get_geofences():
+    fences = Geofence.query.order_by(Geofence.created_at.desc()).all()
+    return jsonify([serialize_geofence(g) for g in fences])
+
+@api.route('/api/geofences', methods=['POST'])
+@login_required
+def create_geofence():
+    data = request.json
+    fence = Geofence(created_by=current_user.id)
+    
+    error = apply_geofence_fields(fence, data, require_all=True)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    db.session.add(fence)
+    bump_version(GEOFENCES_VERSION)
+    db.session.commit()
+    geofence_engine.invalidate()
+    
+    return jsonify({'message': 'Geofence created successfully', 'geofence': serialize_geofence(fence)}), 201
+
+@api.route('/api/geofences/<int:fence_id>', methods=['PUT'])
+@login_required
+def update_geofence(fence_id):
+    fence = db.session.get(Geofence, fence_id)
+    
+    if not fence:
+        return jsonify({'error': 'Geofence not found'}), 404
+    
+    error = apply_geofence_fields(fence, request.json)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    bump_version(GEOFENCES_VERSION)
+    db.session.commit()
+    geofence_engine.invalidate()
+    return jsonify({'message': 'Geofence updated successfully'})
+
+@api.route('/api/geofences/<int:fence_id>', methods=['DELETE'])
+@login_required
+def delete_geofence(fence_id):
+    fence = db.session.get(Geofence, fence_id)
+    
+    if not fence:
+        return jsonify({'error': 'Geofence not found'}), 404
+    
+    db.session.delete(fence)
+    bump_version(GEOFENCES_VERSION)
+    db.session.commit()
+    geofence_engine.invalidate()
+    return jsonify({'message': 'Geofence deleted successfully'})
+
+def apply_geofence_fields(fence, data, require_all=False):
+    kind = data.get('kind', fence.kind or 'circle')
+    if kind not in ('circle', 'polygon'):
+        return 'kind must be circle or polygon'
+    
+    if require_all and not data.get('name'):
+        return 'Missing required fields'
+    
+    if 'dwell_seconds' in data:
+        dwell_seconds = data['dwell_seconds']
+        if isinstance(dwell_seconds, str) and dwell_seconds.strip().isdigit():
+            dwell_seconds = int(dwell_seconds)
+        if isinstance(dwell_seconds, bool) or not isinstance(dwell_seconds, int) or not 0 <= dwell_seconds <= MAX_DWELL_SECONDS:
+            return f'dwell_seconds must be a whole number of seconds from 0 to {MAX_DWELL_SECONDS}'
+    
+    try:
+        if kind == 'circle' and (require_all or kind != fence.kind or any(k in data for k in ('latitude', 'longitude', 'radius_m'))):
+            latitude = float(data.get('latitude', fence.latitude))
+            longitude = float(data.get('longitude', fence.longitude))
+            radius_m = float(data.get('radius_m', fence.radius_m))
+            if not (-90 <= latitude <= 90 and -180 <= longitude <= 180 and 0 < radius_m <= 100000):
+                return 'Circle needs valid latitude, longitude and radius_m (up to 100 km)'
+            fence.latitude, fence.longitude, fence.radius_m, fence.polygon = latitude, longitude, radius_m, None
+        
+        if kind == 'polygon' and (require_all or 'polygon' in data or kind != fence.kind):
+            polygon = [[float(lat), float(lon)] for lat, lon in data['polygon']]
+            if len(polygon) < 3:
+                return 'polygon needs at least 3 [lat, lon] points'
+            fence.latitude, fence.longitude, fence.radius_m = polygon_bounds(polygon)
+            fence.polygon = json.dumps(polygon)
+        
+    except (KeyError, TypeError, ValueError):
+        return 'Invalid geofence geometry'
+    
+    fence.kind = kind
+    if 'dwell_seconds' in data:
+        fence.dwell_seconds = dwell_seconds
+    if 'name' in data:
+        fence.name = data['name']
+    if 'is_active' in data:
+        fence.is_active = data['is_active']
+    return None
+
+MAX_GEOFENCE_EVENTS_PAGE = 5000
+
+@api.route('/api/geofence-events', methods=['GET'])
+@login_required
+def get_geofence_events():
+    query = GeofenceEvent.query
+    
+    vehicle_id = request.args.get('vehicle_id', type=int)
+    if vehicle_id is not None:
+        query = query.filter(GeofenceEvent.vehicle_id == vehicle_id)
+    
+    if request.args.get('fence_type'):
+        query = query.filter(GeofenceEvent.fence_type == request.args['fence_type'])
+    fence_id = request.args.get('fence_id', type=int)
+    if fence_id is not None:
+        query = query.filter(GeofenceEvent.fence_id == fence_id)
+    
+    start, end, error = parse_time_range(request.args)
+    if error:
+        return jsonify({'error': error}), 400
+    query = query.filter(GeofenceEvent.timestamp >= start)
+    if end is not None:
+        query = query.filter(GeofenceEvent.timestamp < end)
+    
+    try:
+        limit, after = page_params(request.args, 500, MAX_GEOFENCE_EVENTS_PAGE)
+        events, next_cursor = paginate(query, GeofenceEvent.timestamp, GeofenceEvent.id, limit, after)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return page_response([serialize_event(e) for e in events], next_cursor)
+
+@api.route('/api/geocode', methods=['GET'])
 @login_required
 def geocode_address():
-    """Geocode address using Nominatim (OpenStreetMap)"""
+    """Geocode address using the configured provider (default: Nominatim)"""
     address = request.args.get('address', '')
     
-    if not address:
+    query = normalize_query(address)
+    if not query:
         return jsonify({'error': 'Address parameter required'}), 400
     
-    import urllib.parse
-    import urllib.request
-    import json
+    # Checked after normalizing, which can lengthen it, since the cache stores that form
+    if len(query) > 500:
+        return jsonify({'error': 'Address too long'}), 400
     
     try:
-        encoded_address = urllib.parse.quote(address)
-        url = f'https://nominatim.openstreetmap.org/search?q={encoded_address}&format=json&limit=5'
-        
-        req = urllib.request.Request(url)
-        req.add_header('User-Agent', 'GPS-Tracker-App/1.0')
-        
-        with urllib.request.urlopen(req, timeout=5) as response:
-            data = json.loads(response.read().decode())
-            
-        results = [{
-            'name': item.get('display_name', ''),
-            'latitude': float(item.get('lat', 0)),
-            'longitude': float(item.get('lon', 0)),
-            'type': item.get('type', ''),
-            'importance': item.get('importance', 0)
-        } for item in data]
-        
-        return jsonify(results)
-        
+        return jsonify(geocoder.search(address))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-
-if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0')
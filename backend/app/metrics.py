@@ -0,0 +1,249 @@
+"""Request, SQL and ingest metrics, exposed in Prometheus text format.
+
+Request hooks time every request by route (the URL rule, so ids in paths do
+not create new series). SQLAlchemy cursor events count the queries and
+database time of each request; a request that runs the same statement
+N_PLUS_ONE_REPEATS times or more is counted as a likely N+1 pattern and
+the statement is logged once per route. Ingest records points, stored
+rows, stops and geofence events per batch.
+
+Everything is kept in process memory behind one lock, at a few
+microseconds per request and per query. Under Gunicorn each worker also
+writes its totals to METRICS_DIR every few seconds, and /api/metrics adds
+up the files of all workers, including ones that have exited.
+"""
+from bisect import bisect_left
+from collections import Counter, defaultdict
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+N_PLUS_ONE_REPEATS = 10
+WRITE_INTERVAL_SECONDS = 5
+EXITED_FILE = 'exited.json'
+
+METRICS = {
+    'gps_http_requests_total': ('counter', 'HTTP requests by route, method and status.'),
+    'gps_http_request_duration_seconds': ('histogram', 'Time to handle a request, including streamed bodies read with the request context.'),
+    'gps_db_queries_total': ('counter', 'SQL statements executed while handling requests, by route.'),
+    'gps_db_query_duration_seconds_total': ('counter', 'Time spent in SQL statements while handling requests, by route.'),
+    'gps_db_queries_per_request': ('histogram', 'SQL statements per request, by route.'),
+    'gps_db_n_plus_one_requests_total': ('counter', f'Requests that ran one statement {N_PLUS_ONE_REPEATS} or more times, by route.'),
+    'gps_ingest_batches_total': ('counter', 'Ingest batches committed.'),
+    'gps_ingest_points_total': ('counter', 'GPS points ingested.'),
+    'gps_ingest_rows_stored_total': ('counter', 'Location rows written after compaction.'),
+    'gps_ingest_stops_total': ('counter', 'Stops detected at ingest.'),
+    'gps_ingest_geofence_events_total': ('counter', 'Geofence events raised at ingest.'),
+    'gps_ingest_batch_duration_seconds': ('histogram', 'Time to process and commit one ingest batch.'),
+}
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._flagged = set()
+        self._written_at = 0
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            self._counters[(name, labels)] += value
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                # Per-bucket counts (the last is +Inf), then sum
+                histogram = self._histograms[(name, labels)] = [buckets, [0] * (len(buckets) + 1), 0.0]
+            histogram[1][bisect_left(buckets, value)] += 1
+            histogram[2] += value
+
+    def record_request(self, route, method, status, seconds, queries, query_seconds, repeats):
+        with self._lock:
+            self._counters[('gps_http_requests_total', (('route', route), ('method', method), ('status', str(status))))] += 1
+            if queries:
+                self._counters[('gps_db_queries_total', (('route', route),))] += queries
+                self._counters[('gps_db_query_duration_seconds_total', (('route', route),))] += query_seconds
+        self.observe('gps_http_request_duration_seconds', (('route', route), ('method', method)), seconds)
+        self.observe('gps_db_queries_per_request', (('route', route),), queries, QUERY_COUNT_BUCKETS)
+
+        if repeats:
+            statement, count = repeats.most_common(1)[0]
+            if count >= N_PLUS_ONE_REPEATS:
+                self.inc('gps_db_n_plus_one_requests_total', (('route', route),))
+                if (route, statement) not in self._flagged:
+                    self._flagged.add((route, statement))
+                    logger.warning('Possible N+1 queries in %s %s: %d x %s', method, route, count, ' '.join(statement.split())[:300])
+
+    def record_ingest(self, points, stored, stops, fence_events, seconds):
+        with self._lock:
+            self._counters[('gps_ingest_batches_total', ())] += 1
+            self._counters[('gps_ingest_points_total', ())] += points
+            self._counters[('gps_ingest_rows_stored_total', ())] += stored
+            self._counters[('gps_ingest_stops_total', ())] += stops
+            self._counters[('gps_ingest_geofence_events_total', ())] += fence_events
+        self.observe('gps_ingest_batch_duration_seconds', (), seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'histograms': [[name, list(labels), list(buckets), list(counts), total]
+                               for (name, labels), (buckets, counts, total) in self._histograms.items()],
+            }
+
+    def write(self, directory, force=False):
+        """Save this process's totals to directory/<pid>.json, at most every WRITE_INTERVAL_SECONDS."""
+        now = time.monotonic()
+        if not force and now - self._written_at < WRITE_INTERVAL_SECONDS:
+            return
+        self._written_at = now
+        _write_json(os.path.join(directory, f'{os.getpid()}.json'), self.snapshot())
+
+metrics = Metrics()
+
+def init_metrics(app):
+    app.before_request(_start_request)
+    app.after_request(_note_status)
+    app.teardown_request(_finish_request)
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    if app.config.get('METRICS_DIR'):
+        os.makedirs(app.config['METRICS_DIR'], exist_ok=True)
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+    g.metrics_sql = [0, 0.0, Counter()]
+
+def _note_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+def _finish_request(exc):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return
+    queries, query_seconds, repeats = g.pop('metrics_sql')
+    status = g.pop('metrics_status', 500 if exc is not None else 200)
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.record_request(route, request.method, status, time.perf_counter() - started, queries, query_seconds, repeats)
+
+    directory = current_app.config.get('METRICS_DIR')
+    if directory:
+        try:
+            metrics.write(directory)
+        except OSError as e:
+            logger.warning('Could not write metrics to %s: %s', directory, e)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if not starts or not has_request_context():
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    sql = g.get('metrics_sql')
+    if sql is not None:
+        sql[0] += 1
+        sql[1] += elapsed
+        sql[2][statement] += 1
+
+def render(directory=None):
+    """Prometheus text exposition of this process, or of every worker writing to directory."""
+    if directory:
+        metrics.write(directory, force=True)
+        snapshots = [s for s in map(_read_json, glob.glob(os.path.join(directory, '*.json'))) if s]
+    else:
+        snapshots = [metrics.snapshot()]
+    counters, histograms = _merge(snapshots)
+
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for labels, value in sorted(counters.get(name, {}).items()):
+                lines.append(f'{name}{_labels(labels)} {_number(value)}')
+            continue
+        for labels, (buckets, counts, total) in sorted(histograms.get(name, {}).items()):
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels + (("le", _number(bound)),))} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {_number(total)}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+def reset_metrics_dir(directory):
+    """Remove the files of a previous server run (call before workers start)."""
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        os.remove(path)
+
+def retire_worker(directory, pid):
+    """Fold an exited worker's totals into EXITED_FILE so its counters keep counting."""
+    path = os.path.join(directory, f'{pid}.json')
+    snapshot = _read_json(path)
+    if snapshot is None:
+        return
+    exited = os.path.join(directory, EXITED_FILE)
+    counters, histograms = _merge([s for s in (_read_json(exited), snapshot) if s])
+    _write_json(exited, {
+        'counters': [[name, [list(l) for l in labels], value] for name, series in counters.items() for labels, value in series.items()],
+        'histograms': [[name, [list(l) for l in labels], list(buckets), counts, total]
+                       for name, series in histograms.items() for labels, (buckets, counts, total) in series.items()],
+    })
+    os.remove(path)
+
+def _merge(snapshots):
+    counters = defaultdict(lambda: defaultdict(float))
+    histograms = defaultdict(dict)
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            counters[name][tuple(map(tuple, labels))] += value
+        for name, labels, buckets, counts, total in snapshot['histograms']:
+            key = tuple(map(tuple, labels))
+            current = histograms[name].get(key)
+            if current is None:
+                histograms[name][key] = (tuple(buckets), list(counts), total)
+            else:
+                histograms[name][key] = (current[0], [a + b for a, b in zip(current[1], counts)], current[2] + total)
+    return counters, histograms
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+def _number(value):
+    if isinstance(value, str):
+        return value
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None  # a worker that has just exited, or a file being replaced
+
+def _write_json(path, data):
+    temp = f'{path}.{threading.get_ident()}.tmp'
+    with open(temp, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp, path)
@@ -26,6 +26,11 @@ class Vehicle(db.Model):
     
     locations = db.relationship('Location', backref='vehicle', lazy=True, cascade='all, delete-orphan')
     saved_locations = db.relationship('SavedLocation', backref='vehicle', lazy=True, cascade='all, delete-orphan')
+    last_position = db.relationship('VehicleLastPosition', uselist=False, lazy=True, cascade='all, delete-orphan')
+    hourly_rollups = db.relationship('LocationHourlyRollup', lazy=True, cascade='all, delete-orphan')
+    geofence_events = db.relationship('GeofenceEvent', lazy=True, cascade='all, delete-orphan')
+    archive_days = db.relationship('LocationArchiveDay', lazy=True, cascade='all, delete-orphan')
+    trips = db.relationship('Trip', lazy=True, cascade='all, delete-orphan')
 
 class Location(db.Model):
     __tablename__ = 'locations'
@@ -36,6 +41,73 @@ class Location(db.Model):
     longitude = db.Column(db.Float, nullable=False)
     speed = db.Column(db.Float, default=0.0)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # Set when stationary pings were compacted into this row
+    dwell_until = db.Column(db.DateTime)
+    sample_count = db.Column(db.Integer, default=1)
+    
+    __table_args__ = (db.Index('ix_locations_vehicle_timestamp', 'vehicle_id', 'timestamp'),)
+    
+class VehicleLastPosition(db.Model):
+    __tablename__ = 'vehicle_last_position'
+    
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id'), primary_key=True)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    speed = db.Column(db.Float, default=0.0)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    
+class LocationHourlyRollup(db.Model):
+    __tablename__ = 'location_hourly_rollups'
+    
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id'), primary_key=True)
+    hour = db.Column(db.DateTime, primary_key=True)
+    point_count = db.Column(db.Integer, nullable=False, default=0)
+    distance_km = db.Column(db.Float, nullable=False, default=0.0)
+    speed_sum = db.Column(db.Float, nullable=False, default=0.0)
+    speed_max = db.Column(db.Float, nullable=False, default=0.0)
+    moving_seconds = db.Column(db.Float, nullable=False, default=0.0)
+    idle_seconds = db.Column(db.Float, nullable=False, default=0.0)
+    first_timestamp = db.Column(db.DateTime)
+    first_latitude = db.Column(db.Float)
+    first_longitude = db.Column(db.Float)
+    first_speed = db.Column(db.Float)
+    last_timestamp = db.Column(db.DateTime)
+    last_latitude = db.Column(db.Float)
+    last_longitude = db.Column(db.Float)
+    last_speed = db.Column(db.Float)
+    
+class LocationArchiveDay(db.Model):
+    __tablename__ = 'location_archive_days'
+    
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id'), primary_key=True)
+    day = db.Column(db.DateTime, primary_key=True)
+    point_count = db.Column(db.Integer, nullable=False)
+    first_timestamp = db.Column(db.DateTime, nullable=False)
+    last_timestamp = db.Column(db.DateTime, nullable=False)
+    size_bytes = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+class Trip(db.Model):
+    __tablename__ = 'trips'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id'), nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False)
+    start_latitude = db.Column(db.Float, nullable=False)
+    start_longitude = db.Column(db.Float, nullable=False)
+    end_latitude = db.Column(db.Float, nullable=False)
+    end_longitude = db.Column(db.Float, nullable=False)
+    start_place = db.Column(db.String(200))
+    end_place = db.Column(db.String(200))
+    distance_km = db.Column(db.Float, nullable=False, default=0.0)
+    max_speed = db.Column(db.Float, nullable=False, default=0.0)
+    avg_speed = db.Column(db.Float, nullable=False, default=0.0)
+    point_count = db.Column(db.Integer, nullable=False, default=0)
+    polyline = db.Column(db.Text)  # JSON list of [lat, lon], set when the trip ends
+    is_open = db.Column(db.Boolean, nullable=False, default=True)
+    
+    __table_args__ = (db.Index('ix_trips_vehicle_start', 'vehicle_id', 'start_time', unique=True),)
     
 class SavedLocation(db.Model):
     __tablename__ = 'saved_locations'
@@ -49,6 +121,8 @@ class SavedLocation(db.Model):
     visit_type = db.Column(db.String(50))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     notes = db.Column(db.Text)
+    
+    __table_args__ = (db.Index('ix_saved_locations_vehicle_timestamp', 'vehicle_id', 'timestamp'),)
 
 class PlaceOfInterest(db.Model):
     __tablename__ = 'places_of_interest'
@@ -64,3 +138,44 @@ class PlaceOfInterest(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     creator = db.relationship('User', backref=db.backref('created_places', lazy=True))
+
+class GeocodeCacheEntry(db.Model):
+    __tablename__ = 'geocode_cache'
+    
+    query = db.Column(db.String(500), primary_key=True)
+    results = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class DataVersion(db.Model):
+    __tablename__ = 'data_versions'
+    
+    name = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+class Geofence(db.Model):
+    __tablename__ = 'geofences'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    kind = db.Column(db.String(20), nullable=False, default='circle')  # circle or polygon
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    radius_m = db.Column(db.Float)
+    polygon = db.Column(db.Text)  # JSON list of [lat, lon]
+    dwell_seconds = db.Column(db.Integer, default=300)
+    is_active = db.Column(db.Boolean, default=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('users.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class GeofenceEvent(db.Model):
+    __tablename__ = 'geofence_events'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id'), nullable=False, index=True)
+    fence_type = db.Column(db.String(20), nullable=False)  # geofence or place
+    fence_id = db.Column(db.Integer, nullable=False)
+    fence_name = db.Column(db.String(200))
+    event_type = db.Column(db.String(20), nullable=False)  # enter, exit or dwell
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False, index=True)
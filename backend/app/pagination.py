@@ -0,0 +1,93 @@
+"""Keyset pagination and field selection for list endpoints.
+
+A page is read with a seek past the (sort key, id) of the previous page's
+last row instead of an OFFSET, so a deep page costs the same single index
+range read as the first one. Clients get that position as an opaque cursor
+token in the X-Next-Cursor header and pass it back as ?cursor=. Every list
+has a limit cap, and ?fields=a,b trims each record to the named fields.
+"""
+import base64
+from datetime import datetime
+import json
+
+from app.fastjson import json_response
+from app.models import db
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+def encode_cursor(*values):
+    values = [{'t': v.isoformat()} if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    """Return the position values of a cursor token; raises ValueError when it is malformed."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if not isinstance(values, list) or not values:
+            raise ValueError
+        return [datetime.fromisoformat(v['t']) if isinstance(v, dict) else v for v in values]
+    except (TypeError, ValueError, KeyError):
+        raise ValueError('Invalid cursor')
+
+def page_params(args, default_limit, max_limit):
+    """Return (limit, decoded cursor or None) from request args; raises ValueError."""
+    limit = args.get('limit', default=default_limit, type=int)
+    if not 1 <= limit <= max_limit:
+        raise ValueError(f'limit must be between 1 and {max_limit}')
+    return limit, decode_cursor(args['cursor']) if args.get('cursor') else None
+
+def parse_fields(args, allowed):
+    """Return the fields named in ?fields=, or None for all of them; raises ValueError."""
+    if not args.get('fields'):
+        return None
+    fields = [f.strip() for f in args['fields'].split(',') if f.strip()]
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)} (use {', '.join(allowed)})")
+    return fields or None
+
+def seek(key_column, id_column, after, descending=True):
+    """Condition for rows past position `after` ((key, id), or (id,) without a key column)."""
+    if key_column is None:
+        if len(after) != 1 or not isinstance(after[0], int):
+            raise ValueError('Invalid cursor')
+        return id_column < after[0] if descending else id_column > after[0]
+
+    if len(after) != 2 or not isinstance(after[0], key_column.type.python_type) or not isinstance(after[1], int):
+        raise ValueError('Invalid cursor')
+    key, row_id = after
+    # Written as a range on the key so a (…, key) index still applies
+    if descending:
+        return db.and_(key_column <= key, db.or_(key_column < key, id_column < row_id))
+    return db.and_(key_column >= key, db.or_(key_column > key, id_column > row_id))
+
+def paginate(query, key_column, id_column, limit, after=None, descending=True):
+    """Return (items, next cursor or None) for one page of an ORM query."""
+    if after is not None:
+        query = query.filter(seek(key_column, id_column, after, descending))
+
+    columns = [c for c in (key_column, id_column) if c is not None]
+    query = query.order_by(*[c.desc() if descending else c.asc() for c in columns])
+    items = query.limit(limit + 1).all()
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, encode_cursor(*[getattr(items[-1], c.key) for c in columns])
+
+def paginate_list(items, position, limit, after=None):
+    """Page an in-memory list already sorted by position(item), ascending."""
+    if after is not None:
+        after = tuple(after)
+        items = [item for item in items if position(item) > after]
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    return items, encode_cursor(*position(items[-1]))
+
+def page_response(records, next_cursor, fields=None):
+    if fields is not None:
+        records = [{f: record.get(f) for f in fields} for record in records]
+    response = json_response(records)
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response
@@ -0,0 +1,280 @@
+"""Storage layout and retention for the locations table.
+
+On PostgreSQL `locations` is range-partitioned on timestamp, by month or by
+day (LOCATIONS_PARTITION_INTERVAL). Partitions are created ahead of time and
+a default partition catches anything outside them, so ingest never fails on
+a missing range. Retention detaches and drops whole partitions instead of
+deleting rows.
+
+SQLite has no partitioning: the table stays as it is and retention falls
+back to deleting old rows in small batches.
+"""
+from datetime import datetime, timedelta
+import logging
+import re
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from app.models import db, Location
+
+logger = logging.getLogger(__name__)
+
+LOCATIONS_INDEX = 'ix_locations_vehicle_timestamp'
+DEFAULT_PARTITION = 'locations_default'
+PARTITION_INTERVALS = ('month', 'day')
+DELETE_BATCH_SIZE = 10000
+# Serializes partition DDL between worker processes
+ADVISORY_LOCK_KEY = 72_311_004
+
+_BOUND_RE = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+def is_postgresql():
+    return db.engine.dialect.name == 'postgresql'
+
+def period_start(moment, interval):
+    start = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start.replace(day=1) if interval == 'month' else start
+
+def next_period(start, interval):
+    if interval == 'day':
+        return start + timedelta(days=1)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def partition_name(start):
+    return f'locations_p{start:%Y%m%d}'
+
+def ensure_location_schema(interval='month', ahead_days=60):
+    """Create the (vehicle_id, timestamp) index and keep partitions ahead of time.
+
+    An empty, unpartitioned locations table (a fresh install) is converted in
+    place. One that already holds data is left alone until
+    migrate_locations() is run, since copying can take a while.
+    Returns the names of the partitions created.
+    """
+    _add_missing_columns()
+    if not is_postgresql():
+        db.session.execute(text(f'CREATE INDEX IF NOT EXISTS {LOCATIONS_INDEX} ON locations (vehicle_id, timestamp)'))
+        db.session.commit()
+        return []
+
+    if interval not in PARTITION_INTERVALS:
+        if _table_kind() == 'r':
+            db.session.rollback()
+            _create_index_concurrently()
+        return []
+
+    _lock()
+    kind = _table_kind()
+    if kind == 'r':
+        if db.session.execute(text('SELECT 1 FROM locations LIMIT 1')).first() is None:
+            created = _convert_to_partitioned(interval, ahead_days)
+        else:
+            db.session.rollback()
+            _create_index_concurrently()
+            logger.warning("locations is not partitioned yet; run 'flask partition-locations' to migrate it")
+            return []
+    else:
+        created = create_partitions(datetime.utcnow(), datetime.utcnow() + timedelta(days=ahead_days), interval)
+    db.session.commit()
+    return created
+
+def migrate_locations(interval='month', ahead_days=60):
+    """Move an existing unpartitioned locations table into partitions, in one transaction."""
+    if not is_postgresql():
+        raise RuntimeError('Partitioning needs PostgreSQL')
+    if interval not in PARTITION_INTERVALS:
+        raise ValueError(f'Unknown partition interval: {interval}')
+
+    _lock()
+    if _table_kind() != 'r':
+        db.session.rollback()
+        return None
+
+    missing = db.session.execute(text('SELECT COUNT(*) FROM locations WHERE timestamp IS NULL')).scalar()
+    if missing:
+        db.session.rollback()
+        raise RuntimeError(f'{missing} locations have no timestamp; fix or delete them before migrating')
+
+    created = _convert_to_partitioned(interval, ahead_days)
+    db.session.commit()
+    return created
+
+def create_partitions(start, end, interval):
+    """Create partitions covering [start, end) that do not overlap existing ones."""
+    existing = sorted(_partition_ranges().values())
+    created = []
+    period = period_start(start, interval)
+    while period < end:
+        period_end = next_period(period, interval)
+        for gap_start, gap_end in _gaps(period, period_end, existing):
+            name = partition_name(gap_start)
+            _create_partition(name, gap_start, gap_end)
+            existing.append((gap_start, gap_end))
+            existing.sort()
+            created.append(name)
+        period = period_end
+    return created
+
+def ensure_partitions(start, end, interval):
+    """Create missing partitions for [start, end] on a partitioned table, e.g. before loading old history.
+
+    Does nothing on SQLite or an unpartitioned table. Returns the names created.
+    """
+    if not is_postgresql() or interval not in PARTITION_INTERVALS or _table_kind() != 'p':
+        return []
+    _lock()
+    return create_partitions(start, end + timedelta(microseconds=1), interval)
+
+def drop_expired_partitions(cutoff):
+    """Detach and drop partitions that end at or before cutoff. Returns their names."""
+    _lock()
+    dropped = []
+    for name, (_, end) in sorted(_partition_ranges().items(), key=lambda item: item[1]):
+        if end <= cutoff:
+            db.session.execute(text(f'ALTER TABLE locations DETACH PARTITION {name}'))
+            db.session.execute(text(f'DROP TABLE {name}'))
+            dropped.append(name)
+    if _has_default_partition():
+        db.session.execute(text(f'DELETE FROM {DEFAULT_PARTITION} WHERE timestamp < :cutoff'), {'cutoff': cutoff})
+    db.session.commit()
+    return dropped
+
+def prune_locations(retention_days):
+    """Apply retention: drop whole partitions on PostgreSQL, delete in batches elsewhere.
+
+    Returns (dropped partition names, rows deleted).
+    """
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    if is_postgresql() and _table_kind() == 'p':
+        return drop_expired_partitions(cutoff), 0
+
+    deleted = 0
+    while True:
+        ids = db.session.execute(
+            db.select(Location.id).where(Location.timestamp < cutoff).limit(DELETE_BATCH_SIZE)
+        ).scalars().all()
+        if not ids:
+            return [], deleted
+        db.session.execute(db.delete(Location).where(Location.id.in_(ids)))
+        db.session.commit()
+        deleted += len(ids)
+
+def partition_info():
+    """[(name, start, end)] for each range partition, oldest first; empty when unpartitioned."""
+    if not is_postgresql() or _table_kind() != 'p':
+        return []
+    return [(name, start, end) for name, (start, end) in sorted(_partition_ranges().items(), key=lambda item: item[1])]
+
+def _convert_to_partitioned(interval, ahead_days):
+    bounds = db.session.execute(text('SELECT MIN(timestamp), MAX(timestamp) FROM locations')).first()
+    now = datetime.utcnow()
+    first = bounds[0] or now
+    last = max(bounds[1] or now, now)
+
+    # The id sequence is owned by the old table; keep it when that table is dropped.
+    db.session.execute(text('ALTER SEQUENCE locations_id_seq OWNED BY NONE'))
+    db.session.execute(text('ALTER TABLE locations RENAME TO locations_legacy'))
+    db.session.execute(text('ALTER TABLE locations_legacy DROP CONSTRAINT locations_pkey'))
+    db.session.execute(text(f'DROP INDEX IF EXISTS {LOCATIONS_INDEX}'))
+
+    db.session.execute(text("""
+        CREATE TABLE locations (
+            id INTEGER NOT NULL DEFAULT nextval('locations_id_seq'),
+            vehicle_id INTEGER NOT NULL REFERENCES vehicles (id),
+            latitude DOUBLE PRECISION NOT NULL,
+            longitude DOUBLE PRECISION NOT NULL,
+            speed DOUBLE PRECISION,
+            timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            dwell_until TIMESTAMP WITHOUT TIME ZONE,
+            sample_count INTEGER,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    """))
+    db.session.execute(text('ALTER SEQUENCE locations_id_seq OWNED BY locations.id'))
+    db.session.execute(text(f'CREATE INDEX {LOCATIONS_INDEX} ON locations (vehicle_id, timestamp)'))
+    db.session.execute(text(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF locations DEFAULT'))
+
+    created = create_partitions(first, last + timedelta(days=ahead_days), interval)
+    db.session.execute(text("""
+        INSERT INTO locations (id, vehicle_id, latitude, longitude, speed, timestamp, dwell_until, sample_count)
+        SELECT id, vehicle_id, latitude, longitude, speed, timestamp, dwell_until, sample_count FROM locations_legacy
+    """))
+    db.session.execute(text('DROP TABLE locations_legacy'))
+    return created
+
+def _add_missing_columns():
+    existing = {column['name'] for column in db.inspect(db.engine).get_columns('locations')}
+    for name, ddl in (('dwell_until', 'TIMESTAMP'), ('sample_count', 'INTEGER')):
+        if name not in existing:
+            # IF NOT EXISTS covers workers starting at the same time (PostgreSQL only)
+            guard = ' IF NOT EXISTS' if is_postgresql() else ''
+            db.session.execute(text(f'ALTER TABLE locations ADD COLUMN{guard} {name} {ddl}'))
+    db.session.commit()
+
+def _create_partition(name, start, end):
+    params = {'start': start, 'end': end}
+    moved = _has_default_partition() and db.session.execute(text(
+        f'SELECT 1 FROM {DEFAULT_PARTITION} WHERE timestamp >= :start AND timestamp < :end LIMIT 1'
+    ), params).first() is not None
+
+    if moved:
+        # Rows already in the default partition must move into the new range.
+        db.session.execute(text(f'ALTER TABLE locations DETACH PARTITION {DEFAULT_PARTITION}'))
+    db.session.execute(text(
+        f"CREATE TABLE {name} PARTITION OF locations FOR VALUES FROM ('{start:%Y-%m-%d %H:%M:%S}') TO ('{end:%Y-%m-%d %H:%M:%S}')"
+    ))
+    if moved:
+        db.session.execute(text(f"""
+            WITH moved AS (
+                DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= :start AND timestamp < :end
+                RETURNING id, vehicle_id, latitude, longitude, speed, timestamp, dwell_until, sample_count
+            )
+            INSERT INTO locations (id, vehicle_id, latitude, longitude, speed, timestamp, dwell_until, sample_count)
+            SELECT id, vehicle_id, latitude, longitude, speed, timestamp, dwell_until, sample_count FROM moved
+        """), params)
+        db.session.execute(text(f'ALTER TABLE locations ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT'))
+
+def _gaps(start, end, ranges):
+    cursor = start
+    for range_start, range_end in ranges:
+        if range_end <= cursor or range_start >= end:
+            continue
+        if range_start > cursor:
+            yield cursor, range_start
+        cursor = max(cursor, range_end)
+        if cursor >= end:
+            return
+    if cursor < end:
+        yield cursor, end
+
+def _partition_ranges():
+    rows = db.session.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'locations'::regclass
+    """)).all()
+    ranges = {}
+    for name, bound in rows:
+        match = _BOUND_RE.search(bound or '')
+        if match:
+            ranges[name] = (datetime.fromisoformat(match.group(1)), datetime.fromisoformat(match.group(2)))
+    return ranges
+
+def _has_default_partition():
+    return db.session.execute(text('SELECT to_regclass(:name)'), {'name': DEFAULT_PARTITION}).scalar() is not None
+
+def _table_kind():
+    return db.session.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass('locations')")).scalar()
+
+def _lock():
+    db.session.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': ADVISORY_LOCK_KEY})
+
+def _create_index_concurrently():
+    # Must run outside the session's transaction, which it would otherwise wait on.
+    try:
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {LOCATIONS_INDEX} ON locations (vehicle_id, timestamp)'))
+    except DBAPIError as e:
+        # Another worker building the same index at startup
+        logger.warning('Could not create %s: %s', LOCATIONS_INDEX, e.orig)
@@ -0,0 +1,47 @@
+"""Spatial lookups for places of interest.
+
+The grid index lives in process memory and is rebuilt whenever the
+places_of_interest version counter changes, which every POI write bumps.
+"""
+import threading
+
+from app.models import db, PlaceOfInterest
+from app.spatial import GridIndex
+from app.versions import get_version
+
+PLACES_VERSION = 'places_of_interest'
+
+class PlaceIndex:
+    def __init__(self):
+        self._index = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        version = get_version(PLACES_VERSION)
+        with self._lock:
+            if self._index is None or version != self._version:
+                self._index = self._build()
+                self._version = version
+            return self._index
+
+    def _build(self):
+        index = GridIndex()
+        rows = db.session.execute(db.select(
+            PlaceOfInterest.id, PlaceOfInterest.latitude, PlaceOfInterest.longitude
+        )).all()
+        for place_id, latitude, longitude in rows:
+            index.add(place_id, latitude, longitude)
+        return index
+
+place_index = PlaceIndex()
+
+def find_places(bbox=None, near=None, radius_m=None):
+    """Return [(place_id, distance_m or None)] ordered newest (highest id) first, or nearest first for near queries."""
+    index = place_index.current()
+    if near is not None:
+        return index.query_radius(near[0], near[1], radius_m)
+
+    ids = index.query_bbox(*bbox)
+    ids.sort(reverse=True)
+    return [(place_id, None) for place_id in ids]
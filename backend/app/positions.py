@@ -0,0 +1,70 @@
+"""Last known position per vehicle, kept current by the ingest endpoints."""
+from app.models import db, Location, VehicleLastPosition
+
+POSITION_FIELDS = ['latitude', 'longitude', 'speed', 'timestamp']
+
+def update_last_positions(rows):
+    latest = {}
+    for row in rows:
+        current = latest.get(row['vehicle_id'])
+        if current is None or row['timestamp'] >= current['timestamp']:
+            latest[row['vehicle_id']] = row
+
+    if not latest:
+        return
+
+    values = [{'vehicle_id': vehicle_id, **{f: row[f] for f in POSITION_FIELDS}} for vehicle_id, row in latest.items()]
+    insert = _dialect_insert()
+
+    if insert is None:
+        for value in values:
+            position = db.session.get(VehicleLastPosition, value['vehicle_id'])
+            if position is None:
+                db.session.add(VehicleLastPosition(**value))
+            elif value['timestamp'] >= position.timestamp:
+                for field in POSITION_FIELDS:
+                    setattr(position, field, value[field])
+        return
+
+    table = VehicleLastPosition.__table__
+    stmt = insert(table).values(values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.vehicle_id],
+        set_={f: stmt.excluded[f] for f in POSITION_FIELDS},
+        where=stmt.excluded.timestamp >= table.c.timestamp
+    )
+    db.session.execute(stmt)
+
+def backfill_last_positions():
+    """Seed the table from locations for vehicles that have no row yet."""
+    ranked = db.select(
+        Location.vehicle_id, Location.latitude, Location.longitude, Location.speed, Location.timestamp,
+        db.func.row_number().over(
+            partition_by=Location.vehicle_id,
+            order_by=(Location.timestamp.desc(), Location.id.desc())
+        ).label('rank')
+    ).subquery()
+
+    latest = db.select(
+        ranked.c.vehicle_id, ranked.c.latitude, ranked.c.longitude, ranked.c.speed, ranked.c.timestamp
+    ).where(
+        ranked.c.rank == 1,
+        ranked.c.timestamp.is_not(None),
+        ranked.c.vehicle_id.not_in(db.select(VehicleLastPosition.vehicle_id))
+    )
+
+    result = db.session.execute(
+        db.insert(VehicleLastPosition).from_select(['vehicle_id'] + POSITION_FIELDS, latest)
+    )
+    db.session.commit()
+    return result.rowcount
+
+def _dialect_insert():
+    name = db.engine.dialect.name
+    if name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    if name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    return None
@@ -0,0 +1,231 @@
+"""Hourly per-vehicle rollups of the locations table.
+
+Ingest folds each point into its vehicle-hour row. Stats for long windows
+then read whole hours from the rollups and raw rows only for the partial
+hours at either edge.
+"""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from sqlalchemy.exc import IntegrityError
+
+from app.compaction import expand_row
+from app.geo import calculate_distance
+from app.models import db, Location, LocationHourlyRollup, Vehicle
+from app.stats import TrackSummary, classify_segment, load_track, merge_summaries, summarize_track
+
+ROLLUP_PERIOD = timedelta(hours=1)
+BACKFILL_CHUNK_SIZE = 5000
+
+def truncate_hour(timestamp):
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+def update_rollups(rows):
+    groups = {}
+    for row in rows:
+        groups.setdefault((row['vehicle_id'], truncate_hour(row['timestamp'])), []).append(row)
+
+    for (vehicle_id, hour), points in groups.items():
+        points.sort(key=lambda p: p['timestamp'])
+        rollup = db.session.get(LocationHourlyRollup, (vehicle_id, hour), with_for_update=True)
+
+        if rollup is None:
+            rollup = _insert_rollup(vehicle_id, hour)
+        if rollup.point_count and points[0]['timestamp'] < rollup.last_timestamp:
+            # Late points land mid-hour; recompute the hour from raw rows.
+            rebuild_rollup(rollup)
+            continue
+
+        for p in points:
+            add_point(rollup, p['timestamp'], p['latitude'], p['longitude'], p['speed'])
+
+def _insert_rollup(vehicle_id, hour):
+    """Insert an empty row for the hour, or lock the one another worker has just inserted."""
+    try:
+        with db.session.begin_nested():
+            rollup = new_rollup(vehicle_id, hour)
+            db.session.add(rollup)
+        return rollup
+    except IntegrityError:
+        # Created concurrently by another worker
+        return db.session.get(LocationHourlyRollup, (vehicle_id, hour), with_for_update=True, populate_existing=True)
+
+def new_rollup(vehicle_id, hour):
+    return LocationHourlyRollup(**_empty_rollup(vehicle_id, hour))
+
+def _empty_rollup(vehicle_id, hour):
+    return dict(
+        vehicle_id=vehicle_id, hour=hour, point_count=0, distance_km=0.0, speed_sum=0.0,
+        speed_max=0.0, moving_seconds=0.0, idle_seconds=0.0
+    )
+
+def add_point(rollup, timestamp, latitude, longitude, speed):
+    speed = speed or 0.0
+
+    if rollup.point_count:
+        distance = calculate_distance(rollup.last_latitude, rollup.last_longitude, latitude, longitude)
+        moving, idle = classify_segment(distance, (timestamp - rollup.last_timestamp).total_seconds(), speed)
+        rollup.distance_km += distance
+        rollup.moving_seconds += moving
+        rollup.idle_seconds += idle
+        rollup.speed_max = max(rollup.speed_max, speed)
+    else:
+        rollup.first_timestamp = timestamp
+        rollup.first_latitude = latitude
+        rollup.first_longitude = longitude
+        rollup.first_speed = speed
+        rollup.speed_max = speed
+
+    rollup.point_count += 1
+    rollup.speed_sum += speed
+    rollup.last_timestamp = timestamp
+    rollup.last_latitude = latitude
+    rollup.last_longitude = longitude
+    rollup.last_speed = speed
+
+def rebuild_rollup(rollup):
+    fresh = new_rollup(rollup.vehicle_id, rollup.hour)
+    for row in db.session.execute(_hour_query(rollup.vehicle_id, rollup.hour, rollup.hour + ROLLUP_PERIOD)):
+        for point in expand_row(*row):
+            add_point(fresh, *point)
+
+    if fresh.point_count == 0:
+        db.session.delete(rollup)
+        return
+
+    for column in LocationHourlyRollup.__table__.columns.keys():
+        setattr(rollup, column, getattr(fresh, column))
+
+def backfill_rollups(rebuild_all=False):
+    """Rebuild rollups from raw locations and return the number of hours written.
+
+    By default only history up to and including each vehicle's earliest
+    rollup hour is rebuilt, which covers data ingested before rollups existed
+    and is cheap to re-run.
+    """
+    written = 0
+    for vehicle_id, in db.session.execute(db.select(Vehicle.id).order_by(Vehicle.id)).all():
+        before = None
+        if not rebuild_all:
+            first_hour = db.session.execute(
+                db.select(db.func.min(LocationHourlyRollup.hour)).where(LocationHourlyRollup.vehicle_id == vehicle_id)
+            ).scalar()
+            if first_hour is not None:
+                before = first_hour + ROLLUP_PERIOD
+
+        written += rebuild_rollups(vehicle_id, None, before)
+        db.session.commit()
+
+    return written
+
+def rebuild_rollups(vehicle_id, start=None, before=None):
+    """Recompute a vehicle's rollups for the hours in [start, before), without committing.
+
+    start is rounded down to its hour. Returns the number of hours written.
+    """
+    start = truncate_hour(start) if start is not None else None
+    delete = db.delete(LocationHourlyRollup).where(LocationHourlyRollup.vehicle_id == vehicle_id)
+    if start is not None:
+        delete = delete.where(LocationHourlyRollup.hour >= start)
+    if before is not None:
+        delete = delete.where(LocationHourlyRollup.hour < before)
+    db.session.execute(delete)
+
+    # Hours are summed on plain objects and inserted as rows, without ORM attribute tracking per point
+    written = 0
+    pending = []
+    rollup = None
+    query = _hour_query(vehicle_id, start, before).execution_options(yield_per=BACKFILL_CHUNK_SIZE)
+    for row in db.session.execute(query):
+        hour = truncate_hour(row[0])
+        if rollup is None or rollup.hour != hour:
+            rollup = SimpleNamespace(**_empty_rollup(vehicle_id, hour))
+            pending.append(rollup)
+        for point in expand_row(*row):
+            add_point(rollup, *point)
+
+        if len(pending) > BACKFILL_CHUNK_SIZE:
+            db.session.execute(db.insert(LocationHourlyRollup), [vars(r) for r in pending[:-1]])
+            written += len(pending) - 1
+            pending = pending[-1:]
+
+    if pending:
+        db.session.execute(db.insert(LocationHourlyRollup), [vars(r) for r in pending])
+    return written + len(pending)
+
+def rebuild_track_rollups(vehicle_id, start, before):
+    """rebuild_rollups() read through load_track, so hours served from the archive are included.
+
+    Used where rows older than the hot table have just been archived. Works
+    a day at a time; returns the number of hours written.
+    """
+    start = truncate_hour(start)
+    db.session.execute(db.delete(LocationHourlyRollup).where(
+        LocationHourlyRollup.vehicle_id == vehicle_id,
+        LocationHourlyRollup.hour >= start,
+        LocationHourlyRollup.hour < before
+    ))
+
+    written = 0
+    day = start
+    while day < before:
+        track = load_track(vehicle_id, day, min(day + timedelta(days=1), before))
+        pending = []
+        for timestamp, latitude, longitude, speed in zip(
+            track.timestamps.astype(datetime).tolist(), track.latitudes.tolist(),
+            track.longitudes.tolist(), track.speeds.tolist()
+        ):
+            hour = truncate_hour(timestamp)
+            if not pending or pending[-1].hour != hour:
+                pending.append(SimpleNamespace(**_empty_rollup(vehicle_id, hour)))
+            add_point(pending[-1], timestamp, latitude, longitude, speed)
+        if pending:
+            db.session.execute(db.insert(LocationHourlyRollup), [vars(r) for r in pending])
+        written += len(pending)
+        day += timedelta(days=1)
+    return written
+
+def rollup_summary(rollup):
+    return TrackSummary(
+        point_count=rollup.point_count,
+        distance_km=rollup.distance_km,
+        speed_sum=rollup.speed_sum,
+        speed_max=rollup.speed_max,
+        moving_seconds=rollup.moving_seconds,
+        idle_seconds=rollup.idle_seconds,
+        first=(rollup.first_timestamp, rollup.first_latitude, rollup.first_longitude, rollup.first_speed),
+        last=(rollup.last_timestamp, rollup.last_latitude, rollup.last_longitude, rollup.last_speed)
+    )
+
+def window_summary(vehicle_id, start, end=None):
+    """Summarize [start, end) from whole-hour rollups plus raw edge rows."""
+    first_hour = truncate_hour(start)
+    if first_hour < start:
+        first_hour += ROLLUP_PERIOD
+    last_hour = truncate_hour(end or datetime.utcnow())
+
+    if first_hour >= last_hour:
+        return summarize_track(load_track(vehicle_id, start, end))
+
+    rollups = LocationHourlyRollup.query.filter(
+        LocationHourlyRollup.vehicle_id == vehicle_id,
+        LocationHourlyRollup.hour >= first_hour,
+        LocationHourlyRollup.hour < last_hour
+    ).order_by(LocationHourlyRollup.hour.asc()).all()
+
+    return merge_summaries(
+        [summarize_track(load_track(vehicle_id, start, first_hour))]
+        + [rollup_summary(r) for r in rollups]
+        + [summarize_track(load_track(vehicle_id, last_hour, end))]
+    )
+
+def _hour_query(vehicle_id, start, end):
+    query = db.select(
+        Location.timestamp, Location.latitude, Location.longitude, Location.speed,
+        Location.dwell_until, Location.sample_count
+    ).where(Location.vehicle_id == vehicle_id)
+    if start is not None:
+        query = query.where(Location.timestamp >= start)
+    if end is not None:
+        query = query.where(Location.timestamp < end)
+    return query.order_by(Location.timestamp.asc(), Location.id.asc())
@@ -0,0 +1,228 @@
+"""Level-of-detail simplification for vehicle tracks.
+
+A single Douglas-Peucker pass ranks every point by the largest tolerance at
+which it would still be kept. Any tolerance or point budget is then a cheap
+selection on that ranking. Stop boundaries and sharp turns are always kept.
+
+Rankings for closed vehicle-days are cached in process and checked against
+the hourly rollup point counts, so late points invalidate them everywhere.
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import math
+import threading
+
+import numpy as np
+
+from app.geo import EARTH_RADIUS_KM
+from app.models import db, LocationHourlyRollup
+from app.stats import load_track
+
+MIN_TOLERANCE_M = 0.5
+STOP_SPEED_KMH = 1.0
+SHARP_TURN_DEGREES = 60
+SHARP_TURN_MIN_LEG_M = 10
+CACHE_MAX_POINTS = 2_000_000
+# Most points one simplified response returns, the raw history page limit
+MAX_SIMPLIFIED_POINTS = 10000
+# Protected points outrank any tolerance; only the window endpoints rank higher.
+PROTECTED_RANK = 1e12
+
+class RankedTrack:
+    __slots__ = ('timestamps', 'latitudes', 'longitudes', 'speeds', 'ranks')
+
+    def __init__(self, timestamps, latitudes, longitudes, speeds, ranks):
+        self.timestamps = timestamps
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.speeds = speeds
+        self.ranks = ranks
+
+    def __len__(self):
+        return len(self.ranks)
+
+def rank_track(track, floor_m=MIN_TOLERANCE_M):
+    """Rank points of a TrackArrays and drop those below floor_m."""
+    n = len(track)
+    ranks = np.zeros(n)
+    if n:
+        x, y = _project(track.latitudes, track.longitudes)
+        protected = _protected_points(x, y, track.speeds)
+        ranks[protected] = PROTECTED_RANK
+        _douglas_peucker(x, y, np.flatnonzero(protected), ranks, floor_m)
+
+    keep = ranks > 0
+    return RankedTrack(
+        track.timestamps[keep], track.latitudes[keep], track.longitudes[keep], track.speeds[keep], ranks[keep]
+    )
+
+def select_points(ranked, tolerance_m=None, max_points=None):
+    """Return indices into ranked, in time order."""
+    indices = np.arange(len(ranked))
+    if tolerance_m is not None:
+        indices = indices[ranked.ranks[indices] > tolerance_m]
+    if max_points is not None and len(indices) > max_points:
+        top = np.argpartition(-ranked.ranks[indices], max_points - 1)[:max_points]
+        indices = np.sort(indices[top])
+    return indices
+
+def zoom_tolerance(zoom, latitude):
+    """Ground size of one 256px-tile pixel at this zoom level, in meters."""
+    return 2 * math.pi * EARTH_RADIUS_KM * 1000 * math.cos(math.radians(latitude)) / (256 * 2 ** zoom)
+
+def simplified_history(vehicle_id, start, end=None, tolerance_m=None, max_points=None, zoom=None):
+    """Simplified track of [start, end), never more than MAX_SIMPLIFIED_POINTS points."""
+    end = end or datetime.utcnow()
+    max_points = min(max_points or MAX_SIMPLIFIED_POINTS, MAX_SIMPLIFIED_POINTS)
+    floor_m = max(MIN_TOLERANCE_M, tolerance_m or 0)
+    pieces = [_ranked_piece(vehicle_id, piece_start, piece_end, floor_m, version)
+              for piece_start, piece_end, version in _day_pieces(vehicle_id, start, end)]
+    pieces = [p for p in pieces if len(p)]
+    if not pieces:
+        return []
+
+    ranked = RankedTrack(*(np.concatenate([getattr(p, f) for p in pieces]) for f in RankedTrack.__slots__))
+    ranked.ranks[[0, -1]] = np.inf
+    if zoom is not None:
+        zoom_m = zoom_tolerance(zoom, float(np.mean(ranked.latitudes)))
+        tolerance_m = max(tolerance_m or 0, zoom_m)
+
+    indices = select_points(ranked, tolerance_m, max_points)
+    return [{
+        'latitude': lat,
+        'longitude': lon,
+        'speed': speed,
+        'timestamp': timestamp
+    } for timestamp, lat, lon, speed in zip(
+        ranked.timestamps[indices].astype(datetime).tolist(),
+        ranked.latitudes[indices].tolist(),
+        ranked.longitudes[indices].tolist(),
+        ranked.speeds[indices].tolist()
+    )]
+
+class RankedTrackCache:
+    def __init__(self, max_points=CACHE_MAX_POINTS):
+        self.max_points = max_points
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, version, ranked):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old[1])
+            self._entries[key] = (version, ranked)
+            self._size += len(ranked)
+            while self._size > self.max_points and len(self._entries) > 1:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+ranked_day_cache = RankedTrackCache()
+
+def _ranked_piece(vehicle_id, start, end, floor_m, version):
+    if version is None:
+        return rank_track(load_track(vehicle_id, start, end), floor_m)
+
+    # Cache only at the default floor so every tolerance can share it.
+    key = (vehicle_id, start)
+    ranked = ranked_day_cache.get(key, version)
+    if ranked is None:
+        ranked = rank_track(load_track(vehicle_id, start, end))
+        ranked_day_cache.put(key, version, ranked)
+
+    if floor_m > MIN_TOLERANCE_M:
+        keep = ranked.ranks > floor_m
+        ranked = RankedTrack(*(getattr(ranked, f)[keep] for f in RankedTrack.__slots__))
+    return ranked
+
+def _day_pieces(vehicle_id, start, end):
+    """Split [start, end) at UTC midnights; closed whole days get a cache version."""
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    first_day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    if first_day < start:
+        first_day += timedelta(days=1)
+    last_day = min(end.replace(hour=0, minute=0, second=0, microsecond=0), today)
+
+    versions = {}
+    if first_day < last_day:
+        rows = db.session.execute(db.select(LocationHourlyRollup.hour, LocationHourlyRollup.point_count).where(
+            LocationHourlyRollup.vehicle_id == vehicle_id,
+            LocationHourlyRollup.hour >= first_day,
+            LocationHourlyRollup.hour < last_day
+        )).all()
+        for hour, count in rows:
+            day = hour.replace(hour=0)
+            versions[day] = versions.get(day, 0) + count
+
+    pieces = []
+    cursor = start
+    day = first_day
+    while day < last_day:
+        if cursor < day:
+            pieces.append((cursor, day, None))
+        pieces.append((day, day + timedelta(days=1), versions.get(day, 0)))
+        cursor = day = day + timedelta(days=1)
+    if cursor < end:
+        pieces.append((cursor, end, None))
+    return pieces
+
+def _project(latitudes, longitudes):
+    lat0 = math.radians(float(np.mean(latitudes)))
+    scale = EARTH_RADIUS_KM * 1000
+    return np.radians(longitudes) * scale * math.cos(lat0), np.radians(latitudes) * scale
+
+def _protected_points(x, y, speeds):
+    n = len(x)
+    protected = np.zeros(n, dtype=bool)
+    protected[0] = protected[-1] = True
+    if n < 3:
+        return protected
+
+    # Stop boundaries: speed crosses the stop threshold
+    stopped = speeds < STOP_SPEED_KMH
+    change = stopped[1:] != stopped[:-1]
+    protected[1:][change] = True
+    protected[:-1][change] = True
+
+    # Sharp turns between two legs long enough not to be GPS jitter
+    dx, dy = np.diff(x), np.diff(y)
+    legs = np.hypot(dx, dy)
+    heading = np.arctan2(dy, dx)
+    turn = np.abs((heading[1:] - heading[:-1] + np.pi) % (2 * np.pi) - np.pi)
+    sharp = (turn > math.radians(SHARP_TURN_DEGREES)) & (legs[:-1] >= SHARP_TURN_MIN_LEG_M) & (legs[1:] >= SHARP_TURN_MIN_LEG_M)
+    protected[1:-1][sharp] = True
+    return protected
+
+def _douglas_peucker(x, y, anchors, ranks, floor_m):
+    stack = [(a, b, PROTECTED_RANK) for a, b in zip(anchors[:-1].tolist(), anchors[1:].tolist()) if b - a > 1]
+    while stack:
+        a, b, parent = stack.pop()
+        px, py = x[a + 1:b] - x[a], y[a + 1:b] - y[a]
+        dx, dy = x[b] - x[a], y[b] - y[a]
+        length2 = dx * dx + dy * dy
+        if length2 > 0:
+            t = np.clip((px * dx + py * dy) / length2, 0, 1)
+            distances = np.hypot(px - t * dx, py - t * dy)
+        else:
+            distances = np.hypot(px, py)
+
+        k = int(np.argmax(distances))
+        if distances[k] < floor_m:
+            continue
+
+        i = a + 1 + k
+        rank = min(float(distances[k]), parent)
+        ranks[i] = rank
+        if i - a > 1:
+            stack.append((a, i, rank))
+        if b - i > 1:
+            stack.append((i, b, rank))
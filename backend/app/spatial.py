@@ -0,0 +1,84 @@
+"""In-memory uniform grid index for point and circle lookups."""
+import math
+
+from app.geo import calculate_distance
+
+KM_PER_DEGREE_LAT = 111.32
+
+class GridIndex:
+    """Buckets items by lat/lon cell so lookups only touch nearby cells.
+
+    Each item has an id, a position and an optional radius in meters;
+    items with a radius are registered in every cell their circle covers.
+    """
+    def __init__(self, cell_degrees=0.05):
+        self.cell_degrees = cell_degrees
+        self._cells = {}
+        self._items = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, item_id, latitude, longitude, radius_m=0, payload=None):
+        self._items[item_id] = (latitude, longitude, radius_m, payload)
+        for cell in self._cells_for_circle(latitude, longitude, radius_m):
+            self._cells.setdefault(cell, []).append(item_id)
+
+    def get(self, item_id):
+        return self._items.get(item_id)
+
+    def items(self):
+        return self._items.items()
+
+    def query_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """Ids of items whose position lies inside the box."""
+        if min_lon > max_lon:
+            # Box crosses the antimeridian
+            return self.query_bbox(min_lat, min_lon, max_lat, 180) + self.query_bbox(min_lat, -180, max_lat, max_lon)
+
+        found = []
+        for cell in self._cells_for_box(min_lat, min_lon, max_lat, max_lon, occupied_only=True):
+            for item_id in self._cells.get(cell, ()):
+                latitude, longitude, _, _ = self._items[item_id]
+                if min_lat <= latitude <= max_lat and min_lon <= longitude <= max_lon:
+                    found.append(item_id)
+        return list(dict.fromkeys(found))
+
+    def query_radius(self, latitude, longitude, radius_m):
+        """(id, distance_m) of items within radius_m of the point, nearest first."""
+        found = {}
+        for cell in self._cells_for_circle(latitude, longitude, radius_m, occupied_only=True):
+            for item_id in self._cells.get(cell, ()):
+                if item_id in found:
+                    continue
+                item_lat, item_lon, _, _ = self._items[item_id]
+                distance_m = calculate_distance(latitude, longitude, item_lat, item_lon) * 1000
+                if distance_m <= radius_m:
+                    found[item_id] = distance_m
+        return sorted(found.items(), key=lambda item: item[1])
+
+    def candidates(self, latitude, longitude):
+        """Ids registered in the cell containing the point."""
+        return self._cells.get(self._cell(latitude, longitude), ())
+
+    def _cell(self, latitude, longitude):
+        return (math.floor(latitude / self.cell_degrees), math.floor(longitude / self.cell_degrees))
+
+    def _cells_for_box(self, min_lat, min_lon, max_lat, max_lon, occupied_only=False):
+        row0, col0 = self._cell(min_lat, min_lon)
+        row1, col1 = self._cell(max_lat, max_lon)
+        if occupied_only and (row1 - row0 + 1) * (col1 - col0 + 1) > len(self._cells):
+            # Box covers more cells than are occupied; scan occupied cells instead.
+            return [c for c in self._cells if row0 <= c[0] <= row1 and col0 <= c[1] <= col1]
+        return [(row, col) for row in range(row0, row1 + 1) for col in range(col0, col1 + 1)]
+
+    def _cells_for_circle(self, latitude, longitude, radius_m, occupied_only=False):
+        if not radius_m:
+            return [self._cell(latitude, longitude)]
+        dlat = radius_m / 1000 / KM_PER_DEGREE_LAT
+        dlon = dlat / max(math.cos(math.radians(latitude)), 0.01)
+        return self._cells_for_box(
+            max(latitude - dlat, -90), max(longitude - dlon, -180),
+            min(latitude + dlat, 90), min(longitude + dlon, 180),
+            occupied_only
+        )
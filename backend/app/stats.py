@@ -0,0 +1,189 @@
+"""Trip statistics computed on columnar NumPy arrays.
+
+Points are loaded as plain columns in timestamp order and every metric is
+computed in a handful of vectorized passes instead of a Python loop.
+"""
+from datetime import datetime
+
+import numpy as np
+
+from app.archive import read_archive
+from app.compaction import covers, expand_arrays
+from app.geo import EARTH_RADIUS_KM
+from app.models import db, Location
+
+MOVING_SPEED_KMH = 3.0
+MAX_SAMPLE_GAP_SECONDS = 600
+
+class TrackArrays:
+    __slots__ = ('timestamps', 'latitudes', 'longitudes', 'speeds')
+
+    def __init__(self, timestamps, latitudes, longitudes, speeds):
+        self.timestamps = timestamps
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self.speeds = speeds
+
+    def __len__(self):
+        return len(self.timestamps)
+
+def load_track(vehicle_id, start, end=None):
+    """Load [start, end) as TrackArrays, with compacted rows expanded into their samples."""
+    query = db.select(
+        Location.timestamp, Location.latitude, Location.longitude, Location.speed,
+        Location.dwell_until, Location.sample_count
+    ).where(Location.vehicle_id == vehicle_id, covers(start))
+    if end is not None:
+        query = query.where(Location.timestamp < end)
+
+    rows = db.session.execute(query.order_by(Location.timestamp.asc(), Location.id.asc())).all()
+    pieces = read_archive(vehicle_id, start, end)
+    if rows:
+        timestamps, latitudes, longitudes, speeds, dwell_until, sample_counts = zip(*rows)
+        pieces.append((
+            np.array(timestamps, dtype='datetime64[us]'),
+            np.array(latitudes, dtype=np.float64),
+            np.array(longitudes, dtype=np.float64),
+            np.array([s or 0.0 for s in speeds], dtype=np.float64),
+            np.array(dwell_until, dtype='datetime64[us]'),
+            np.array([c or 1 for c in sample_counts], dtype=np.int64)
+        ))
+
+    if not pieces:
+        return TrackArrays(np.empty(0, dtype='datetime64[us]'), np.empty(0), np.empty(0), np.empty(0))
+
+    columns = pieces[0] if len(pieces) == 1 else tuple(np.concatenate(column) for column in zip(*pieces))
+    timestamps, latitudes, longitudes, speeds = expand_arrays(*columns)
+    keep = timestamps >= np.datetime64(start, 'us')
+    if end is not None:
+        keep &= timestamps < np.datetime64(end, 'us')
+    if keep.all():
+        return TrackArrays(timestamps, latitudes, longitudes, speeds)
+    return TrackArrays(timestamps[keep], latitudes[keep], longitudes[keep], speeds[keep])
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+def segment_distances(track):
+    if len(track) < 2:
+        return np.empty(0)
+    return haversine_km(track.latitudes[:-1], track.longitudes[:-1], track.latitudes[1:], track.longitudes[1:])
+
+class TrackSummary:
+    """Additive aggregates of a run of points plus its first and last fix.
+
+    Summaries of adjacent runs can be merged exactly, which lets stats be
+    assembled from hourly rollups and raw edge rows.
+    """
+    __slots__ = ('point_count', 'distance_km', 'speed_sum', 'speed_max',
+                 'moving_seconds', 'idle_seconds', 'first', 'last')
+
+    def __init__(self, point_count=0, distance_km=0.0, speed_sum=0.0, speed_max=0.0,
+                 moving_seconds=0.0, idle_seconds=0.0, first=None, last=None):
+        self.point_count = point_count
+        self.distance_km = distance_km
+        self.speed_sum = speed_sum
+        self.speed_max = speed_max
+        self.moving_seconds = moving_seconds
+        self.idle_seconds = idle_seconds
+        # (timestamp, latitude, longitude, speed)
+        self.first = first
+        self.last = last
+
+def classify_segment(distance_km, seconds, end_speed):
+    """Return (moving_seconds, idle_seconds) for one interval between fixes."""
+    # Intervals longer than the gap limit mean the tracker was off; they count
+    # towards distance but not towards moving or idle time.
+    if seconds <= 0 or seconds > MAX_SAMPLE_GAP_SECONDS:
+        return 0.0, 0.0
+    if distance_km * 3600 / seconds >= MOVING_SPEED_KMH or end_speed >= MOVING_SPEED_KMH:
+        return seconds, 0.0
+    return 0.0, seconds
+
+def summarize_track(track):
+    count = len(track)
+    if count == 0:
+        return TrackSummary()
+
+    distances = segment_distances(track)
+    seconds = np.diff(track.timestamps).astype('timedelta64[us]').astype(np.float64) / 1e6
+
+    # Vectorized form of classify_segment
+    sampled = (seconds > 0) & (seconds <= MAX_SAMPLE_GAP_SECONDS)
+    implied_speed = np.zeros_like(seconds)
+    np.divide(distances * 3600, seconds, out=implied_speed, where=seconds > 0)
+    moving = sampled & ((implied_speed >= MOVING_SPEED_KMH) | (track.speeds[1:] >= MOVING_SPEED_KMH))
+
+    return TrackSummary(
+        point_count=count,
+        distance_km=float(distances.sum()),
+        speed_sum=float(track.speeds.sum()),
+        speed_max=float(track.speeds.max()),
+        moving_seconds=float(seconds[moving].sum()),
+        idle_seconds=float(seconds[sampled & ~moving].sum()),
+        first=_fix(track, 0),
+        last=_fix(track, count - 1)
+    )
+
+def merge_summaries(summaries):
+    """Merge summaries of consecutive, non-overlapping runs in time order."""
+    merged = TrackSummary()
+    for summary in summaries:
+        if summary.point_count == 0:
+            continue
+
+        if merged.point_count:
+            prev_at, prev_lat, prev_lon, _ = merged.last
+            next_at, next_lat, next_lon, next_speed = summary.first
+            distance = float(haversine_km(prev_lat, prev_lon, next_lat, next_lon))
+            moving, idle = classify_segment(distance, (next_at - prev_at).total_seconds(), next_speed)
+            merged.distance_km += distance
+            merged.moving_seconds += moving
+            merged.idle_seconds += idle
+            merged.speed_max = max(merged.speed_max, summary.speed_max)
+        else:
+            merged.first = summary.first
+            merged.speed_max = summary.speed_max
+
+        merged.point_count += summary.point_count
+        merged.distance_km += summary.distance_km
+        merged.speed_sum += summary.speed_sum
+        merged.moving_seconds += summary.moving_seconds
+        merged.idle_seconds += summary.idle_seconds
+        merged.last = summary.last
+    return merged
+
+def format_stats(summary):
+    """Stats response for a summary.
+
+    Under LOCATION_COMPACTION the figures are approximate: a parked run is
+    expanded at its first position, so the GPS jitter between its pings,
+    which an uncompacted track counts as distance and often as moving
+    time, is left out. Expect a few percent less of both for fleets that
+    park a lot.
+    """
+    if summary.point_count == 0:
+        return {'total_points': 0, 'avg_speed': 0, 'max_speed': 0, 'distance_km': 0,
+                'moving_minutes': 0, 'idle_minutes': 0}
+
+    return {
+        'total_points': summary.point_count,
+        'avg_speed': round(summary.speed_sum / summary.point_count, 2),
+        'max_speed': round(summary.speed_max, 2),
+        'distance_km': round(summary.distance_km, 2),
+        'moving_minutes': round(summary.moving_seconds / 60, 1),
+        'idle_minutes': round(summary.idle_seconds / 60, 1)
+    }
+
+def compute_stats(track):
+    return format_stats(summarize_track(track))
+
+def _fix(track, index):
+    return (
+        track.timestamps[index].astype(datetime),
+        float(track.latitudes[index]),
+        float(track.longitudes[index]),
+        float(track.speeds[index])
+    )
@@ -0,0 +1,156 @@
+"""Incremental stop detection.
+
+A vehicle counts as stopped when at least STOP_MIN_POINTS pings fall inside
+the last STOP_WINDOW, the oldest of them is within STOP_RADIUS_KM of the
+newest, and they span at least STOP_MIN_MINUTES. Only one stop is recorded
+while another saved location for the vehicle is still inside the window.
+
+Each vehicle keeps its own window of recent pings in memory, so a ping costs
+amortized O(1) instead of re-reading the window from the database. State is
+rebuilt from the database the first time a vehicle is seen by this process,
+and again whenever its newest ping is no longer the vehicle's last stored
+position (see verify()).
+"""
+from bisect import insort
+from collections import deque
+from datetime import timedelta
+import threading
+
+from app.geo import calculate_distance
+
+STOP_WINDOW = timedelta(minutes=10)
+STOP_MIN_POINTS = 5
+STOP_RADIUS_KM = 0.05
+STOP_MIN_MINUTES = 5
+
+class VehicleStopState:
+    __slots__ = ('window', 'last_saved_at', 'last_at')
+
+    def __init__(self, points=(), last_saved_at=None):
+        # (timestamp, latitude, longitude), oldest first
+        self.window = deque(points)
+        self.last_saved_at = last_saved_at
+        # Newest ping observed, compared with the vehicle's stored last position
+        self.last_at = None
+
+class StopDetector:
+    def __init__(self, loader=None):
+        self._loader = loader
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def observe(self, vehicle_id, latitude, longitude, timestamp):
+        """Feed one ping and return the fields of a new stop, or None."""
+        with self._lock:
+            state = self._states.get(vehicle_id)
+            if state is None:
+                state = self._load(vehicle_id, timestamp)
+                self._states[vehicle_id] = state
+
+            if state.last_at is None or timestamp > state.last_at:
+                state.last_at = timestamp
+            if not push_point(state.window, (timestamp, latitude, longitude)):
+                return None
+
+            first = dwell_start(state.window)
+            if first is None:
+                return None
+
+            first_at = first[0]
+            time_diff = (timestamp - first_at).total_seconds() / 60
+            if state.last_saved_at is not None and state.last_saved_at >= timestamp - STOP_WINDOW:
+                return None
+
+            state.last_saved_at = first_at
+            return {
+                'name': 'Auto-detected Stop',
+                'latitude': latitude,
+                'longitude': longitude,
+                'stop_duration_minutes': int(time_diff),
+                'visit_type': 'auto_detected',
+                'timestamp': first_at
+            }
+
+    def note_saved_location(self, vehicle_id, timestamp):
+        with self._lock:
+            state = self._states.get(vehicle_id)
+            if state is not None and (state.last_saved_at is None or timestamp > state.last_saved_at):
+                state.last_saved_at = timestamp
+
+    def verify(self, vehicle_id, last_at):
+        """Drop the vehicle's state unless its newest ping is the last stored position, last_at.
+
+        Another worker, or a rolled-back batch, may have changed the track or
+        saved a stop since this process last saw it. Call before feeding a batch.
+        """
+        with self._lock:
+            state = self._states.get(vehicle_id)
+            if state is not None and state.last_at != last_at:
+                del self._states[vehicle_id]
+
+    def invalidate(self, vehicle_id=None):
+        with self._lock:
+            if vehicle_id is None:
+                self._states.clear()
+            else:
+                self._states.pop(vehicle_id, None)
+
+    def _load(self, vehicle_id, timestamp):
+        if self._loader is None:
+            return VehicleStopState()
+        points, last_saved_at = self._loader(vehicle_id, timestamp - STOP_WINDOW, timestamp)
+        return VehicleStopState(points, last_saved_at)
+
+def push_point(window, point):
+    """Add a (timestamp, latitude, longitude) ping to a dwell window.
+
+    Returns False for a late fix: it is kept in order but, as in live
+    ingest, only the newest point is evaluated.
+    """
+    timestamp = point[0]
+    if window and timestamp < window[-1][0]:
+        if timestamp >= window[-1][0] - STOP_WINDOW:
+            insort(window, point)
+        return False
+
+    window_start = timestamp - STOP_WINDOW
+    while window and window[0][0] < window_start:
+        window.popleft()
+    window.append(point)
+    return True
+
+def dwell_start(window):
+    """The oldest ping of the window if the vehicle has dwelled there up to the newest one, else None."""
+    if len(window) < STOP_MIN_POINTS:
+        return None
+
+    first_at, first_lat, first_lon = first = window[0]
+    last_at, latitude, longitude = window[-1]
+    if calculate_distance(first_lat, first_lon, latitude, longitude) >= STOP_RADIUS_KM:
+        return None
+    if (last_at - first_at).total_seconds() / 60 < STOP_MIN_MINUTES:
+        return None
+    return first
+
+def load_stop_state(vehicle_id, window_start, before):
+    from app.compaction import covers, expand_row
+    from app.models import db, Location, SavedLocation
+
+    with db.session.no_autoflush:
+        rows = db.session.query(
+            Location.timestamp, Location.latitude, Location.longitude, Location.speed,
+            Location.dwell_until, Location.sample_count
+        ).filter(
+            Location.vehicle_id == vehicle_id,
+            covers(window_start),
+            Location.timestamp < before
+        ).order_by(Location.timestamp.asc()).all()
+
+        last_saved_at = db.session.query(db.func.max(SavedLocation.timestamp)).filter(
+            SavedLocation.vehicle_id == vehicle_id
+        ).scalar()
+
+    points = [(timestamp, latitude, longitude)
+              for row in rows for timestamp, latitude, longitude, _ in expand_row(*row)
+              if window_start <= timestamp < before]
+    return points, last_saved_at
@@ -0,0 +1,13 @@
+"""Timestamp parsing shared by the HTTP API and the track importer."""
+from datetime import datetime, timezone
+
+def parse_timestamp(value):
+    """Parse an ISO 8601 timestamp into a naive UTC datetime, or None if it is invalid."""
+    try:
+        timestamp = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
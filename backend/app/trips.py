@@ -0,0 +1,385 @@
+"""Trip segmentation at ingest.
+
+A trip starts when a parked vehicle moves more than STOP_RADIUS_KM from
+where it stopped. It ends at the next stop, found with the same dwell test
+the stop detector uses while the tracker reports no movement, or at the
+last fix before a gap longer than TRIP_MAX_GAP.
+
+Each vehicle's open trip is kept in memory and written to `trips` with
+running totals as points arrive. When it ends, its totals and simplified
+polyline are recomputed from the stored track, so a finished trip matches
+the stats for the same window. Trips shorter than TRIP_MIN_DISTANCE_KM are
+GPS drift around a stop and are dropped.
+"""
+from collections import deque
+from datetime import datetime, timedelta
+import json
+import threading
+
+import numpy as np
+from sqlalchemy.exc import IntegrityError
+
+from app.geo import calculate_distance
+from app.geofence import PLACE_RADIUS_M
+from app.models import db, Location, LocationArchiveDay, PlaceOfInterest, Trip, VehicleLastPosition
+from app.places import find_places
+from app.simplify import rank_track, select_points
+from app.stats import MAX_SAMPLE_GAP_SECONDS, MOVING_SPEED_KMH, load_track, summarize_track
+from app.stops import STOP_RADIUS_KM, STOP_WINDOW, dwell_start, load_stop_state, push_point
+
+TRIP_MAX_GAP = timedelta(seconds=MAX_SAMPLE_GAP_SECONDS)
+TRIP_MIN_DISTANCE_KM = 0.2
+POLYLINE_TOLERANCE_M = 10
+POLYLINE_MAX_POINTS = 500
+TRIP_FIELDS = ('id', 'vehicle_id', 'start_time', 'end_time', 'duration_minutes', 'start_latitude', 'start_longitude',
+               'start_place', 'end_latitude', 'end_longitude', 'end_place', 'distance_km', 'max_speed', 'avg_speed',
+               'point_count', 'is_open')
+
+class OpenTrip:
+    __slots__ = ('start_time', 'start_latitude', 'start_longitude', 'end_time', 'end_latitude', 'end_longitude',
+                 'distance_km', 'speed_sum', 'max_speed', 'point_count', 'stored')
+
+    def __init__(self, timestamp, latitude, longitude, speed):
+        self.start_time = self.end_time = timestamp
+        self.start_latitude = self.end_latitude = latitude
+        self.start_longitude = self.end_longitude = longitude
+        self.distance_km = 0.0
+        self.speed_sum = self.max_speed = speed
+        self.point_count = 1
+        # Whether the trips row exists
+        self.stored = False
+
+    @classmethod
+    def from_row(cls, trip):
+        open_trip = cls(trip.start_time, trip.start_latitude, trip.start_longitude, 0.0)
+        open_trip.end_time = trip.end_time
+        open_trip.end_latitude = trip.end_latitude
+        open_trip.end_longitude = trip.end_longitude
+        open_trip.distance_km = trip.distance_km
+        open_trip.speed_sum = trip.avg_speed * trip.point_count
+        open_trip.max_speed = trip.max_speed
+        open_trip.point_count = trip.point_count
+        open_trip.stored = True
+        return open_trip
+
+    def add(self, timestamp, latitude, longitude, speed):
+        self.distance_km += calculate_distance(self.end_latitude, self.end_longitude, latitude, longitude)
+        self.end_time = timestamp
+        self.end_latitude = latitude
+        self.end_longitude = longitude
+        self.speed_sum += speed
+        self.max_speed = max(self.max_speed, speed)
+        self.point_count += 1
+
+    def values(self):
+        return {
+            'start_time': self.start_time,
+            'end_time': self.end_time,
+            'start_latitude': self.start_latitude,
+            'start_longitude': self.start_longitude,
+            'end_latitude': self.end_latitude,
+            'end_longitude': self.end_longitude,
+            'distance_km': self.distance_km,
+            'max_speed': self.max_speed,
+            'avg_speed': self.speed_sum / self.point_count,
+            'point_count': self.point_count,
+            'is_open': True
+        }
+
+class VehicleTripState:
+    __slots__ = ('window', 'last', 'anchor', 'trip')
+
+    def __init__(self):
+        # Dwell window of (timestamp, latitude, longitude), oldest first
+        self.window = deque()
+        # Newest fix as (timestamp, latitude, longitude, speed)
+        self.last = None
+        # (latitude, longitude) where the vehicle is parked; None during a trip
+        self.anchor = None
+        self.trip = None
+
+class TripSegmenter:
+    def __init__(self, loader=None):
+        self._loader = loader
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def segment(self, rows):
+        """Feed time-ordered rows and write the trips they start, extend or end."""
+        ended = []
+        touched = {}
+        with self._lock:
+            checked = set()
+            for row in rows:
+                vehicle_id = row['vehicle_id']
+                if vehicle_id not in checked:
+                    checked.add(vehicle_id)
+                    self._current(vehicle_id)
+                state = self._states[vehicle_id]
+                self._observe(vehicle_id, state, row['timestamp'], row['latitude'], row['longitude'], row['speed'] or 0.0, ended)
+                if state.trip is not None:
+                    touched[vehicle_id] = state.trip
+
+            # Snapshot what to write while the state cannot change
+            ended = [(vehicle_id, trip.start_time, trip.stored, end_time) for vehicle_id, trip, end_time in ended]
+            writes = []
+            for vehicle_id, trip in touched.items():
+                if self._states.get(vehicle_id) is None or self._states[vehicle_id].trip is not trip:
+                    continue
+                writes.append((vehicle_id, trip.values(), trip.stored))
+                trip.stored = True
+
+        for vehicle_id, start_time, stored, end_time in ended:
+            self._finish(vehicle_id, start_time, stored, end_time)
+        for vehicle_id, values, stored in writes:
+            if stored:
+                self._update(vehicle_id, values)
+            else:
+                self._insert(vehicle_id, values)
+
+    def invalidate(self, vehicle_id=None):
+        with self._lock:
+            if vehicle_id is None:
+                self._states.clear()
+            else:
+                self._states.pop(vehicle_id, None)
+
+    def verify(self, vehicle_id, last_at):
+        """Drop the vehicle's state unless its newest fix is the last stored position, last_at.
+
+        Another worker, or a rolled-back batch, may have moved the track on
+        since this process last saw it. Call before segmenting a batch.
+        """
+        with self._lock:
+            state = self._states.get(vehicle_id)
+            if state is not None and (state.last[0] if state.last else None) != last_at:
+                del self._states[vehicle_id]
+
+    def _current(self, vehicle_id):
+        state = self._states.get(vehicle_id)
+        if state is None:
+            state = self._states[vehicle_id] = self._loader(vehicle_id) if self._loader else VehicleTripState()
+        return state
+
+    def _observe(self, vehicle_id, state, timestamp, latitude, longitude, speed, ended):
+        last = state.last
+        if last is not None and timestamp <= last[0]:
+            # Late fix: an open trip picks it up when its totals are recomputed
+            return
+        push_point(state.window, (timestamp, latitude, longitude))
+        state.last = (timestamp, latitude, longitude, speed)
+
+        trip = state.trip
+        if trip is not None and timestamp - trip.end_time > TRIP_MAX_GAP:
+            self._end(vehicle_id, state, trip.end_time, trip.end_latitude, trip.end_longitude, ended)
+            trip = None
+
+        if trip is None:
+            anchor = state.anchor
+            if anchor is None:
+                state.anchor = (latitude, longitude)
+            elif calculate_distance(anchor[0], anchor[1], latitude, longitude) > STOP_RADIUS_KM:
+                # Departure: the trip starts at the previous fix unless the tracker was off in between
+                if last is not None and timestamp - last[0] <= TRIP_MAX_GAP:
+                    trip = OpenTrip(*last)
+                    trip.add(timestamp, latitude, longitude, speed)
+                else:
+                    trip = OpenTrip(timestamp, latitude, longitude, speed)
+                state.trip = trip
+                state.anchor = None
+            return
+
+        trip.add(timestamp, latitude, longitude, speed)
+        first = dwell_start(state.window) if speed < MOVING_SPEED_KMH else None
+        if first is not None:
+            self._end(vehicle_id, state, first[0], first[1], first[2], ended)
+
+    def _end(self, vehicle_id, state, end_time, latitude, longitude, ended):
+        ended.append((vehicle_id, state.trip, end_time))
+        state.trip = None
+        state.anchor = (latitude, longitude)
+
+    def _finish(self, vehicle_id, start_time, stored, end_time):
+        track = load_track(vehicle_id, start_time, end_time + timedelta(microseconds=1)) if end_time > start_time else None
+        summary = summarize_track(track) if track is not None else None
+        if summary is None or summary.point_count < 2 or summary.distance_km < TRIP_MIN_DISTANCE_KM:
+            if stored:
+                db.session.execute(db.delete(Trip).where(Trip.vehicle_id == vehicle_id, Trip.start_time == start_time))
+            return
+
+        _, start_latitude, start_longitude, _ = summary.first
+        _, end_latitude, end_longitude, _ = summary.last
+        values = {
+            'start_time': start_time,
+            'end_time': end_time,
+            'start_latitude': start_latitude,
+            'start_longitude': start_longitude,
+            'end_latitude': end_latitude,
+            'end_longitude': end_longitude,
+            'start_place': place_name(start_latitude, start_longitude),
+            'end_place': place_name(end_latitude, end_longitude),
+            'distance_km': summary.distance_km,
+            'max_speed': summary.speed_max,
+            'avg_speed': summary.speed_sum / summary.point_count,
+            'point_count': summary.point_count,
+            'polyline': json.dumps(track_polyline(track)),
+            'is_open': False
+        }
+        if stored:
+            self._update(vehicle_id, values)
+        else:
+            self._insert(vehicle_id, values)
+
+    def _insert(self, vehicle_id, values):
+        try:
+            with db.session.begin_nested():
+                db.session.execute(db.insert(Trip).values(vehicle_id=vehicle_id, **values))
+        except IntegrityError:
+            # Rebuilt concurrently by segment-trips; reload the vehicle next time
+            self.invalidate(vehicle_id)
+
+    def _update(self, vehicle_id, values):
+        updated = db.session.execute(db.update(Trip).where(
+            Trip.vehicle_id == vehicle_id,
+            Trip.start_time == values['start_time']
+        ).values(**values)).rowcount
+        if not updated:
+            self.invalidate(vehicle_id)
+
+def load_trip_state(vehicle_id):
+    """Rebuild a vehicle's state from its last position, recent track and latest trip."""
+    state = VehicleTripState()
+    last = db.session.execute(db.select(
+        VehicleLastPosition.timestamp, VehicleLastPosition.latitude, VehicleLastPosition.longitude, VehicleLastPosition.speed
+    ).where(VehicleLastPosition.vehicle_id == vehicle_id)).first()
+    if last is None:
+        return state
+
+    timestamp, latitude, longitude, speed = last
+    state.last = (timestamp, latitude, longitude, speed or 0.0)
+    points, _ = load_stop_state(vehicle_id, timestamp - STOP_WINDOW, timestamp + timedelta(microseconds=1))
+    state.window = deque(points)
+
+    trip = Trip.query.filter(Trip.vehicle_id == vehicle_id).order_by(Trip.start_time.desc()).first()
+    if trip is not None and trip.is_open:
+        state.trip = OpenTrip.from_row(trip)
+    else:
+        state.anchor = (latitude, longitude)
+    return state
+
+def rebuild_trips(vehicle_id, start=None, end=None):
+    """Re-segment a vehicle's history, archived days included. Returns the number of trips it has.
+
+    With start or end, only [start, end] is re-segmented, widened to the
+    trip before start and the one after end: the vehicle is parked where
+    each of those starts, so segmenting can begin and stop there.
+    """
+    since = until = None
+    if start is not None:
+        since = db.session.execute(db.select(db.func.max(Trip.start_time)).where(
+            Trip.vehicle_id == vehicle_id, Trip.start_time < start
+        )).scalar()
+    if end is not None:
+        until = _next_trip_start(vehicle_id, end)
+
+    delete = db.delete(Trip).where(Trip.vehicle_id == vehicle_id)
+    if since is not None:
+        delete = delete.where(Trip.start_time >= since)
+    if until is not None:
+        delete = delete.where(Trip.start_time < until)
+    db.session.execute(delete)
+
+    position = since or _first_day(vehicle_id)
+    segmenter = TripSegmenter()
+    now = datetime.utcnow()
+    while position is not None and (until is not None or position <= now):
+        stop = position.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        if until is not None:
+            # The fix the next kept trip departs from is fed too
+            stop = min(stop, until + timedelta(microseconds=1))
+        track = load_track(vehicle_id, position, stop)
+        segmenter.segment([{
+            'vehicle_id': vehicle_id,
+            'timestamp': timestamp,
+            'latitude': latitude,
+            'longitude': longitude,
+            'speed': speed
+        } for timestamp, latitude, longitude, speed in zip(
+            track.timestamps.astype(datetime).tolist(),
+            track.latitudes.tolist(),
+            track.longitudes.tolist(),
+            track.speeds.tolist()
+        )])
+        db.session.commit()
+        position = stop
+
+        if until is not None and stop > until:
+            state = segmenter._states.get(vehicle_id)
+            if state is None or state.trip is None:
+                break
+            # Still moving where the next trip starts: rebuild that one too
+            db.session.execute(db.delete(Trip).where(Trip.vehicle_id == vehicle_id, Trip.start_time == until))
+            until = _next_trip_start(vehicle_id, until)
+        elif not len(track):
+            # Skip ahead over days without data, e.g. before a recent import of old history
+            position = _first_day(vehicle_id, position)
+            if position is not None and until is not None and position > until:
+                position = until
+
+    db.session.commit()
+    return db.session.execute(db.select(db.func.count(Trip.id)).where(Trip.vehicle_id == vehicle_id)).scalar()
+
+def _next_trip_start(vehicle_id, after):
+    return db.session.execute(db.select(db.func.min(Trip.start_time)).where(
+        Trip.vehicle_id == vehicle_id, Trip.start_time > after
+    )).scalar()
+
+def _first_day(vehicle_id, since=None):
+    """Start of the first day at or after `since` with hot or archived points, or None."""
+    hot = db.select(db.func.min(Location.timestamp)).where(Location.vehicle_id == vehicle_id)
+    archived = db.select(db.func.min(LocationArchiveDay.day)).where(LocationArchiveDay.vehicle_id == vehicle_id)
+    if since is not None:
+        hot = hot.where(Location.timestamp >= since)
+        archived = archived.where(LocationArchiveDay.day >= since)
+    first = min(filter(None, [db.session.execute(hot).scalar(), db.session.execute(archived).scalar()]), default=None)
+    return first.replace(hour=0, minute=0, second=0, microsecond=0) if first is not None else None
+
+def track_polyline(track):
+    """[[lat, lon], ...] of a TrackArrays, simplified for drawing."""
+    if not len(track):
+        return []
+    ranked = rank_track(track)
+    ranked.ranks[[0, -1]] = np.inf
+    indices = select_points(ranked, POLYLINE_TOLERANCE_M, POLYLINE_MAX_POINTS)
+    return [[round(lat, 6), round(lon, 6)]
+            for lat, lon in zip(ranked.latitudes[indices].tolist(), ranked.longitudes[indices].tolist())]
+
+def place_name(latitude, longitude):
+    matches = find_places(near=(latitude, longitude), radius_m=PLACE_RADIUS_M)
+    if not matches:
+        return None
+    place = db.session.get(PlaceOfInterest, matches[0][0])
+    return place.name if place else None
+
+def serialize_trip(t, polyline=None):
+    trip = {
+        'id': t.id,
+        'vehicle_id': t.vehicle_id,
+        'start_time': t.start_time.isoformat(),
+        'end_time': t.end_time.isoformat(),
+        'duration_minutes': round((t.end_time - t.start_time).total_seconds() / 60, 1),
+        'start_latitude': t.start_latitude,
+        'start_longitude': t.start_longitude,
+        'start_place': t.start_place,
+        'end_latitude': t.end_latitude,
+        'end_longitude': t.end_longitude,
+        'end_place': t.end_place,
+        'distance_km': round(t.distance_km, 2),
+        'max_speed': round(t.max_speed, 2),
+        'avg_speed': round(t.avg_speed, 2),
+        'point_count': t.point_count,
+        'is_open': t.is_open
+    }
+    if polyline is not None:
+        trip['polyline'] = polyline
+    return trip
@@ -0,0 +1,55 @@
+"""Change counters shared by all worker processes.
+
+Write paths bump a named counter in the same transaction as the change;
+in-process caches compare the counter to decide whether to rebuild.
+"""
+from sqlalchemy.exc import IntegrityError
+
+from app.models import db, DataVersion
+
+# Per-vehicle counters (see vehicle_key) and table-wide ones read by the HTTP cache
+LOCATIONS_VERSION = 'locations'
+SAVED_LOCATIONS_VERSION = 'saved_locations'
+USERS_VERSION = 'users'
+# Per-vehicle; bumped when a vehicle's history is rewritten in bulk so every worker reloads its ingest state
+TRACK_VERSION = 'track'
+
+def bump_version(name):
+    updated = db.session.execute(
+        db.update(DataVersion).where(DataVersion.name == name).values(version=DataVersion.version + 1)
+    ).rowcount
+    if updated:
+        return
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(DataVersion(name=name, version=1))
+    except IntegrityError:
+        # Created concurrently by another worker
+        db.session.execute(
+            db.update(DataVersion).where(DataVersion.name == name).values(version=DataVersion.version + 1)
+        )
+
+def get_version(name):
+    version = db.session.execute(db.select(DataVersion.version).where(DataVersion.name == name)).scalar()
+    return version or 0
+
+def get_versions(names=(), prefix=None):
+    """Current values of several counters in one query.
+
+    Returns one value per name, followed by the sum of every counter whose
+    name starts with prefix when one is given. Counters only go up, so the
+    sum changes whenever any of them does.
+    """
+    condition = DataVersion.name.in_(list(names))
+    if prefix is not None:
+        condition = db.or_(condition, DataVersion.name.startswith(prefix, autoescape=True))
+    found = dict(db.session.execute(db.select(DataVersion.name, DataVersion.version).where(condition)).all())
+    versions = [found.get(name) or 0 for name in names]
+    if prefix is not None:
+        versions.append(sum(version or 0 for name, version in found.items() if name.startswith(prefix)))
+    return tuple(versions)
+
+def vehicle_key(name, vehicle_id):
+    """Name of the per-vehicle counter for one kind of data, e.g. locations:3."""
+    return f'{name}:{vehicle_id}'
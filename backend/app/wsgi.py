@@ -0,0 +1,4 @@
+"""WSGI entry point: `gunicorn app.wsgi:app`, or `flask --app app.wsgi <command>`."""
+from app.main import create_app
+
+app = create_app()
@@ -0,0 +1,13 @@
+"""Load tests and microbenchmarks for the backend.
+
+Run from backend/ against the database in DATABASE_URL (SQLite or
+PostgreSQL); use a scratch database, the fleet generator adds data:
+
+    python -m bench fleet --vehicles 20 --days 2
+    python -m bench load --scenario mixed --concurrency 8 --duration 30 -o run.json
+    python -m bench micro -o micro.json
+    python -m bench compare before.json after.json
+
+Every command can write its results as JSON (see bench.results), so runs
+from different commits or machines can be compared.
+"""
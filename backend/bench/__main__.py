@@ -0,0 +1,130 @@
+"""Command line for the benchmark package; see bench/__init__.py."""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from bench import results
+
+def create_app(args):
+    """The app on DATABASE_URL, bootstrapped."""
+    from app.config import Config
+    from app.main import create_app
+
+    class BenchConfig(Config):
+        RESPONSE_CACHE_ENTRIES = 0 if getattr(args, 'no_cache', False) else Config.RESPONSE_CACHE_ENTRIES
+
+    app = create_app(BenchConfig)
+    output = app.test_cli_runner().invoke(args=['bootstrap'])
+    if output.exit_code:
+        raise SystemExit(output.output)
+    return app
+
+def fleet_command(args):
+    from bench.fleet import generate_fleet
+    app = create_app(args)
+    with app.app_context():
+        started = time.perf_counter()
+        try:
+            points = generate_fleet(args.vehicles, args.days, args.interval, args.parked, args.seed)
+        except RuntimeError as e:
+            raise SystemExit(str(e))
+        seconds = time.perf_counter() - started
+    print(f'Ingested {points} points for {args.vehicles} vehicles in {seconds:.1f} s ({points / seconds:.0f} points/s)')
+
+def load_command(args):
+    from bench.load import SCENARIOS, HttpClient, InProcessClient, run_load
+    if args.url:
+        fleet = remote_fleet(HttpClient(args.url), args)
+        make_client = lambda: HttpClient(args.url)
+    else:
+        from bench.fleet import bench_vehicles
+        app = create_app(args)
+        with app.app_context():
+            fleet = [tuple(v) for v in bench_vehicles()]
+        make_client = lambda: InProcessClient(app)
+    if not fleet:
+        raise SystemExit('No bench vehicles found; run `python -m bench fleet` first')
+
+    config = {
+        'scenario': args.scenario, 'weights': SCENARIOS[args.scenario], 'concurrency': args.concurrency,
+        'duration': args.duration, 'warmup': args.warmup, 'url': args.url, 'vehicles': len(fleet),
+        'response_cache': not args.no_cache
+    }
+    result = results.new_result('load', config)
+    result['results'] = run_load(make_client, fleet, args.scenario, args.concurrency, args.duration, args.warmup,
+                                 args.username, args.password, args.seed)
+    results.print_table(result)
+    if args.output:
+        results.write(result, args.output)
+
+def remote_fleet(client, args):
+    from bench.fleet import DEVICE_PREFIX
+    status, _ = client.request('POST', '/api/auth/login', {'username': args.username, 'password': args.password})
+    if status != 200:
+        raise SystemExit(f'Login to {args.url} failed with HTTP {status}')
+    with client.opener.open(f'{client.base_url}/api/vehicles?fields=id,device_id') as response:
+        vehicles = json.loads(response.read())
+    return [(v['id'], v['device_id']) for v in vehicles if v['device_id'].startswith(DEVICE_PREFIX)]
+
+def micro_command(args):
+    from bench.micro import run_micro
+    app = create_app(args)
+    with app.app_context():
+        result = results.new_result('micro', {'size': args.size, 'repeat': args.repeat})
+        result['results'] = run_micro(args.size, args.repeat)
+    results.print_table(result)
+    if args.output:
+        results.write(result, args.output)
+
+def compare_command(args):
+    try:
+        lines = results.compare(results.load(args.baseline), results.load(args.current))
+    except ValueError as e:
+        raise SystemExit(str(e))
+    print('\n'.join(lines))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench', description='Load tests and microbenchmarks.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    fleet = commands.add_parser('fleet', help='Generate a synthetic fleet history in DATABASE_URL.')
+    fleet.add_argument('--vehicles', type=int, default=10)
+    fleet.add_argument('--days', type=float, default=1.0, help='Days of history, ending now.')
+    fleet.add_argument('--interval', type=int, default=10, help='Seconds between pings.')
+    fleet.add_argument('--parked', type=float, default=0.3, help='Share of vehicles that are mostly parked.')
+    fleet.add_argument('--seed', type=int, default=1)
+    fleet.set_defaults(func=fleet_command)
+
+    load = commands.add_parser('load', help='Drive the API with concurrent clients.')
+    load.add_argument('--scenario', choices=['mixed', 'ingest', 'ingest_frames', 'read'], default='mixed')
+    load.add_argument('--concurrency', type=int, default=4)
+    load.add_argument('--duration', type=float, default=30.0, help='Seconds measured, after the warm-up.')
+    load.add_argument('--warmup', type=float, default=2.0)
+    load.add_argument('--url', help='Base URL of a running server; default drives the app in this process.')
+    load.add_argument('--no-cache', action='store_true', help='Disable the response cache (in-process only).')
+    load.add_argument('--username', default='admin')
+    load.add_argument('--password', default='admin123')
+    load.add_argument('--seed', type=int, default=1)
+    load.add_argument('-o', '--output', help='Write JSON results here (- for stdout).')
+    load.set_defaults(func=load_command)
+
+    micro = commands.add_parser('micro', help='Time distance, stop detection and serializers.')
+    micro.add_argument('--size', type=int, default=10000, help='Rows per benchmark.')
+    micro.add_argument('--repeat', type=int, default=5)
+    micro.add_argument('-o', '--output', help='Write JSON results here (- for stdout).')
+    micro.set_defaults(func=micro_command)
+
+    compare = commands.add_parser('compare', help='Compare two JSON results files.')
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.set_defaults(func=compare_command)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Synthetic fleet generator.
+
+Vehicles bench-1 .. bench-N report every `interval` seconds over the last
+`days` days. A `parked_share` of them are mostly parked, with a few short
+drives a day; the others drive most of the time with stops of a few
+minutes to an hour. Points go through the normal ingest pipeline in
+time-ordered batches, so stops, trips, rollups and last positions are built
+as they are in production.
+"""
+from datetime import datetime, timedelta
+import math
+import random
+
+from app import main
+from app.devices import VEHICLES_VERSION, device_registry
+from app.models import db, Location, Vehicle
+from app.versions import bump_version
+
+DEVICE_PREFIX = 'bench-'
+INGEST_BATCH = 5000
+KM_PER_DEGREE = 111.32
+GPS_NOISE_DEGREES = 0.00002  # about 2 m
+
+class SimulatedVehicle:
+    """Alternates between driving and parking, one fix per step."""
+
+    def __init__(self, vehicle_id, rng, parked):
+        self.vehicle_id = vehicle_id
+        self.rng = rng
+        self.parked = parked
+        self.latitude = 45.0 + rng.uniform(-0.5, 0.5)
+        self.longitude = 7.0 + rng.uniform(-0.5, 0.5)
+        self.heading = rng.uniform(0, 2 * math.pi)
+        self.speed = 0.0
+        self.driving = rng.random() < (0.1 if parked else 0.7)
+        self.remaining = self._phase_seconds()
+
+    def step(self, timestamp, interval):
+        self.remaining -= interval
+        if self.remaining <= 0:
+            self.driving = not self.driving
+            self.remaining = self._phase_seconds()
+
+        rng = self.rng
+        if self.driving:
+            self.heading += rng.gauss(0, 0.15)
+            self.speed = min(max(rng.gauss(self.speed or 40, 8), 8.0), 120.0)
+            step_km = self.speed * interval / 3600
+            self.latitude += step_km * math.cos(self.heading) / KM_PER_DEGREE
+            self.longitude += step_km * math.sin(self.heading) / (KM_PER_DEGREE * math.cos(math.radians(self.latitude)))
+            latitude, longitude = self.latitude, self.longitude
+        else:
+            self.speed = 0.0
+            latitude = self.latitude + rng.gauss(0, GPS_NOISE_DEGREES)
+            longitude = self.longitude + rng.gauss(0, GPS_NOISE_DEGREES)
+
+        return {
+            'vehicle_id': self.vehicle_id,
+            'latitude': latitude,
+            'longitude': longitude,
+            'speed': self.speed,
+            'timestamp': timestamp
+        }
+
+    def _phase_seconds(self):
+        if self.parked:
+            minutes = self.rng.uniform(10, 40) if self.driving else self.rng.uniform(60, 360)
+        else:
+            minutes = self.rng.uniform(60, 180) if self.driving else self.rng.uniform(5, 60)
+        return minutes * 60
+
+def ensure_vehicles(count):
+    """Return [(vehicle_id, device_id)] for bench-1 .. bench-count, creating missing ones."""
+    device_ids = [f'{DEVICE_PREFIX}{n}' for n in range(1, count + 1)]
+    existing = dict(db.session.execute(
+        db.select(Vehicle.device_id, Vehicle.id).where(Vehicle.device_id.in_(device_ids))
+    ).all())
+    missing = [d for d in device_ids if d not in existing]
+    if missing:
+        db.session.add_all([Vehicle(name=f'Bench {d[len(DEVICE_PREFIX):]}', device_id=d) for d in missing])
+        bump_version(VEHICLES_VERSION)
+        db.session.commit()
+        device_registry.invalidate()
+        existing = dict(db.session.execute(
+            db.select(Vehicle.device_id, Vehicle.id).where(Vehicle.device_id.in_(device_ids))
+        ).all())
+    return [(existing[d], d) for d in device_ids]
+
+def bench_vehicles():
+    """[(vehicle_id, device_id)] of the bench vehicles already in the database."""
+    return db.session.execute(
+        db.select(Vehicle.id, Vehicle.device_id).where(Vehicle.device_id.startswith(DEVICE_PREFIX)).order_by(Vehicle.id)
+    ).all()
+
+def generate_fleet(vehicles=10, days=1.0, interval=10, parked_share=0.3, seed=1, progress=print):
+    """Ingest a synthetic history for `vehicles` bench vehicles. Returns the number of points."""
+    fleet = ensure_vehicles(vehicles)
+    vehicle_ids = [vehicle_id for vehicle_id, _ in fleet]
+    if db.session.execute(db.select(Location.id).where(Location.vehicle_id.in_(vehicle_ids)).limit(1)).first():
+        raise RuntimeError('The bench vehicles already have history; generate the fleet into a fresh database')
+
+    rng = random.Random(seed)
+    parked_count = round(vehicles * parked_share)
+    simulated = [SimulatedVehicle(vehicle_id, random.Random(rng.random()), i < parked_count)
+                 for i, vehicle_id in enumerate(vehicle_ids)]
+
+    end = datetime.utcnow().replace(microsecond=0)
+    timestamp = end - timedelta(days=days)
+    step = timedelta(seconds=interval)
+    total = 0
+    batches = 0
+    batch = []
+    while timestamp < end:
+        batch.extend(vehicle.step(timestamp, interval) for vehicle in simulated)
+        timestamp += step
+        if len(batch) >= INGEST_BATCH:
+            main.ingest_rows(batch)
+            total += len(batch)
+            batches += 1
+            batch = []
+            if batches % 20 == 0:
+                progress(f'  {total} points, up to {timestamp:%Y-%m-%d %H:%M}')
+    if batch:
+        main.ingest_rows(batch)
+        total += len(batch)
+    return total
@@ -0,0 +1,206 @@
+"""Concurrent load generator.
+
+Worker threads each log in with their own client and send requests picked
+from a weighted scenario until the run is over. The target is either the
+app in this process, through Flask's test client (no network or server
+overhead), or a running server given by URL. Latencies are measured around
+the full request, including reading a streamed body.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+import http.cookiejar
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+from app.frames import FRAME_MIMETYPE, encode_frame
+from app.main import MAX_BATCH_POINTS
+
+GPS_BATCH_POINTS = min(50, MAX_BATCH_POINTS)
+
+def gps(rng, fleet):
+    _, device_id = rng.choice(fleet)
+    return 'POST', '/api/gps', {
+        'device_id': device_id,
+        'latitude': 45.0 + rng.uniform(-0.5, 0.5),
+        'longitude': 7.0 + rng.uniform(-0.5, 0.5),
+        'speed': rng.uniform(0, 90)
+    }
+
+def gps_batch(rng, fleet):
+    points = []
+    for _ in range(GPS_BATCH_POINTS):
+        _, device_id = rng.choice(fleet)
+        points.append({
+            'device_id': device_id,
+            'latitude': 45.0 + rng.uniform(-0.5, 0.5),
+            'longitude': 7.0 + rng.uniform(-0.5, 0.5),
+            'speed': rng.uniform(0, 90)
+        })
+    return 'POST', '/api/gps/batch', {'points': points}
+
+def gps_frame(rng, fleet):
+    _, device_id = rng.choice(fleet)
+    return 'POST', '/api/gps', encode_frame(device_id, [
+        (None, 45.0 + rng.uniform(-0.5, 0.5), 7.0 + rng.uniform(-0.5, 0.5), rng.uniform(0, 90))
+    ])
+
+def gps_frame_batch(rng, fleet):
+    _, device_id = rng.choice(fleet)
+    start = datetime.utcnow() - timedelta(seconds=10 * GPS_BATCH_POINTS)
+    return 'POST', '/api/gps', encode_frame(device_id, [
+        (start + timedelta(seconds=10 * i), 45.0 + rng.uniform(-0.5, 0.5), 7.0 + rng.uniform(-0.5, 0.5), rng.uniform(0, 90))
+        for i in range(GPS_BATCH_POINTS)
+    ])
+
+def history(rng, fleet):
+    vehicle_id, _ = rng.choice(fleet)
+    return 'GET', f'/api/vehicles/{vehicle_id}/history?hours=24&limit=10000', None
+
+def history_simplified(rng, fleet):
+    vehicle_id, _ = rng.choice(fleet)
+    return 'GET', f'/api/vehicles/{vehicle_id}/history?hours=24&max_points=2000', None
+
+def stats(rng, fleet):
+    vehicle_id, _ = rng.choice(fleet)
+    return 'GET', f'/api/vehicles/{vehicle_id}/stats?hours={rng.choice([1, 24, 168])}', None
+
+def export(rng, fleet):
+    vehicle_id, _ = rng.choice(fleet)
+    return 'GET', f"/api/vehicles/{vehicle_id}/export?hours=24&format={rng.choice(['json', 'ndjson', 'csv'])}", None
+
+def snapshot(rng, fleet):
+    return 'GET', '/api/fleet/snapshot', None
+
+ENDPOINTS = {
+    'gps': gps,
+    'gps_batch': gps_batch,
+    'gps_frame': gps_frame,
+    'gps_frame_batch': gps_frame_batch,
+    'history': history,
+    'history_simplified': history_simplified,
+    'stats': stats,
+    'export': export,
+    'snapshot': snapshot,
+}
+
+# Relative weights of each endpoint
+SCENARIOS = {
+    'mixed': {'gps': 50, 'gps_batch': 5, 'history': 10, 'history_simplified': 10, 'stats': 10, 'export': 5, 'snapshot': 10},
+    'ingest': {'gps': 90, 'gps_batch': 10},
+    'ingest_frames': {'gps_frame': 90, 'gps_frame_batch': 10},
+    'read': {'history': 25, 'history_simplified': 25, 'stats': 25, 'export': 10, 'snapshot': 15},
+}
+
+class InProcessClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        if isinstance(body, bytes):
+            response = self.client.open(path, method=method, data=body, content_type=FRAME_MIMETYPE)
+        else:
+            response = self.client.open(path, method=method, json=body)
+        size = len(response.get_data())
+        response.close()
+        return response.status_code, size
+
+class HttpClient:
+    def __init__(self, base_url, timeout=60):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def request(self, method, path, body=None):
+        if isinstance(body, bytes):
+            data, content_type = body, FRAME_MIMETYPE
+        else:
+            data, content_type = json.dumps(body).encode() if body is not None else None, 'application/json'
+        request = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                         headers={'Content-Type': content_type})
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                return response.status, len(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, len(e.read())
+
+def run_load(make_client, fleet, scenario='mixed', concurrency=4, duration=30.0, warmup=2.0,
+             username='admin', password='admin123', seed=1):
+    """Run the scenario and return {endpoint: summary}, plus 'total'."""
+    weights = SCENARIOS[scenario]
+    names = list(weights)
+    samples = defaultdict(list)
+    failures = defaultdict(int)
+    sizes = defaultdict(int)
+    lock = threading.Lock()
+    errors = []
+
+    start_at = time.perf_counter() + warmup
+    stop_at = start_at + duration
+
+    def worker(index):
+        try:
+            client = make_client()
+            status, _ = client.request('POST', '/api/auth/login', {'username': username, 'password': password})
+            if status != 200:
+                raise RuntimeError(f'Login failed with HTTP {status}')
+            rng = random.Random(seed * 1000 + index)
+            local = defaultdict(list)
+            local_failures = defaultdict(int)
+            local_sizes = defaultdict(int)
+            while True:
+                name = rng.choices(names, weights=[weights[n] for n in names])[0]
+                method, path, body = ENDPOINTS[name](rng, fleet)
+                began = time.perf_counter()
+                if began >= stop_at:
+                    break
+                status, size = client.request(method, path, body)
+                elapsed = time.perf_counter() - began
+                if began < start_at:
+                    continue  # warm-up
+                local[name].append(elapsed)
+                local_sizes[name] += size
+                if status >= 400:
+                    local_failures[name] += 1
+            with lock:
+                for name, values in local.items():
+                    samples[name].extend(values)
+                    failures[name] += local_failures[name]
+                    sizes[name] += local_sizes[name]
+        except Exception as e:
+            with lock:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,), name=f'bench-{i}') for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+
+    results = {name: summarize(samples[name], failures[name], sizes[name], duration) for name in names if samples[name]}
+    everything = [value for name in names for value in samples[name]]
+    if everything:
+        results['total'] = summarize(everything, sum(failures.values()), sum(sizes.values()), duration)
+    return results
+
+def summarize(latencies, errors, size, duration):
+    values = np.asarray(latencies) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'throughput_rps': round(len(values) / duration, 2),
+        'mean_ms': round(float(values.mean()), 3),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'max_ms': round(float(values.max()), 3),
+        'bytes': size,
+    }
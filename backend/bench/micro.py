@@ -0,0 +1,157 @@
+"""Microbenchmarks for hot functions on the ingest and read paths.
+
+Each benchmark is timed best-of-`repeat` so one-off pauses do not count,
+and reported per call. Inputs are synthetic and built once up front.
+detect_and_save_stops and the ingest parsers need the application context;
+session changes are rolled back.
+"""
+from datetime import datetime, timedelta
+import json
+import random
+import time
+
+from app import fastjson, main
+from app.frames import decode_frames, encode_frame
+from app.export import row_dict, stream_csv, stream_gpx, stream_json, stream_ndjson
+from app.geo import calculate_distance
+from app.models import db, Trip, Vehicle
+from app.trips import serialize_trip
+
+def best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def synthetic_rows(count, seed=1):
+    """(timestamp, latitude, longitude, speed, dwell_until, sample_count) rows, one every 10 seconds."""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    latitude, longitude = 45.0, 7.0
+    rows = []
+    for i in range(count):
+        latitude += rng.gauss(0, 0.0002)
+        longitude += rng.gauss(0, 0.0002)
+        rows.append((start + timedelta(seconds=10 * i), latitude, longitude, rng.uniform(0, 90), None, 1))
+    return rows
+
+def synthetic_trips(count):
+    start = datetime(2024, 1, 1)
+    return [Trip(
+        id=i, vehicle_id=1, start_time=start + timedelta(hours=i), end_time=start + timedelta(hours=i, minutes=35),
+        start_latitude=45.0, start_longitude=7.0, end_latitude=45.1, end_longitude=7.1,
+        start_place='Depot', end_place=None, distance_km=12.3456, max_speed=88.8, avg_speed=41.2,
+        point_count=210, is_open=False
+    ) for i in range(count)]
+
+def drain(chunks):
+    for _ in chunks:
+        pass
+
+def run_micro(size=10000, repeat=5):
+    """Run every benchmark and return {name: {calls, per_call_us, total_ms}}."""
+    rows = synthetic_rows(size)
+    chunks = [rows[i:i + 2000] for i in range(0, len(rows), 2000)]
+    records = [row_dict(row) for row in rows]
+    trips = synthetic_trips(max(size // 10, 1))
+    pairs = [(a[1], a[2], b[1], b[2]) for a, b in zip(rows, rows[1:])]
+    orjson_module = fastjson.orjson
+
+    def stdlib_dumps():
+        fastjson.orjson = None
+        try:
+            fastjson.dumps(records)
+        finally:
+            fastjson.orjson = orjson_module
+
+    benchmarks = [
+        ('calculate_distance', len(pairs), lambda: [calculate_distance(*p) for p in pairs]),
+        ('serialize.row_dict', len(rows), lambda: [row_dict(row) for row in rows]),
+        ('serialize.fastjson_dumps', len(records), lambda: fastjson.dumps(records)),
+        ('serialize.fastjson_dumps_stdlib', len(records), stdlib_dumps),
+        ('serialize.stream_json', len(rows), lambda: drain(stream_json(chunks))),
+        ('serialize.stream_ndjson', len(rows), lambda: drain(stream_ndjson(chunks))),
+        ('serialize.stream_csv', len(rows), lambda: drain(stream_csv(chunks))),
+        ('serialize.stream_gpx', len(rows), lambda: drain(stream_gpx(chunks, 'bench'))),
+        ('serialize.serialize_trip', len(trips), lambda: [serialize_trip(t) for t in trips]),
+    ]
+    if orjson_module is None:
+        benchmarks = [b for b in benchmarks if b[0] != 'serialize.fastjson_dumps_stdlib']
+
+    results = {}
+    for name, calls, func in benchmarks:
+        results[name] = _result(calls, best_time(func, repeat))
+
+    results.update(_ingest_parsing(rows, repeat))
+    calls, seconds = _stop_detection(rows, repeat)
+    results['detect_and_save_stops'] = _result(calls, seconds)
+    return results
+
+def _ingest_parsing(rows, repeat):
+    """Request body to ingest rows: JSON batch points against compact frames of the same points."""
+    device_id = db.session.execute(db.select(Vehicle.device_id).order_by(Vehicle.id).limit(1)).scalar()
+    if device_id is None:
+        raise RuntimeError('No vehicles in the database; run `flask bootstrap` or `python -m bench fleet` first')
+
+    now = datetime.utcnow()
+    start = now - timedelta(seconds=10 * len(rows))
+    points = [(start + timedelta(seconds=10 * i), row[1], row[2], row[3]) for i, row in enumerate(rows)]
+    batches = [points[i:i + main.MAX_BATCH_POINTS] for i in range(0, len(points), main.MAX_BATCH_POINTS)]
+    json_bodies = [fastjson.dumps({'points': [{
+        'device_id': device_id, 'latitude': p[1], 'longitude': p[2], 'speed': p[3], 'timestamp': p[0].isoformat()
+    } for p in batch]}) for batch in batches]
+    frame_bodies = [encode_frame(device_id, batch) for batch in batches]
+
+    def parse_json():
+        for body in json_bodies:
+            [main.parse_gps_point(point, now) for point in json.loads(body)['points']]
+
+    def parse_frames():
+        for body in frame_bodies:
+            for frame_device, frame_points in decode_frames(body, now):
+                vehicle = main.device_registry.get(frame_device)
+                [{'vehicle_id': vehicle.vehicle_id, 'latitude': p[1], 'longitude': p[2], 'speed': p[3], 'timestamp': p[0]}
+                 for p in frame_points]
+
+    try:
+        return {
+            'ingest.parse_json': _result(len(points), best_time(parse_json, repeat)),
+            'ingest.parse_frame': _result(len(points), best_time(parse_frames, repeat)),
+        }
+    finally:
+        db.session.rollback()
+
+def _stop_detection(rows, repeat):
+    """Feed the track through detect_and_save_stops for one vehicle, then roll back."""
+    vehicle_id = db.session.execute(db.select(Vehicle.id).order_by(Vehicle.id).limit(1)).scalar()
+    if vehicle_id is None:
+        raise RuntimeError('No vehicles in the database; run `flask bootstrap` or `python -m bench fleet` first')
+
+    # Recent timestamps with a parked stretch every 20 minutes, so stops are found and saved
+    start = datetime.utcnow() - timedelta(seconds=10 * len(rows))
+    track = []
+    for i, (_, latitude, longitude, _, _, _) in enumerate(rows):
+        if (i // 60) % 2:
+            latitude, longitude = track[-1][1], track[-1][2]
+        track.append((start + timedelta(seconds=10 * i), latitude, longitude))
+
+    def replay():
+        main.stop_detector.invalidate(vehicle_id)
+        try:
+            for timestamp, latitude, longitude in track:
+                main.detect_and_save_stops(vehicle_id, latitude, longitude, timestamp)
+        finally:
+            db.session.rollback()
+            main.stop_detector.invalidate(vehicle_id)
+
+    return len(track), best_time(replay, repeat)
+
+def _result(calls, seconds):
+    return {
+        'calls': calls,
+        'per_call_us': round(seconds / calls * 1e6, 4),
+        'total_ms': round(seconds * 1000, 3),
+    }
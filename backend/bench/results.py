@@ -0,0 +1,112 @@
+"""JSON results format shared by the load and micro benchmarks.
+
+    {
+      "schema": 1,
+      "kind": "load" | "micro",
+      "started_at": "2024-01-01T12:00:00",
+      "environment": {"python": ..., "platform": ..., "cpus": ..., "database": ..., "commit": ..., "orjson": ...},
+      "config": {...command options...},
+      "results": {"<name>": {"<metric>": number, ...}, ...}
+    }
+
+Load results are keyed by endpoint and carry requests, errors, throughput_rps,
+mean_ms, p50_ms, p95_ms, p99_ms, max_ms and bytes. Micro results are keyed
+by benchmark and carry calls, per_call_us and total_ms.
+"""
+from datetime import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+SCHEMA_VERSION = 1
+
+# Metrics compared between runs, and whether a higher value is better
+COMPARED_METRICS = {
+    'throughput_rps': True,
+    'p50_ms': False,
+    'p95_ms': False,
+    'p99_ms': False,
+    'per_call_us': False,
+}
+
+def new_result(kind, config):
+    return {
+        'schema': SCHEMA_VERSION,
+        'kind': kind,
+        'started_at': datetime.utcnow().replace(microsecond=0).isoformat(),
+        'environment': environment(config.get('url')),
+        'config': config,
+        'results': {},
+    }
+
+def environment(url=None):
+    try:
+        import orjson
+    except ImportError:
+        orjson = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'database': url or _database_kind(),
+        'commit': _git_commit(),
+        'orjson': orjson is not None,
+    }
+
+def write(result, path):
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if path in (None, '-'):
+        print(text)
+        return
+    with open(path, 'w') as f:
+        f.write(text + '\n')
+
+def load(path):
+    with open(path) as f:
+        result = json.load(f)
+    if result.get('schema') != SCHEMA_VERSION:
+        raise ValueError(f"{path}: unsupported results schema {result.get('schema')}")
+    return result
+
+def compare(baseline, current):
+    """Lines describing how each shared metric moved from baseline to current."""
+    if baseline['kind'] != current['kind']:
+        raise ValueError(f"Cannot compare {baseline['kind']} results with {current['kind']} results")
+
+    lines = [f"{'':32} {'metric':>14} {'baseline':>12} {'current':>12} {'change':>9}"]
+    for name in sorted(set(baseline['results']) & set(current['results'])):
+        before, after = baseline['results'][name], current['results'][name]
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            if metric not in before or metric not in after:
+                continue
+            change = (after[metric] - before[metric]) / before[metric] * 100 if before[metric] else 0.0
+            better = change > 0 if higher_is_better else change < 0
+            marker = '' if abs(change) < 5 else (' +' if better else ' -')
+            lines.append(f'{name:32} {metric:>14} {before[metric]:12.3f} {after[metric]:12.3f} {change:8.1f}%{marker}')
+    return lines
+
+def _database_kind():
+    url = os.getenv('DATABASE_URL', '')
+    return url.split(':', 1)[0] if url else None
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(__file__),
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def print_table(result, file=sys.stdout):
+    rows = result['results']
+    if result['kind'] == 'load':
+        print(f"{'endpoint':24} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}", file=file)
+        for name, r in rows.items():
+            print(f"{name:24} {r['requests']:9d} {r['errors']:7d} {r['throughput_rps']:9.1f} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f} {r['p99_ms']:9.2f} {r['max_ms']:9.2f}", file=file)
+    else:
+        print(f"{'benchmark':36} {'calls':>9} {'us/call':>11}", file=file)
+        for name, r in rows.items():
+            print(f"{name:36} {r['calls']:9d} {r['per_call_us']:11.3f}", file=file)
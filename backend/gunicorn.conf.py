@@ -0,0 +1,43 @@
+"""Production server settings: `gunicorn --config gunicorn.conf.py app.wsgi:app`.
+
+One worker process per core, each with a pool of threads. Threads cover
+requests that wait on the database, and each open live stream (/api/stream)
+holds one of them; LIVE_STREAMS_PER_WORKER (default half the threads) caps
+those so ingest and API calls always find a free thread. Size DB_POOL_SIZE
+to match GUNICORN_THREADS, and keep workers x (DB_POOL_SIZE +
+DB_MAX_OVERFLOW + 1) under PostgreSQL's max_connections.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY') or 0) or multiprocessing.cpu_count()  # 0: one per core
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+
+# Workers build the app themselves rather than inheriting it from the master:
+# the live event hub and ingest engines are per process, and starting one
+# does no database work. Each batch checks the engines' state against the
+# vehicle's last stored position, so workers pick up each other's writes.
+preload_app = False
+
+timeout = 60
+graceful_timeout = 30  # lets the async ingest queue flush on shutdown
+keepalive = 5
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+# Each worker writes its /api/metrics totals here; the master clears them on
+# start and folds in those of workers that exit, so counters survive restarts.
+os.environ.setdefault('METRICS_DIR', '/tmp/gps-tracker-metrics')
+
+def on_starting(server):
+    from app.metrics import reset_metrics_dir
+    reset_metrics_dir(os.environ['METRICS_DIR'])
+
+def child_exit(server, worker):
+    from app.metrics import retire_worker
+    retire_worker(os.environ['METRICS_DIR'], worker.pid)
+
+accesslog = '-'
+errorlog = '-'
@@ -0,0 +1,102 @@
+"""Compare ORM-object serialization with the column-tuple + fastjson path.
+
+Usage:
+    python tools/bench_serialization.py [rows]
+
+Loads a synthetic history window into an in-memory SQLite database, then
+times the old read path (ORM Location objects, isoformat() per row,
+jsonify) against the current one (column tuples, datetimes left to
+app.fastjson), with orjson and with the standard library fallback. Both
+include the query, so the numbers show what an endpoint pays per window.
+"""
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+os.environ['DATABASE_URL'] = 'sqlite://'
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import numpy as np
+from flask import Flask, jsonify
+
+from app import fastjson
+from app.models import db, Location, Vehicle
+
+def build_app(rows, seed=0):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        db.session.add(Vehicle(id=1, name='Bench', device_id='bench'))
+        db.session.commit()
+        rng = np.random.default_rng(seed)
+        base = datetime(2024, 1, 1)
+        latitudes = (52.37 + np.cumsum(rng.normal(0, 0.0001, rows))).tolist()
+        longitudes = (4.89 + np.cumsum(rng.normal(0, 0.0001, rows))).tolist()
+        speeds = np.abs(rng.normal(30, 20, rows)).tolist()
+        db.session.execute(db.insert(Location), [
+            {'vehicle_id': 1, 'latitude': lat, 'longitude': lon, 'speed': speed,
+             'timestamp': base + timedelta(seconds=i, microseconds=i % 7 * 1000)}
+            for i, (lat, lon, speed) in enumerate(zip(latitudes, longitudes, speeds))
+        ])
+        db.session.commit()
+    return app
+
+def legacy_path():
+    locations = Location.query.filter_by(vehicle_id=1).order_by(Location.timestamp.asc()).all()
+    return jsonify([{
+        'latitude': loc.latitude,
+        'longitude': loc.longitude,
+        'speed': loc.speed,
+        'timestamp': loc.timestamp.isoformat()
+    } for loc in locations]).get_data()
+
+def lean_path():
+    rows = db.session.execute(db.select(
+        Location.latitude, Location.longitude, Location.speed, Location.timestamp
+    ).where(Location.vehicle_id == 1).order_by(Location.timestamp.asc())).all()
+    return fastjson.json_response(fastjson.row_records(rows)).get_data()
+
+def timed(func, repeat=3):
+    best = None
+    for _ in range(repeat):
+        db.session.expunge_all()
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def main(rows):
+    app = build_app(rows)
+    with app.test_request_context():
+        legacy, legacy_seconds = timed(legacy_path)
+        if fastjson.orjson is None:
+            print('orjson is not installed; only the stdlib fallback is measured')
+        lean, lean_seconds = timed(lean_path)
+
+        orjson_module, fastjson.orjson = fastjson.orjson, None
+        try:
+            stdlib, stdlib_seconds = timed(lean_path)
+        finally:
+            fastjson.orjson = orjson_module
+
+    expected = json.loads(legacy)
+    for name, body in (('lean', lean), ('stdlib', stdlib)):
+        if json.loads(body) != expected:
+            print(f'MISMATCH: {name} output differs from the ORM path')
+            return 1
+
+    print(f'{rows} rows')
+    print(f'  ORM + jsonify:        {legacy_seconds * 1000:9.1f} ms')
+    print(f'  columns + stdlib:     {stdlib_seconds * 1000:9.1f} ms  ({legacy_seconds / stdlib_seconds:.1f}x)')
+    if fastjson.orjson is not None:
+        print(f'  columns + orjson:     {lean_seconds * 1000:9.1f} ms  ({legacy_seconds / lean_seconds:.1f}x)')
+    print(f'  response size: {len(lean)} bytes')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000))
@@ -0,0 +1,71 @@
+"""Compare the per-point Python stats loop with the vectorized engine.
+
+Usage:
+    python tools/bench_stats.py [points]
+
+Both implementations run on the same synthetic 1 Hz track held in memory,
+so the numbers measure computation only, not the database read.
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.geo import calculate_distance
+from app.stats import TrackArrays, compute_stats
+
+def synthetic_track(points, seed=0):
+    rng = np.random.default_rng(seed)
+    start = np.datetime64(datetime(2024, 1, 1), 'us')
+    timestamps = start + np.arange(points) * np.timedelta64(1, 's')
+    latitudes = 52.37 + np.cumsum(rng.normal(0, 0.0001, points))
+    longitudes = 4.89 + np.cumsum(rng.normal(0, 0.0001, points))
+    speeds = np.abs(rng.normal(30, 20, points))
+    return TrackArrays(timestamps, latitudes, longitudes, speeds)
+
+def legacy_stats(locations):
+    speeds = [loc[3] for loc in locations]
+    avg_speed = sum(speeds) / len(speeds) if speeds else 0
+    max_speed = max(speeds) if speeds else 0
+
+    total_distance = 0
+    for i in range(1, len(locations)):
+        prev = locations[i-1]
+        curr = locations[i]
+        total_distance += calculate_distance(prev[1], prev[2], curr[1], curr[2])
+
+    return {'avg_speed': round(avg_speed, 2), 'max_speed': round(max_speed, 2), 'distance_km': round(total_distance, 2)}
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def main(points):
+    track = synthetic_track(points)
+    base = datetime(2024, 1, 1)
+    rows = [
+        (base + timedelta(seconds=i), lat, lon, speed)
+        for i, (lat, lon, speed) in enumerate(zip(track.latitudes.tolist(), track.longitudes.tolist(), track.speeds.tolist()))
+    ]
+
+    legacy, legacy_seconds = timed(legacy_stats, rows)
+    vectorized, vectorized_seconds = timed(compute_stats, track)
+
+    for key in legacy:
+        if abs(legacy[key] - vectorized[key]) > 0.01:
+            print(f'MISMATCH {key}: legacy={legacy[key]} vectorized={vectorized[key]}')
+            return 1
+
+    print(f'{points} points')
+    print(f'  python loop: {legacy_seconds * 1000:9.1f} ms')
+    print(f'  numpy:       {vectorized_seconds * 1000:9.1f} ms  ({legacy_seconds / vectorized_seconds:.1f}x)')
+    print(f'  result: {vectorized}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000))
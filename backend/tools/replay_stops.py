@@ -0,0 +1,114 @@
+"""Replay recorded tracks through the legacy and incremental stop detectors.
+
+Usage:
+    python tools/replay_stops.py [track.csv ...]
+
+Tracks use the CSV layout produced by /api/vehicles/<id>/export?format=csv
+(Timestamp, Latitude, Longitude, Speed). Without arguments a synthetic track
+with several parking periods is replayed. Exits non-zero on any mismatch.
+"""
+import csv
+import math
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.geo import calculate_distance
+from app.stops import StopDetector
+
+def legacy_detect(track):
+    """The original query-per-ping algorithm, run against in-memory rows."""
+    stops = []
+    for i, (timestamp, latitude, longitude) in enumerate(track):
+        time_window = timestamp - timedelta(minutes=10)
+        recent_locations = [p for p in track[:i + 1] if p[0] >= time_window]
+
+        if len(recent_locations) < 5:
+            continue
+
+        first_loc = recent_locations[0]
+        distance = calculate_distance(first_loc[1], first_loc[2], latitude, longitude)
+
+        if distance < 0.05 and len(recent_locations) >= 5:
+            time_diff = (timestamp - first_loc[0]).total_seconds() / 60
+
+            if time_diff >= 5:
+                existing_stop = any(s['timestamp'] >= time_window for s in stops)
+
+                if not existing_stop:
+                    stops.append({
+                        'name': 'Auto-detected Stop',
+                        'latitude': latitude,
+                        'longitude': longitude,
+                        'stop_duration_minutes': int(time_diff),
+                        'visit_type': 'auto_detected',
+                        'timestamp': first_loc[0]
+                    })
+    return stops
+
+def incremental_detect(track):
+    detector = StopDetector()
+    stops = []
+    for timestamp, latitude, longitude in track:
+        stop = detector.observe(1, latitude, longitude, timestamp)
+        if stop:
+            stops.append(stop)
+    return stops
+
+def read_track(path):
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        track = [(datetime.fromisoformat(row[0]), float(row[1]), float(row[2])) for row in reader if row]
+    return sorted(track, key=lambda p: p[0])
+
+def synthetic_track(seed=0, hours=12):
+    rng = random.Random(seed)
+    timestamp = datetime(2024, 1, 1, 6, 0)
+    end = timestamp + timedelta(hours=hours)
+    latitude, longitude = 52.37, 4.89
+    track = []
+
+    while timestamp < end:
+        if rng.random() < 0.4:
+            # Parked: small GPS jitter, sometimes with gaps in reporting
+            for _ in range(rng.randint(10, 200)):
+                track.append((timestamp, latitude + rng.gauss(0, 0.00005), longitude + rng.gauss(0, 0.00005)))
+                timestamp += timedelta(seconds=rng.choice([10, 10, 30, 60, 240]))
+        else:
+            heading = rng.uniform(0, 2 * math.pi)
+            for _ in range(rng.randint(20, 300)):
+                step_km = rng.uniform(0, 0.3)
+                latitude += step_km / 111.0 * math.cos(heading)
+                longitude += step_km / (111.0 * math.cos(math.radians(latitude))) * math.sin(heading)
+                heading += rng.gauss(0, 0.2)
+                track.append((timestamp, latitude, longitude))
+                timestamp += timedelta(seconds=rng.choice([5, 10, 10, 30]))
+    return track
+
+def main(paths):
+    tracks = [(path, read_track(path)) for path in paths]
+    if not tracks:
+        tracks = [(f'synthetic-{seed}', synthetic_track(seed)) for seed in range(5)]
+
+    failed = False
+    for name, track in tracks:
+        expected = legacy_detect(track)
+        actual = incremental_detect(track)
+        status = 'OK' if expected == actual else 'MISMATCH'
+        failed = failed or expected != actual
+        print(f'{name}: {len(track)} points, {len(expected)} legacy stops, {len(actual)} incremental stops: {status}')
+
+        if expected != actual:
+            for old, new in zip(expected, actual):
+                if old != new:
+                    print(f'  first difference: legacy={old} incremental={new}')
+                    break
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -44,6 +44,13 @@ else
     exit 1
 fi
 
+# Backup history archive (files are already compressed)
+if [ -d archive ]; then
+    echo "📦 Backing up history archive..."
+    tar -cf $BACKUP_DIR/archive_$DATE.tar archive/
+    echo "✅ History archive backed up"
+fi
+
 # List all backups
 echo ""
 echo "================================================"
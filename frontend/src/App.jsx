@@ -1,10 +1,11 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef, useCallback } from 'react';
 import Map from './components/Map';
 import VehicleList from './components/VehicleList';
 import VehicleHistory from './components/VehicleHistory';
 import VehicleStats from './components/VehicleStats';
 import AdminPanel from './components/AdminPanel';
 import Login from './components/Login';
+import { fetchAllPages } from './fetchAllPages';
 
 // Role permissions checker
 const canAccessAdmin = (userRole) => {
@@ -22,6 +23,8 @@ function App() {
   const [savedLocations, setSavedLocations] = useState([]);
   const [placesOfInterest, setPlacesOfInterest] = useState([]);
   const [historyHours, setHistoryHours] = useState(24);
+  const selectedVehicleIdRef = useRef(null);
+  const poiBoundsRef = useRef(null);
 
   useEffect(() => {
     checkAuth();
@@ -68,29 +71,14 @@ function App() {
 
   const fetchVehicles = async () => {
     try {
-      const response = await fetch('/api/vehicles', {
+      const response = await fetch('/api/fleet/snapshot', {
         credentials: 'include'
       });
-      const vehiclesData = await response.json();
+      const fleet = await response.json();
       
-      const vehiclesWithLocations = await Promise.all(
-        vehiclesData.map(async (vehicle) => {
-          try {
-            const locResponse = await fetch(`/api/vehicles/${vehicle.id}/location`, {
-              credentials: 'include'
-            });
-            if (locResponse.ok) {
-              const location = await locResponse.json();
-              return { ...vehicle, lastLocation: location };
-            }
-          } catch (err) {
-            console.log(`No location for vehicle ${vehicle.id}`);
-          }
-          return vehicle;
-        })
-      );
-      
-      setVehicles(vehiclesWithLocations);
+      setVehicles(fleet.map(({ last_location, ...vehicle }) => (
+        last_location ? { ...vehicle, lastLocation: last_location } : vehicle
+      )));
     } catch (error) {
       console.error('Error fetching vehicles:', error);
     }
@@ -98,7 +86,7 @@ function App() {
 
   const fetchVehicleHistory = async (vehicleId) => {
     try {
-      const response = await fetch(`/api/vehicles/${vehicleId}/history?hours=${historyHours}`, {
+      const response = await fetch(`/api/vehicles/${vehicleId}/history?hours=${historyHours}&max_points=2000`, {
         credentials: 'include'
       });
       const data = await response.json();
@@ -111,11 +99,7 @@ function App() {
 
   const fetchSavedLocations = async (vehicleId) => {
     try {
-      const response = await fetch(`/api/vehicles/${vehicleId}/saved-locations`, {
-        credentials: 'include'
-      });
-      const data = await response.json();
-      setSavedLocations(data);
+      setSavedLocations(await fetchAllPages(`/api/vehicles/${vehicleId}/saved-locations`));
     } catch (error) {
       console.error('Error fetching saved locations:', error);
       setSavedLocations([]);
@@ -123,12 +107,10 @@ function App() {
   };
 
   const fetchPlacesOfInterest = async () => {
+    // Only load the places inside the visible map area
+    const query = poiBoundsRef.current ? `?bbox=${poiBoundsRef.current}` : '';
     try {
-      const response = await fetch('/api/places-of-interest', {
-        credentials: 'include'
-      });
-      const data = await response.json();
-      setPlacesOfInterest(data);
+      setPlacesOfInterest(await fetchAllPages(`/api/places-of-interest${query}`));
     } catch (error) {
       console.error('Error fetching places of interest:', error);
       setPlacesOfInterest([]);
@@ -139,31 +121,83 @@ function App() {
     if (isAuthenticated && activeView === 'tracking') {
       fetchVehicles();
       fetchPlacesOfInterest();
-      const interval = setInterval(() => {
-        fetchVehicles();
-        fetchPlacesOfInterest();
-      }, 5000);
+      const interval = setInterval(fetchPlacesOfInterest, 5000);
       return () => clearInterval(interval);
     }
   }, [isAuthenticated, activeView]);
 
+  // Live position and stop updates pushed by the backend
   useEffect(() => {
+    if (!isAuthenticated || activeView !== 'tracking') {
+      return;
+    }
+
+    let events;
+    let retry;
+    const connect = () => {
+      events = new EventSource('/api/stream', { withCredentials: true });
+
+      events.addEventListener('position', (e) => {
+        const { vehicle_id, ...location } = JSON.parse(e.data);
+        setVehicles((current) => current.map((v) => (
+          v.id === vehicle_id ? { ...v, lastLocation: location } : v
+        )));
+        if (selectedVehicleIdRef.current === vehicle_id) {
+          setVehicleHistory((current) => [...current, location]);
+        }
+      });
+
+      events.addEventListener('stop', (e) => {
+        const { vehicle_id, ...stop } = JSON.parse(e.data);
+        if (selectedVehicleIdRef.current === vehicle_id) {
+          setSavedLocations((current) => [stop, ...current]);
+        }
+      });
+
+      // Missed events could not be replayed; reload everything
+      events.addEventListener('reset', () => {
+        fetchVehicles();
+        if (selectedVehicleIdRef.current) {
+          fetchVehicleHistory(selectedVehicleIdRef.current);
+          fetchSavedLocations(selectedVehicleIdRef.current);
+        }
+      });
+
+      // A busy server answers 503 and EventSource gives up; try again later
+      events.onerror = () => {
+        if (events.readyState === EventSource.CLOSED) {
+          retry = setTimeout(() => {
+            fetchVehicles();
+            connect();
+          }, 10000);
+        }
+      };
+    };
+    connect();
+
+    return () => {
+      clearTimeout(retry);
+      events.close();
+    };
+  }, [isAuthenticated, activeView, historyHours]);
+
+  useEffect(() => {
+    selectedVehicleIdRef.current = selectedVehicle ? selectedVehicle.id : null;
+
     if (selectedVehicle && isAuthenticated) {
       fetchVehicleHistory(selectedVehicle.id);
       fetchSavedLocations(selectedVehicle.id);
-      
-      const interval = setInterval(() => {
-        fetchVehicleHistory(selectedVehicle.id);
-        fetchSavedLocations(selectedVehicle.id);
-      }, 10000);
-      
-      return () => clearInterval(interval);
     } else {
       setVehicleHistory([]);
       setSavedLocations([]);
     }
   }, [selectedVehicle, historyHours, isAuthenticated]);
 
+  const handleViewportChange = useCallback((bbox) => {
+    poiBoundsRef.current = bbox;
+    fetchPlacesOfInterest();
+  }, []);
+
   const handleSelectVehicle = (vehicle) => {
     setSelectedVehicle(vehicle);
   };
@@ -278,6 +312,7 @@ function App() {
               savedLocations={savedLocations}
               placesOfInterest={placesOfInterest}
               onRefreshPOI={fetchPlacesOfInterest}
+              onViewportChange={handleViewportChange}
               currentUserRole={currentUser?.role}
             />
           </main>
@@ -1,4 +1,5 @@
 import React, { useState, useEffect } from 'react';
+import { fetchAllPages } from '../fetchAllPages';
 
 function AdminPanel({ currentUserRole }) {
   const [activeTab, setActiveTab] = useState('users');
@@ -76,9 +77,7 @@ function UserManagement() {
 
   const fetchUsers = async () => {
     try {
-      const response = await fetch('/api/users', { credentials: 'include' });
-      const data = await response.json();
-      setUsers(data);
+      setUsers(await fetchAllPages('/api/users'));
     } catch (error) {
       console.error('Error fetching users:', error);
     }
@@ -348,9 +347,7 @@ function VehicleManagement() {
 
   const fetchVehicles = async () => {
     try {
-      const response = await fetch('/api/vehicles', { credentials: 'include' });
-      const data = await response.json();
-      setVehicles(data);
+      setVehicles(await fetchAllPages('/api/vehicles'));
     } catch (error) {
       console.error('Error fetching vehicles:', error);
     }
@@ -637,9 +634,7 @@ function POIManagement() {
 
   const fetchPlaces = async () => {
     try {
-      const response = await fetch('/api/places-of-interest', { credentials: 'include' });
-      const data = await response.json();
-      setPlaces(data);
+      setPlaces(await fetchAllPages('/api/places-of-interest'));
     } catch (error) {
       console.error('Error fetching places:', error);
     }
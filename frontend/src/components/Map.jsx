@@ -43,7 +43,30 @@ function MapController({ center, zoom }) {
   return null;
 }
 
-function Map({ vehicles, selectedVehicle, vehicleHistory, savedLocations, placesOfInterest, onRefreshPOI, currentUserRole }) {
+function MapViewportWatcher({ onViewportChange }) {
+  const map = useMap();
+  
+  useEffect(() => {
+    if (!onViewportChange) {
+      return;
+    }
+    
+    const handleMove = () => {
+      const bounds = map.getBounds().pad(0.2);
+      onViewportChange([bounds.getWest(), bounds.getSouth(), bounds.getEast(), bounds.getNorth()].join(','));
+    };
+    
+    handleMove();
+    map.on('moveend', handleMove);
+    return () => {
+      map.off('moveend', handleMove);
+    };
+  }, [map, onViewportChange]);
+  
+  return null;
+}
+
+function Map({ vehicles, selectedVehicle, vehicleHistory, savedLocations, placesOfInterest, onRefreshPOI, onViewportChange, currentUserRole }) {
   const [center, setCenter] = useState([5.8520, -55.2038]);
   const [zoom, setZoom] = useState(13);
   const [pinMode, setPinMode] = useState(false);
@@ -227,6 +250,7 @@ function Map({ vehicles, selectedVehicle, vehicleHistory, savedLocations, places
   return (
     <div className="relative h-full w-full">
       <MapContainer center={center} zoom={zoom} className="h-full w-full">
+        <MapViewportWatcher onViewportChange={onViewportChange} />
         <TileLayer
           attribution='&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a> contributors'
           url="https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png"
@@ -84,6 +84,12 @@ function VehicleStats({ vehicleId, historyHours }) {
           >
             CSV
           </button>
+          <button
+            onClick={() => handleExport('gpx')}
+            className="flex-1 px-3 py-2 bg-purple-500 hover:bg-purple-600 text-white rounded text-sm"
+          >
+            GPX
+          </button>
         </div>
       </div>
     </div>
@@ -0,0 +1,18 @@
+// List endpoints return one page at a time and send the cursor of the next
+// page in the X-Next-Cursor header; follow it until the last page.
+export async function fetchAllPages(url) {
+  let items = [];
+  let cursor = null;
+  do {
+    const separator = url.includes('?') ? '&' : '?';
+    const response = await fetch(cursor ? `${url}${separator}cursor=${encodeURIComponent(cursor)}` : url, {
+      credentials: 'include'
+    });
+    if (!response.ok) {
+      throw new Error(`${url} returned ${response.status}`);
+    }
+    items = items.concat(await response.json());
+    cursor = response.headers.get('X-Next-Cursor');
+  } while (cursor);
+  return items;
+}
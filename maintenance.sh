@@ -47,7 +47,8 @@ read -p "Delete location data older than 30 days? (yes/no): " cleanup
 
 if [ "$cleanup" = "yes" ]; then
     echo "Cleaning old data..."
-    docker compose exec -T db psql -U gpsadmin gps_tracker -c "DELETE FROM locations WHERE timestamp < NOW() - INTERVAL '30 days';"
+    # Drops whole monthly partitions, so up to one extra month is kept
+    docker compose exec -T backend python -m flask --app app.wsgi prune-locations --days 30
     docker compose exec -T db psql -U gpsadmin gps_tracker -c "DELETE FROM saved_locations WHERE timestamp < NOW() - INTERVAL '30 days' AND visit_type = 'auto_detected';"
     echo "Cleanup completed!"
 fi
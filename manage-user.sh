@@ -38,7 +38,8 @@ case $option in
         
         docker compose exec backend python -c "
 from app.models import db, User
-from app.main import app, bcrypt
+from app.wsgi import app
+from app.main import bcrypt
 with app.app_context():
     hashed = bcrypt.generate_password_hash('$password').decode('utf-8')
     user = User(username='$username', email='$email', password_hash=hashed, role='$role')
@@ -56,7 +57,7 @@ with app.app_context():
         
         docker compose exec backend python -c "
 from app.models import db, User
-from app.main import app
+from app.wsgi import app
 with app.app_context():
     user = User.query.filter_by(username='$username').first()
     if user:
@@ -76,7 +77,8 @@ with app.app_context():
         
         docker compose exec backend python -c "
 from app.models import db, User
-from app.main import app, bcrypt
+from app.wsgi import app
+from app.main import bcrypt
 with app.app_context():
     user = User.query.filter_by(username='$username').first()
     if user:
@@ -101,7 +103,7 @@ with app.app_context():
         
         docker compose exec backend python -c "
 from app.models import db, User
-from app.main import app
+from app.wsgi import app
 with app.app_context():
     user = User.query.filter_by(username='$username').first()
     if user:
@@ -121,7 +123,7 @@ with app.app_context():
         if [ "$confirm" = "DELETE" ]; then
             docker compose exec backend python -c "
 from app.models import db, User
-from app.main import app
+from app.wsgi import app
 with app.app_context():
     user = User.query.filter_by(username='$username').first()
     if user:
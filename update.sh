@@ -31,6 +31,14 @@ echo ""
 echo "Waiting for services to start..."
 sleep 15
 
+echo ""
+echo "Moving location history into monthly partitions (first run only)..."
+docker compose exec -T backend python -m flask --app app.wsgi partition-locations
+
+echo ""
+echo "Building hourly stats rollups for existing data..."
+docker compose exec -T backend python -m flask --app app.wsgi backfill-rollups
+
 echo ""
 echo "Checking status..."
 docker compose ps